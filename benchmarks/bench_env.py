@@ -0,0 +1,259 @@
+"""Throughput and reset latency of SumoEnv / SumoContinuousEnv.
+
+Runs every combination of env, lane count, obstacle count, episode length
+and worker count, writes the results as JSON and optionally compares them against a
+stored baseline (exit code 1 on a regression).
+
+    python benchmarks/bench_env.py --obstacles 20 500 2000 --workers 1 4
+    python benchmarks/bench_env.py --update-baseline
+    python benchmarks/bench_env.py --compare
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import itertools
+import subprocess
+import multiprocessing as mp
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+sys.path.insert(0, BENCH_DIR)
+
+from scenarios import make_scenario, GENERATED_DIR  # noqa: E402
+
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+
+# Fields identifying a case, used to match results against the baseline
+CASE_KEYS = ("env", "backend", "snapshots", "stream", "lanes", "obstacles", "max_steps", "workers")
+
+# Compared metrics and whether higher is better
+METRICS = {
+    "steps_per_sec": True,
+    "step_ms_p50": False,
+    "reset_ms_p50": False,
+}
+
+
+def _make_env(name, sumo_cfg, max_steps, backend, snapshots, stream):
+    kwargs = dict(sumo_cfg=sumo_cfg, max_steps=max_steps, backend=backend)
+    if stream:
+        kwargs["stream_window"] = stream
+    if snapshots:
+        from snapshots import SnapshotCache
+        kwargs["snapshots"] = SnapshotCache(os.path.join(GENERATED_DIR, "snapshots"))
+    if name == "discrete":
+        from env import SumoEnv
+        return SumoEnv(**kwargs)
+    from env_continuous import SumoContinuousEnv
+    return SumoContinuousEnv(**kwargs)
+
+
+def _policy(name, rng):
+    # "keep" never changes lane so episodes run to max_steps
+    if name == "keep":
+        return lambda: 0
+    return lambda: rng.randint(0, 2)
+
+
+def run_worker(args):
+    """One env in one process: n_episodes episodes, timing each reset and step."""
+    env_name, sumo_cfg, max_steps, backend, snapshots, stream, n_episodes, policy, seed = args
+    env = _make_env(env_name, sumo_cfg, max_steps, backend, snapshots, stream)
+    act = _policy(policy, random.Random(seed))
+    reset_s, step_s = [], []
+    try:
+        for episode in range(n_episodes):
+            t0 = time.perf_counter()
+            env.reset()
+            reset_s.append(time.perf_counter() - t0)
+            if episode == 0:
+                start = time.perf_counter()
+            done = False
+            while not done:
+                action = act()
+                t0 = time.perf_counter()
+                out = env.step(action)
+                step_s.append(time.perf_counter() - t0)
+                # SumoEnv returns (s, r, done), the gym env (s, r, terminated, truncated, info)
+                done = out[2] if len(out) == 3 else out[2] or out[3]
+        # Steady-state time, without the first reset that launches SUMO
+        elapsed = time.perf_counter() - start
+    finally:
+        env.close()
+    return reset_s, step_s, elapsed
+
+
+def _ms_stats(seconds, prefix):
+    ms = np.asarray(seconds) * 1000.0
+    if ms.size == 0:
+        return {f"{prefix}_mean": None, f"{prefix}_p50": None, f"{prefix}_p99": None}
+    return {
+        f"{prefix}_mean": float(ms.mean()),
+        f"{prefix}_p50": float(np.percentile(ms, 50)),
+        f"{prefix}_p99": float(np.percentile(ms, 99)),
+    }
+
+
+def run_case(env_name, backend, snapshots, stream, n_lanes, n_obstacles, max_steps, workers,
+             n_episodes, policy, seed):
+    sumo_cfg = make_scenario(n_obstacles, n_lanes=n_lanes)
+    jobs = [(env_name, sumo_cfg, max_steps, backend, snapshots, stream, n_episodes, policy, seed + w)
+            for w in range(workers)]
+
+    t0 = time.perf_counter()
+    if workers == 1:
+        outputs = [run_worker(jobs[0])]
+    else:
+        with mp.get_context("spawn").Pool(workers) as pool:
+            outputs = pool.map(run_worker, jobs)
+    wall = time.perf_counter() - t0
+
+    # The first reset of each worker launches SUMO, later ones are warm
+    cold = [r[0] for r, _, _ in outputs]
+    warm = [t for r, _, _ in outputs for t in r[1:]]
+    steps = [t for _, s, _ in outputs for t in s]
+    elapsed = max(e for _, _, e in outputs)
+    result = {
+        "env": env_name,
+        "backend": backend,
+        "snapshots": snapshots,
+        "stream": stream,
+        "lanes": n_lanes,
+        "obstacles": n_obstacles,
+        "max_steps": max_steps,
+        "workers": workers,
+        "episodes": n_episodes * workers,
+        "steps": len(steps),
+        "wall_s": wall,
+        # Aggregate over all workers, warm resets included, SUMO launch excluded
+        "steps_per_sec": len(steps) / elapsed,
+        "cold_start_ms": float(np.mean(cold) * 1000.0),
+    }
+    result.update(_ms_stats(steps, "step_ms"))
+    result.update(_ms_stats(warm, "reset_ms"))
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _sumo_version():
+    try:
+        return subprocess.check_output(["sumo", "--version"], text=True).splitlines()[0]
+    except (OSError, subprocess.CalledProcessError, IndexError):
+        return None
+
+
+def _case_key(result):
+    # Results written before a key existed have it off
+    return tuple(result.get(k) for k in CASE_KEYS)
+
+
+def compare(results, baseline, tolerance):
+    """Return the regressions of `results` against `baseline` (both result lists)."""
+    base = {_case_key(r): r for r in baseline}
+    regressions = []
+    print(f"\n{'case':<72}{'metric':<16}{'baseline':>11}{'current':>11}{'change':>9}")
+    for r in results:
+        b = base.get(_case_key(r))
+        if b is None:
+            continue
+        case = " ".join(f"{k}={r.get(k)}" for k in CASE_KEYS[:1] + CASE_KEYS[2:])
+        for metric, higher_is_better in METRICS.items():
+            old, new = b.get(metric), r.get(metric)
+            if not old or new is None:
+                continue
+            change = new / old - 1.0
+            worse = -change if higher_is_better else change
+            flag = "  REGRESSION" if worse > tolerance else ""
+            print(f"{case:<72}{metric:<16}{old:>11.2f}{new:>11.2f}{change:>+9.1%}{flag}")
+            if flag:
+                regressions.append((_case_key(r), metric, old, new))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--envs", nargs="+", default=["discrete", "continuous"],
+                        choices=["discrete", "continuous"])
+    parser.add_argument("--lanes", nargs="+", type=int, default=[2])
+    parser.add_argument("--obstacles", nargs="+", type=int, default=[20, 200, 1000, 5000])
+    parser.add_argument("--max-steps", nargs="+", type=int, default=[200, 1000])
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--episodes", type=int, default=3, help="episodes per worker")
+    parser.add_argument("--policy", choices=["keep", "random"], default="keep")
+    parser.add_argument("--backend", default=None, help="traci or libsumo ($SUMO_BACKEND)")
+    parser.add_argument("--snapshots", action="store_true",
+                        help="reset from cached SUMO states (SnapshotCache)")
+    parser.add_argument("--stream", nargs=2, type=float, default=None, metavar=("LOOKAHEAD", "TRAILING"),
+                        help="insert obstacles LOOKAHEAD m ahead of the ego, remove them TRAILING m behind")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON file (default: results/<time>.json)")
+    parser.add_argument("--compare", action="store_true", help="fail on regression vs the baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed relative slowdown before a regression is reported")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    from utils import resolve_backend
+    backend = resolve_backend(args.backend)
+
+    results = []
+    cases = itertools.product(args.envs, args.lanes, args.obstacles, args.max_steps, args.workers)
+    for env_name, n_lanes, n_obstacles, max_steps, workers in cases:
+        r = run_case(env_name, backend, args.snapshots, args.stream, n_lanes, n_obstacles, max_steps,
+                     workers, args.episodes, args.policy, args.seed)
+        print(f"{env_name:<11} lanes={n_lanes} obstacles={n_obstacles:<6} max_steps={max_steps:<5} workers={workers:<3}"
+              f"{r['steps_per_sec']:>9.1f} steps/s  step p50 {r['step_ms_p50']:.3f} ms  "
+              f"reset p50 {r['reset_ms_p50'] or float('nan'):.1f} ms  cold {r['cold_start_ms']:.0f} ms")
+        results.append(r)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": _git_commit(),
+            "sumo": _sumo_version(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "episodes_per_worker": args.episodes,
+            "policy": args.policy,
+        },
+        "results": results,
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline updated: {args.baseline}")
+
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+            sys.exit(1)
+        print("\nNo regression")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Generated variants of the obstacles scenario with more traffic.
+
+The obstacles keep the layout of src/data/obstacles.rou.xml (one every
+`spacing` metres, cycling over the lanes, all departing at t=0); the E0 edge
+is stretched so that thousands of them fit on it, and widened to n_lanes.
+"""
+import os
+import copy
+import xml.etree.ElementTree as ET
+
+SRC_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "data")
+BASE_NET = os.path.join(SRC_DATA, "obstacles.net.xml")
+GENERATED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "generated")
+
+# Free road after the last obstacle, as in the original 1061 m scenario
+ROAD_MARGIN = 61.08
+LANE_WIDTH = 3.2
+
+
+def _write_net(path, length, n_lanes):
+    tree = ET.parse(BASE_NET)
+    root = tree.getroot()
+    edge = root.find("edge[@id='E0']")
+    template = edge.find("lane")
+    x0, y0 = (float(v) for v in template.get("shape").split()[0].split(","))
+    x_end = x0 + length
+    for lane in list(edge.iter("lane")):
+        edge.remove(lane)
+    for k in range(n_lanes):
+        lane = copy.deepcopy(template)
+        y = y0 + k * LANE_WIDTH
+        lane.set("id", f"E0_{k}")
+        lane.set("index", str(k))
+        lane.set("length", f"{length:.2f}")
+        lane.set("shape", f"{x0:.2f},{y:.2f} {x_end:.2f},{y:.2f}")
+        edge.append(lane)
+
+    # Junction shapes span the edge's full width
+    y_low, y_high = y0 - LANE_WIDTH / 2, y0 + (n_lanes - 0.5) * LANE_WIDTH
+    j0, j1 = root.find("junction[@id='J0']"), root.find("junction[@id='J1']")
+    j0.set("shape", f"{x0:.2f},{y_high:.2f} {x0:.2f},{y_low:.2f}")
+    j1.set("shape", f"{x_end:.2f},{y_low:.2f} {x_end:.2f},{y_high:.2f}")
+    j1.set("incLanes", " ".join(f"E0_{k}" for k in range(n_lanes)))
+    root.find("location").set("convBoundary", f"{x0:.2f},{y_high:.2f},{x_end:.2f},{y_high:.2f}")
+    tree.write(path, encoding="UTF-8", xml_declaration=True)
+
+
+def _write_routes(path, n_obstacles, spacing, n_lanes):
+    lines = ['<routes>',
+             '    <route id="r_0" edges="E0"/>',
+             '    <vType id="obstacle" vClass="passenger"/>']
+    for i in range(n_obstacles):
+        lane = i % n_lanes
+        lines.append(f'    <trip id="t{lane}_{i // n_lanes}" depart="0.00" type="obstacle" '
+                     f'departPos="{spacing * (i + 1):.1f}" departLane="{lane}" from="E0" to="E0"/>')
+    lines.append('</routes>')
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def _write_cfg(path, net_file, route_file):
+    with open(path, "w") as f:
+        f.write('<configuration>\n'
+                '    <input>\n'
+                f'        <net-file value="{os.path.basename(net_file)}"/>\n'
+                f'        <route-files value="{os.path.basename(route_file)}"/>\n'
+                '    </input>\n'
+                '</configuration>\n')
+
+
+def make_scenario(n_obstacles, spacing=50.0, n_lanes=2, out_dir=GENERATED_DIR):
+    """Write (once) and return the absolute path of a .sumocfg with n_obstacles."""
+    os.makedirs(out_dir, exist_ok=True)
+    name = f"obstacles_{n_obstacles}_{spacing:g}"
+    if n_lanes != 2:
+        name += f"_{n_lanes}lanes"
+    cfg = os.path.join(out_dir, name + ".sumocfg")
+    if os.path.exists(cfg):
+        return cfg
+
+    length = spacing * n_obstacles + ROAD_MARGIN
+    net_file = os.path.join(out_dir, name + ".net.xml")
+    route_file = os.path.join(out_dir, name + ".rou.xml")
+    _write_net(net_file, length, n_lanes)
+    _write_routes(route_file, n_obstacles, spacing, n_lanes)
+    # Written last, its presence means the variant is complete
+    _write_cfg(cfg + ".tmp", net_file, route_file)
+    os.replace(cfg + ".tmp", cfg)
+    return cfg
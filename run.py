@@ -1,27 +1,42 @@
-import traci
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from utils import start_sumo, close_sumo, resolve_backend, BACKENDS
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--backend", choices=BACKENDS, default=None,
+                    help="traci or libsumo (default: $SUMO_BACKEND or traci)")
+parser.add_argument("--nogui", action="store_true", help="run without sumo-gui")
+args = parser.parse_args()
+
+gui = not args.nogui
+backend = resolve_backend(args.backend, gui=gui)  # libsumo has no GUI, falls back to traci
+
+cmd = [
+    "sumo-gui" if gui else "sumo", # Start SUMO with the graphical interface
+    "-c","data/obstacles.sumocfg",
+    "--start", "true",
+    "--collision.action", "warn", 
+    "--xml-validation","never",
+    "--log","log",
+]
+if gui:
+    cmd += ["--delay","200"]
+sim = start_sumo(cmd, backend=backend)
 
-traci.start(
-    [
-        "sumo-gui", # Start SUMO with the graphical interface
-        "-c","data/obstacles.sumocfg",
-        "--delay","200",
-        "--start", "true",
-        "--collision.action", "warn", 
-        "--xml-validation","never",
-        "--log","log",
-    ]
-)
 i = 0
 ego_id="vehAgent"
-traci.vehicle.add(ego_id, "r_0", typeID="obstacle", depart=0) 
+sim.vehicle.add(ego_id, "r_0", typeID="obstacle", depart=0) 
 while i < 200:
-    traci.vehicle.setLaneChangeMode(ego_id, 0) # Disable the default lane-changing model for the AV
-    vehicleIDs=list(traci.vehicle.getIDList())
+    sim.vehicle.setLaneChangeMode(ego_id, 0) # Disable the default lane-changing model for the AV
+    vehicleIDs=list(sim.vehicle.getIDList())
     if ego_id in vehicleIDs:
         vehicleIDs.remove(ego_id)
     for veh in vehicleIDs:
-        traci.vehicle.setLaneChangeMode(veh, 0)  # Disable lane-changing for all surrounding vehicle
-        traci.vehicle.setSpeed(veh, 0) # stop all surrounding vehicle 
-    traci.simulationStep() 
+        sim.vehicle.setLaneChangeMode(veh, 0)  # Disable lane-changing for all surrounding vehicle
+        sim.vehicle.setSpeed(veh, 0) # stop all surrounding vehicle 
+    sim.simulationStep() 
     i += 1
-traci.close()
+close_sumo(sim)
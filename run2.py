@@ -1,28 +1,42 @@
-import traci
+import os
+import sys
 import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from utils import start_sumo, close_sumo, resolve_backend, BACKENDS
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--backend", choices=BACKENDS, default=None,
+                    help="traci or libsumo (default: $SUMO_BACKEND or traci)")
+parser.add_argument("--nogui", action="store_true", help="run without sumo-gui")
+args = parser.parse_args()
+
+gui = not args.nogui
+backend = resolve_backend(args.backend, gui=gui)  # libsumo has no GUI, falls back to traci
 
 # -----------------------------
 # Start SUMO with GUI
 # -----------------------------
-traci.start([
-    "sumo-gui",
+sim = start_sumo([
+    "sumo-gui" if gui else "sumo",
     "-c", "data/obstacles.sumocfg",
     "--start", "true",
     "--collision.action", "warn",
     "--xml-validation", "never",
     "--log", "log",
     "--quit-on-end", "false"   # ✅ prevent auto close
-])
+], backend=backend)
 
 ego_id = "vehAgent"
 
 # Step once before adding vehicle
-traci.simulationStep()
+sim.simulationStep()
 
 # -----------------------------
 # Add the autonomous vehicle
 # -----------------------------
-traci.vehicle.add(
+sim.vehicle.add(
     vehID=ego_id,
     routeID="r_0",
     typeID="obstacle",
@@ -31,35 +45,36 @@ traci.vehicle.add(
 )
 
 # Step once so vehicle actually appears
-traci.simulationStep()
+sim.simulationStep()
 
 # Disable automatic lane change for AV
-traci.vehicle.setLaneChangeMode(ego_id, 0)
+sim.vehicle.setLaneChangeMode(ego_id, 0)
 
 # -----------------------------
 # Simulation loop
 # -----------------------------
 for step in range(200):
-    vehicleIDs = traci.vehicle.getIDList()
+    vehicleIDs = sim.vehicle.getIDList()
     
     # Stop all other vehicles
     for veh in vehicleIDs:
         if veh != ego_id:
-            traci.vehicle.setLaneChangeMode(veh, 0)
-            traci.vehicle.setSpeed(veh, 0)
+            sim.vehicle.setLaneChangeMode(veh, 0)
+            sim.vehicle.setSpeed(veh, 0)
     
     # Manual lane change
     if step == 50:
-        traci.vehicle.changeLane(ego_id, 1, 10)
+        sim.vehicle.changeLane(ego_id, 1, 10)
     if step == 100:
-        traci.vehicle.changeLane(ego_id, 0, 10)
+        sim.vehicle.changeLane(ego_id, 0, 10)
     
-    traci.simulationStep()
-    time.sleep(0.1)   # ✅ slow down so you can see it
+    sim.simulationStep()
+    if gui:
+        time.sleep(0.1)   # ✅ slow down so you can see it
     
     # Print status
-    lane_index = traci.vehicle.getLaneIndex(ego_id)
-    speed = traci.vehicle.getSpeed(ego_id)
+    lane_index = sim.vehicle.getLaneIndex(ego_id)
+    speed = sim.vehicle.getSpeed(ego_id)
     print(f"Step {step}: AV lane={lane_index}, speed={speed}")
 
-traci.close()
+close_sumo(sim)
@@ -0,0 +1,455 @@
+"""Actor-learner PPO: SUMO keeps simulating while the learner optimizes.
+
+deep_rl_train.train alternates: the workers collect a rollout, then sit idle
+while PPO runs its epochs, and the learner sits idle during the next
+rollout. Here n_actors processes step their own SumoContinuousEnv with a
+local copy of the policy and write fixed-size segments straight into shared
+memory; the learner trains as soon as it has a batch of segments and
+publishes the new weights, which the actors pick up at their next segment.
+
+    python actor_learner.py --timesteps 100000 --actors 8 --max-staleness 1
+    python cli.py train-ppo --actor-learner --envs 8 --max-staleness 1
+
+Shared memory:
+
+    RolloutRing   n_slots segments of segment_steps transitions (obs, action,
+                  reward, episode start, behaviour log-prob, finished
+                  episode stats, next obs); a slot is handed over by index
+                  through a free and a full queue, only ints are pickled.
+    WeightBoard   the flat policy parameters and their version.
+
+Staleness: every segment carries the version of the weights it was collected
+with, and one more than max_staleness updates behind the learner is dropped
+(its slot recycled); max_staleness=0 is on-policy PPO. The PPO ratio is
+taken against the behaviour log-probs, so the clip also bounds the step away
+from the policy that collected the data; values and advantages come from
+the learner's current critic.
+"""
+import os
+import time
+import queue
+import argparse
+from collections import deque
+import multiprocessing as mp
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+
+MODEL_DIR = "models"
+LOG_DIR = "logs/ppo_lane_change"
+CHECKPOINT_DIR = f"{MODEL_DIR}/checkpoints_actor_learner"
+CHECKPOINT_EVERY = 10_000
+TOTAL_TIMESTEPS = 100_000
+N_ACTORS = int(os.environ.get("N_ENVS", os.cpu_count() or 1))
+SEGMENT_STEPS = 256
+BATCH_SIZE = 64
+# How often a blocked queue read checks for a stop request or a dead actor
+POLL_INTERVAL = 0.5
+
+
+class _SharedArrays:
+    """Named numpy arrays laid out in one SharedMemory block.
+
+    Pickles as the block name and the layout: a child process attaches to
+    the same memory, nothing else is copied.
+    """
+
+    ALIGN = 64
+
+    def __init__(self, fields, name=None):
+        self.fields = fields
+        offsets, size = {}, 0
+        for key, (shape, dtype) in fields.items():
+            offsets[key] = size
+            size += -(-int(np.prod(shape)) * np.dtype(dtype).itemsize // self.ALIGN) * self.ALIGN
+        self.owner = name is None
+        self.shm = SharedMemory(name=name, create=self.owner, size=max(size, 1))
+        self.arrays = {key: np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offsets[key])
+                       for key, (shape, dtype) in fields.items()}
+
+    def __getitem__(self, key):
+        return self.arrays[key]
+
+    def __getstate__(self):
+        return {"fields": self.fields, "name": self.shm.name}
+
+    def __setstate__(self, state):
+        self.__init__(state["fields"], name=state["name"])
+
+    def close(self):
+        self.arrays = {}
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class RolloutRing:
+    """n_slots rollout segments in shared memory, passed around by slot index.
+
+    An actor takes a slot from `free`, writes segment_steps transitions into
+    it and puts the index on `full`; the learner copies the slot out and
+    puts it back on `free`.
+    """
+
+    def __init__(self, ctx, n_slots, segment_steps, obs_dim):
+        self.n_slots = n_slots
+        self.segment_steps = segment_steps
+        n, t = n_slots, segment_steps
+        self.data = _SharedArrays({
+            "obs": ((n, t, obs_dim), np.float32),
+            "actions": ((n, t), np.int64),
+            "rewards": ((n, t), np.float32),
+            "episode_starts": ((n, t), np.float32),
+            "log_probs": ((n, t), np.float32),
+            # Return and length of the episode that ended at step t, else NaN / 0
+            "episode_returns": ((n, t), np.float64),
+            "episode_lengths": ((n, t), np.int64),
+            # Observation after the last step, and whether it starts an episode
+            "next_obs": ((n, obs_dim), np.float32),
+            "next_starts": ((n,), np.float32),
+            "versions": ((n,), np.int64),
+        })
+        self.free = ctx.Queue()
+        self.full = ctx.Queue()
+        for slot in range(n_slots):
+            self.free.put(slot)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def close(self):
+        self.data.close()
+
+
+class WeightBoard:
+    """The learner's latest policy parameters, readable by every actor.
+
+    publish() and fetch() copy the flat float32 vector under the version's
+    lock; fetch() only copies when the version moved.
+    """
+
+    def __init__(self, ctx, n_params):
+        self.data = _SharedArrays({"params": ((n_params,), np.float32)})
+        self.version = ctx.Value("q", 0)
+
+    def publish(self, params):
+        with self.version.get_lock():
+            self.data["params"][:] = params
+            self.version.value += 1
+            return self.version.value
+
+    def fetch(self, known_version, out):
+        """The current version; `out` holds its parameters when it differs from known_version."""
+        if self.version.value == known_version:
+            return known_version
+        with self.version.get_lock():
+            out[:] = self.data["params"]
+            return self.version.value
+
+    def close(self):
+        self.data.close()
+
+
+def _flat_params(policy):
+    import torch
+    return torch.nn.utils.parameters_to_vector(policy.parameters()).detach().cpu().numpy()
+
+
+def _actor(index, ring, board, stop, env_kwargs, policy_class, policy_kwargs, gamma, seed):
+    import torch
+    from env_continuous import SumoContinuousEnv
+
+    # The learner gets the cores the actors leave
+    torch.set_num_threads(1)
+    if seed is not None:
+        torch.manual_seed(seed + index)
+    env = SumoContinuousEnv(**env_kwargs)
+    policy = policy_class(env.observation_space, env.action_space, lambda _: 0.0, **policy_kwargs)
+    policy.set_training_mode(False)
+    params = np.empty(board.data["params"].shape, dtype=np.float32)
+    version = 0
+    segment_steps = ring.segment_steps
+
+    try:
+        obs, _ = env.reset(seed=None if seed is None else seed + index)
+        episode_start, episode_return, episode_length = 1.0, 0.0, 0
+        while not stop.is_set():
+            try:
+                slot = ring.free.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            new_version = board.fetch(version, params)
+            if new_version != version:
+                torch.nn.utils.vector_to_parameters(torch.from_numpy(params), policy.parameters())
+                version = new_version
+
+            for t in range(segment_steps):
+                with torch.no_grad():
+                    action, _, log_prob = policy(torch.as_tensor(obs[None]))
+                action = int(action[0])
+                ring["obs"][slot, t] = obs
+                ring["actions"][slot, t] = action
+                ring["log_probs"][slot, t] = float(log_prob[0])
+                ring["episode_starts"][slot, t] = episode_start
+
+                obs, reward, terminated, truncated, info = env.step(action)
+                episode_return += reward
+                episode_length += 1
+                # After a SUMO crash obs is a zero placeholder, not a final
+                # observation: the episode is cut with nothing to bootstrap from
+                if truncated and not terminated and not info.get("sumo_crash"):
+                    # Bootstrap the cut episode like SB3's collect_rollouts
+                    with torch.no_grad():
+                        reward += gamma * float(policy.predict_values(torch.as_tensor(obs[None]))[0])
+                ring["rewards"][slot, t] = reward
+                done = terminated or truncated
+                ring["episode_returns"][slot, t] = episode_return if done else np.nan
+                ring["episode_lengths"][slot, t] = episode_length if done else 0
+                if done:
+                    obs, _ = env.reset()
+                    episode_return, episode_length = 0.0, 0
+                episode_start = float(done)
+
+            ring["next_obs"][slot] = obs
+            ring["next_starts"][slot] = episode_start
+            ring["versions"][slot] = version
+            ring.full.put(slot)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        env.close()
+        ring.data.close()
+        board.data.close()
+
+
+class ActorLearner:
+    """Runs the actors and turns their segments into PPO updates of `model`.
+
+    `model` is a PPO whose rollout buffer holds segments_per_update segments
+    (n_envs) of segment_steps transitions (n_steps); see build_model().
+    """
+
+    def __init__(self, model, n_actors, max_staleness=1, env_kwargs=None, seed=None,
+                 start_method="forkserver"):
+        self.model = model
+        self.max_staleness = max_staleness
+        self.segment_steps = model.n_steps
+        self.segments_per_update = model.n_envs
+        ctx = mp.get_context(start_method)
+        obs_dim = model.observation_space.shape[0]
+        # Enough for a full batch plus every actor writing one segment ahead
+        self.ring = RolloutRing(ctx, self.segments_per_update + 2 * n_actors, self.segment_steps, obs_dim)
+        self.board = WeightBoard(ctx, _flat_params(model.policy).size)
+        self.version = self.board.publish(_flat_params(model.policy))
+        self.stop = ctx.Event()
+        self.actors = [
+            ctx.Process(target=_actor, daemon=True, name=f"actor-{i}",
+                        args=(i, self.ring, self.board, self.stop, env_kwargs or {},
+                              model.policy_class, model.policy_kwargs, model.gamma, seed))
+            for i in range(n_actors)
+        ]
+        for actor in self.actors:
+            actor.start()
+        self.dropped = 0
+        self.episodes = deque(maxlen=100)
+
+    def _next_segment(self):
+        while True:
+            try:
+                return self.ring.full.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                dead = [a.name for a in self.actors if not a.is_alive()]
+                if dead:
+                    raise RuntimeError(f"Actor process(es) {', '.join(dead)} died")
+
+    def collect(self):
+        """Copy the next batch of fresh enough segments into the rollout buffer.
+
+        Returns the staleness (learner version minus segment version) of each.
+        """
+        import torch
+        ring, buffer, policy = self.ring, self.model.rollout_buffer, self.model.policy
+        slots, staleness = [], []
+        while len(slots) < self.segments_per_update:
+            slot = self._next_segment()
+            lag = self.version - int(ring["versions"][slot])
+            if lag > self.max_staleness:
+                self.dropped += 1
+                ring.free.put(slot)
+                continue
+            slots.append(slot)
+            staleness.append(lag)
+
+        # Buffer layout is (n_steps, n_envs, ...): one column per segment
+        index = np.array(slots)
+        buffer.reset()
+        buffer.observations[:] = ring["obs"][index].swapaxes(0, 1)
+        buffer.actions[:] = ring["actions"][index].T[..., None]
+        buffer.rewards[:] = ring["rewards"][index].T
+        buffer.episode_starts[:] = ring["episode_starts"][index].T
+        buffer.log_probs[:] = ring["log_probs"][index].T
+        next_obs = ring["next_obs"][index]
+        next_starts = ring["next_starts"][index]
+        returns = ring["episode_returns"][index]
+        lengths = ring["episode_lengths"][index]
+        for slot in slots:
+            ring.free.put(slot)
+
+        ended = ~np.isnan(returns)
+        self.episodes.extend(zip(returns[ended], lengths[ended]))
+        with torch.no_grad():
+            values = policy.predict_values(torch.as_tensor(buffer.observations.reshape(
+                -1, buffer.observations.shape[-1]), device=policy.device))
+            last_values = policy.predict_values(torch.as_tensor(next_obs, device=policy.device))
+        buffer.values[:] = values.cpu().numpy().reshape(buffer.values.shape)
+        buffer.compute_returns_and_advantage(last_values=last_values, dones=next_starts)
+        buffer.pos = buffer.buffer_size
+        buffer.full = True
+        return staleness
+
+    def learn(self, total_timesteps, checkpointer=None, checkpoint_every=CHECKPOINT_EVERY):
+        from checkpoints import dumps_sb3_model
+        model = self.model
+        last_save = model.num_timesteps
+        start_steps, t0 = model.num_timesteps, time.perf_counter()
+        while model.num_timesteps < total_timesteps:
+            t_wait = time.perf_counter()
+            staleness = self.collect()
+            wait = time.perf_counter() - t_wait
+            model.num_timesteps += self.segment_steps * self.segments_per_update
+            model._update_current_progress_remaining(model.num_timesteps, total_timesteps)
+
+            t_train = time.perf_counter()
+            model.train()
+            self.version = self.board.publish(_flat_params(model.policy))
+
+            logger = model.logger
+            if self.episodes:
+                logger.record("rollout/ep_rew_mean", float(np.mean([r for r, _ in self.episodes])))
+                logger.record("rollout/ep_len_mean", float(np.mean([n for _, n in self.episodes])))
+            elapsed = time.perf_counter() - t0
+            logger.record("time/fps", int((model.num_timesteps - start_steps) / max(elapsed, 1e-9)))
+            logger.record("time/total_timesteps", model.num_timesteps)
+            logger.record("actor_learner/staleness_mean", float(np.mean(staleness)))
+            logger.record("actor_learner/dropped_segments", self.dropped)
+            # Learner idle time: how long it waited for the actors
+            logger.record("actor_learner/wait_s", wait)
+            logger.record("actor_learner/train_s", time.perf_counter() - t_train)
+            logger.dump(step=model.num_timesteps)
+
+            if checkpointer and model.num_timesteps - last_save >= checkpoint_every:
+                checkpointer.save(model.num_timesteps, dumps_sb3_model(model))
+                last_save = model.num_timesteps
+        if checkpointer and model.num_timesteps > last_save:
+            checkpointer.save(model.num_timesteps, dumps_sb3_model(model))
+        return model
+
+    def close(self):
+        self.stop.set()
+        # Segments in flight are finished and dropped
+        deadline = time.monotonic() + 30
+        for actor in self.actors:
+            while actor.is_alive() and time.monotonic() < deadline:
+                try:
+                    self.ring.full.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            actor.join(timeout=max(deadline - time.monotonic(), 0))
+            if actor.is_alive():
+                actor.terminate()
+                actor.join()
+        self.ring.close()
+        self.board.close()
+
+
+def build_model(observation_space, action_space, segment_steps=SEGMENT_STEPS, segments_per_update=8,
+                tensorboard_log=LOG_DIR, verbose=1, **ppo_kwargs):
+    """A PPO updated on segments_per_update segments of segment_steps transitions.
+
+    No env: SB3 only needs the spaces and the rollout buffer shape.
+    """
+    from stable_baselines3 import PPO
+    model = PPO("MlpPolicy", env=None, n_steps=segment_steps, tensorboard_log=tensorboard_log,
+                verbose=verbose, _init_setup_model=False, **ppo_kwargs)
+    model.observation_space = observation_space
+    model.action_space = action_space
+    model.n_envs = segments_per_update
+    model._setup_model()
+    return model
+
+
+def train(total_timesteps=TOTAL_TIMESTEPS, n_actors=N_ACTORS, max_staleness=1,
+          segment_steps=SEGMENT_STEPS, segments_per_update=None, sumo_cfg="data/obstacles.sumocfg",
+          max_steps=200, learning_rate=3e-4, batch_size=BATCH_SIZE, gamma=0.99, seed=None,
+          checkpoint_dir=CHECKPOINT_DIR, model_path=f"{MODEL_DIR}/ppo_lane_change",
+          tensorboard_log=LOG_DIR, verbose=1, start_method="forkserver"):
+    """Train PPO with n_actors SUMO actor processes, resuming from the newest checkpoint.
+
+    An update uses segments_per_update segments (by default ~2048 steps, as
+    deep_rl_train); checkpoint_dir / model_path / tensorboard_log set to None
+    turn off checkpoints, the final save and TensorBoard.
+    """
+    from stable_baselines3 import PPO
+    from stable_baselines3.common.utils import configure_logger
+    from env_continuous import SumoContinuousEnv
+    from checkpoints import (AsyncCheckpointer, latest_checkpoint, clear_checkpoints, check_zip,
+                             load_sb3_rng_state)
+
+    for directory in (tensorboard_log, model_path and os.path.dirname(model_path)):
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    env_kwargs = {"sumo_cfg": sumo_cfg, "max_steps": max_steps}
+    # Only for the spaces, SUMO is not started
+    spaces_env = SumoContinuousEnv(**env_kwargs)
+
+    latest = latest_checkpoint(checkpoint_dir, check_zip, prefix="ppo", ext="zip") if checkpoint_dir else None
+    if latest is not None:
+        model = PPO.load(latest[0], tensorboard_log=tensorboard_log)
+        # After load, which reseeds them with the model's seed
+        load_sb3_rng_state(latest[0])
+        print(f"Resuming from {latest[0]} ({model.num_timesteps} timesteps)")
+    else:
+        model = build_model(spaces_env.observation_space, spaces_env.action_space,
+                            segment_steps=segment_steps,
+                            segments_per_update=segments_per_update or max(2048 // segment_steps, 1),
+                            tensorboard_log=tensorboard_log, verbose=verbose,
+                            learning_rate=learning_rate, batch_size=batch_size, gamma=gamma, seed=seed)
+    model.set_logger(configure_logger(verbose, tensorboard_log, "PPO_actor_learner", latest is None))
+
+    checkpointer = AsyncCheckpointer(checkpoint_dir, prefix="ppo", ext="zip") if checkpoint_dir else None
+    runner = ActorLearner(model, n_actors, max_staleness=max_staleness, env_kwargs=env_kwargs,
+                          seed=seed, start_method=start_method)
+    try:
+        runner.learn(total_timesteps, checkpointer=checkpointer)
+    finally:
+        runner.close()
+        if checkpointer:
+            checkpointer.close()
+
+    if model_path:
+        model.save(model_path)
+        print("Training finished and model saved.")
+    # A finished run leaves nothing to resume: the next one starts over
+    if checkpoint_dir and model.num_timesteps >= total_timesteps:
+        clear_checkpoints(checkpoint_dir, prefix="ppo", ext="zip")
+    return model
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Actor-learner PPO on SUMO")
+    parser.add_argument("--timesteps", type=int, default=TOTAL_TIMESTEPS)
+    parser.add_argument("--actors", type=int, default=N_ACTORS)
+    parser.add_argument("--max-staleness", type=int, default=1,
+                        help="drop segments collected with weights more updates old than this (0: on-policy)")
+    parser.add_argument("--segment-steps", type=int, default=SEGMENT_STEPS)
+    parser.add_argument("--segments-per-update", type=int, default=None)
+    parser.add_argument("--max-steps", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+    train(total_timesteps=args.timesteps, n_actors=args.actors, max_staleness=args.max_staleness,
+          segment_steps=args.segment_steps, segments_per_update=args.segments_per_update,
+          max_steps=args.max_steps, seed=args.seed)
+
+
+if __name__ == "__main__":
+    # Actor processes re-import this module, so training only starts under the guard
+    main()
@@ -0,0 +1,299 @@
+"""asyncio front end for many SumoContinuousEnv instances.
+
+Each env lives in its own worker process (its own SUMO and TraCI connection,
+so both backends work) and talks to the event loop over a pipe. A call sends
+the command and awaits the reply: on selector event loops the pipe is
+watched with loop.add_reader, elsewhere a thread polls it. Hundreds of envs
+are then served by one thread that only wakes up when a reply is ready.
+
+    async with AsyncEnvPool(64, sumo_cfg="data/obstacles.sumocfg") as pool:
+        obs = await pool.reset_all(seeds=range(64))
+        results = await pool.step_all(actions, timeout=5.0)
+
+A call that times out, whose worker dies (broken pipe, EOF) or whose env
+raises (a TraCI error...) kills the worker and starts a fresh one, which
+needs a reset before the next step; the call raises asyncio.TimeoutError or
+EnvWorkerError. A cancelled call leaves the env where the worker took it;
+its late reply is dropped.
+"""
+import os
+import asyncio
+import itertools
+import multiprocessing as mp
+import numpy as np
+
+# Poll interval of the thread fallback, bounds how late a cancellation is seen
+POLL_INTERVAL = 0.05
+
+
+class EnvWorkerError(RuntimeError):
+    """The worker died or its env raised; the worker was restarted."""
+
+
+class _RemoteError(Exception):
+    # Exception raised by the env in the worker, as "Type: message"
+    pass
+
+
+def _worker(remote, env_fn, env_kwargs):
+    if env_fn is None:
+        from env_continuous import SumoContinuousEnv
+        env = SumoContinuousEnv(**env_kwargs)
+    else:
+        env = env_fn(**env_kwargs)
+    try:
+        while True:
+            seq, cmd, arg = remote.recv()
+            try:
+                if cmd == "reset":
+                    result = env.reset(**arg)
+                elif cmd == "step":
+                    result = env.step(arg)
+                elif cmd == "close":
+                    remote.send((seq, True, None))
+                    break
+                else:
+                    raise ValueError(f"Unknown command '{cmd}'")
+            except Exception as exc:
+                # As text: some TraCI exceptions do not survive pickling
+                remote.send((seq, False, f"{type(exc).__name__}: {exc}"))
+            else:
+                remote.send((seq, True, result))
+    except (KeyboardInterrupt, EOFError):
+        pass
+    finally:
+        env.close()
+        remote.close()
+
+
+class AsyncEnvHandle:
+    """One env in a worker process, driven with `await reset()` / `await step()`.
+
+    The methods return what SumoContinuousEnv returns. One call at a time per
+    handle; concurrency comes from awaiting several handles together.
+    """
+
+    def __init__(self, ctx, env_fn=None, **env_kwargs):
+        self.ctx = ctx
+        self.env_fn = env_fn
+        self.env_kwargs = env_kwargs
+        self.remote = None
+        self.process = None
+        self.restarts = 0
+        self._seq = itertools.count()
+        self._busy = False
+        self._use_reader = True
+        # Respawn running in a thread, awaited by the next call
+        self._respawning = None
+        self._spawn()
+
+    def _spawn(self):
+        self.remote, child = self.ctx.Pipe()
+        self.process = self.ctx.Process(target=_worker, args=(child, self.env_fn, self.env_kwargs),
+                                        daemon=True)
+        self.process.start()
+        child.close()
+
+    def _kill(self):
+        self.remote.close()
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+    def respawn(self):
+        """Replace the worker (and its SUMO) with a fresh one; reset() before step()."""
+        self._kill()
+        self.restarts += 1
+        self._spawn()
+
+    async def _respawn(self):
+        # Joining a stuck worker takes seconds: done in a thread so the loop
+        # keeps serving the other handles. Shielded, a cancelled call does
+        # not leave the handle half replaced; the next call waits for it.
+        self._respawning = asyncio.get_running_loop().run_in_executor(None, self.respawn)
+        await asyncio.shield(self._respawning)
+
+    async def _readable(self):
+        loop = asyncio.get_running_loop()
+        if self._use_reader:
+            fd = self.remote.fileno()
+            ready = loop.create_future()
+            try:
+                loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+            except NotImplementedError:
+                # Proactor loop (Windows): no add_reader
+                self._use_reader = False
+            else:
+                try:
+                    await ready
+                finally:
+                    loop.remove_reader(fd)
+                return
+        await loop.run_in_executor(None, self.remote.poll, POLL_INTERVAL)
+
+    async def _recv(self, seq):
+        while True:
+            if not self.remote.poll():
+                await self._readable()
+                continue
+            reply_seq, ok, payload = self.remote.recv()
+            # Replies of cancelled calls come first, drop them
+            if reply_seq != seq:
+                continue
+            if not ok:
+                raise _RemoteError(payload)
+            return payload
+
+    async def _call(self, cmd, arg, timeout):
+        if self._busy:
+            raise RuntimeError("AsyncEnvHandle runs one call at a time")
+        self._busy = True
+        seq = next(self._seq)
+        try:
+            if self._respawning is not None:
+                await asyncio.shield(self._respawning)
+                self._respawning = None
+            self.remote.send((seq, cmd, arg))
+            return await asyncio.wait_for(self._recv(seq), timeout)
+        except asyncio.TimeoutError:
+            # SUMO is stuck (or far too slow): start over with a new worker
+            await self._respawn()
+            raise
+        except (EOFError, OSError) as exc:
+            # Pipe closed or broken: the worker is gone
+            pid = self.process.pid
+            await self._respawn()
+            raise EnvWorkerError(f"Env worker {pid} died, restarted") from exc
+        except _RemoteError as exc:
+            # The env raised (TraCI error, SUMO gone...): its state is unknown
+            pid = self.process.pid
+            await self._respawn()
+            raise EnvWorkerError(f"Env worker {pid} failed on '{cmd}' ({exc}), restarted") from None
+        finally:
+            self._busy = False
+
+    async def reset(self, seed=None, options=None, timeout=None):
+        return await self._call("reset", {"seed": seed, "options": options}, timeout)
+
+    async def step(self, action, timeout=None):
+        return await self._call("step", action, timeout)
+
+    async def close(self, timeout=5.0):
+        if self.process is None:
+            return
+        try:
+            await self._call("close", None, timeout)
+        except (asyncio.TimeoutError, EnvWorkerError, OSError):
+            pass
+        await asyncio.get_running_loop().run_in_executor(None, self._kill)
+        self.process = None
+
+
+class AsyncEnvPool:
+    """n_envs AsyncEnvHandle with gather-style batch calls.
+
+    reset_all/step_all return one entry per env, in order; with per-env
+    timeouts a failed env gives its exception instead of a result (the env
+    was respawned and needs a reset) and the others are not affected.
+    """
+
+    def __init__(self, n_envs, env_fn=None, start_method="forkserver", **env_kwargs):
+        ctx = mp.get_context(start_method)
+        self.handles = [AsyncEnvHandle(ctx, env_fn, **env_kwargs) for _ in range(n_envs)]
+
+    def __len__(self):
+        return len(self.handles)
+
+    def __getitem__(self, i):
+        return self.handles[i]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def reset_all(self, seeds=None, timeout=None, handles=None):
+        handles = self.handles if handles is None else handles
+        seeds = [None] * len(handles) if seeds is None else list(seeds)
+        return await asyncio.gather(*(h.reset(seed=s, timeout=timeout) for h, s in zip(handles, seeds)),
+                                    return_exceptions=True)
+
+    async def step_all(self, actions, timeout=None, handles=None):
+        handles = self.handles if handles is None else handles
+        return await asyncio.gather(*(h.step(a, timeout=timeout) for h, a in zip(handles, actions)),
+                                    return_exceptions=True)
+
+    async def close(self):
+        await asyncio.gather(*(h.close() for h in self.handles))
+
+
+async def run_episodes(pool, policy, seeds, timeout=None):
+    """Run one episode per seed of `policy` (see policies.py) on the pool.
+
+    Every handle pulls seeds from a shared queue, so short and long episodes
+    interleave freely. Returns (seed, total_reward, episode_length) per seed,
+    in order, or the exception of an episode that failed or timed out.
+    """
+    seeds = list(seeds)
+    todo = asyncio.Queue()
+    for i, seed in enumerate(seeds):
+        todo.put_nowait((i, seed))
+    results = [None] * len(seeds)
+
+    async def drive(handle):
+        while not todo.empty():
+            i, seed = todo.get_nowait()
+            try:
+                obs, _ = await handle.reset(seed=seed, timeout=timeout)
+                total_reward, length, done = 0.0, 0, False
+                while not done:
+                    action = policy.predict(np.asarray(obs)[None])[0]
+                    obs, reward, terminated, truncated, _ = await handle.step(action, timeout=timeout)
+                    total_reward += reward
+                    length += 1
+                    done = terminated or truncated
+                results[i] = (seed, total_reward, length)
+            except (asyncio.TimeoutError, EnvWorkerError) as exc:
+                # The handle was restarted, the next seed resets it
+                results[i] = exc
+
+    await asyncio.gather(*(drive(h) for h in pool.handles))
+    return results
+
+
+def main():
+    import time
+    import argparse
+    parser = argparse.ArgumentParser(description="Concurrent episodes on an asyncio env pool")
+    parser.add_argument("--model", default="models/ppo_lane_change")
+    parser.add_argument("--envs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--episodes", type=int, default=50)
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds per reset/step")
+    parser.add_argument("--max-steps", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from policies import PPOPolicy
+    policy = PPOPolicy(args.model)
+
+    async def serve():
+        async with AsyncEnvPool(args.envs, sumo_cfg="data/obstacles.sumocfg",
+                                max_steps=args.max_steps) as pool:
+            t0 = time.perf_counter()
+            results = await run_episodes(pool, policy, range(args.seed, args.seed + args.episodes),
+                                         timeout=args.timeout)
+            return results, time.perf_counter() - t0, sum(h.restarts for h in pool.handles)
+
+    results, elapsed, restarts = asyncio.run(serve())
+    done = [r for r in results if isinstance(r, tuple)]
+    print(f"{len(done)}/{len(results)} episodes in {elapsed:.1f} s on {args.envs} envs "
+          f"({sum(r[2] for r in done) / elapsed:.1f} steps/s, {restarts} worker restarts) | "
+          f"mean reward {np.mean([r[1] for r in done]):.2f}")
+
+
+if __name__ == "__main__":
+    main()
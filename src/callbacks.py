@@ -0,0 +1,117 @@
+import time
+from stable_baselines3.common.callbacks import BaseCallback
+from profiling import Profiler
+from checkpoints import AsyncCheckpointer, dumps_sb3_model
+from metrics import MetricsWriter, PPO_COLUMNS
+
+
+class ProfilerCallback(BaseCallback):
+    """Learner-side profiling for PPO: action selection, rollout and update time.
+
+    policy.forward is only called by collect_rollouts, so timing it gives the
+    agent's action selection. One summary per rollout goes to the SB3 logger
+    and, as histograms, next to the run's own TensorBoard events.
+    """
+
+    def __init__(self, profiler=None, verbose=0):
+        super().__init__(verbose)
+        self.profiler = profiler or Profiler()
+        self._rollout_end = None
+
+    def _on_training_start(self):
+        if self.profiler.tensorboard_dir is None:
+            self.profiler.tensorboard_dir = self.logger.get_dir()
+        policy = self.model.policy
+        forward = policy.forward
+
+        def timed_forward(*args, **kwargs):
+            with self.profiler.section("action_selection"):
+                return forward(*args, **kwargs)
+
+        policy.forward = timed_forward
+
+    def _on_rollout_start(self):
+        now = time.perf_counter()
+        if self._rollout_end is not None:
+            self.profiler.record("policy_update", now - self._rollout_end)
+        self._rollout_start = now
+
+    def _on_step(self):
+        return True
+
+    def _on_rollout_end(self):
+        self._rollout_end = time.perf_counter()
+        self.profiler.record("rollout", self._rollout_end - self._rollout_start)
+        summary = self.profiler.end_episode()
+        for name, stats in summary.items():
+            self.logger.record(f"profile/{name}_mean_ms", stats["mean_ms"])
+            self.logger.record(f"profile/{name}_total_ms", stats["total_ms"])
+
+    def _on_training_end(self):
+        self.profiler.close()
+
+
+class AsyncCheckpointCallback(BaseCallback):
+    """Saves the model every save_freq timesteps without stalling the rollout.
+
+    The model zip (weights, optimizer state, num_timesteps, RNG states) is
+    built in memory on the training thread, the disk write happens on the
+    checkpointer's thread. Resume with PPO.load(path, env=env),
+    checkpoints.load_sb3_rng_state(path) and learn(..., reset_num_timesteps=False).
+    """
+
+    def __init__(self, directory, save_freq=10_000, keep=3, verbose=0):
+        super().__init__(verbose)
+        self.save_freq = save_freq
+        self.checkpointer = AsyncCheckpointer(directory, keep=keep, prefix="ppo", ext="zip")
+        self._last_save = 0
+
+    def _on_training_start(self):
+        self._last_save = self.num_timesteps
+
+    def _save(self):
+        self.checkpointer.save(self.num_timesteps, dumps_sb3_model(self.model))
+        self._last_save = self.num_timesteps
+        if self.verbose:
+            print(f"Checkpoint queued at {self.num_timesteps} timesteps")
+
+    def _on_step(self):
+        if self.num_timesteps - self._last_save >= self.save_freq:
+            self._save()
+        return True
+
+    def _on_training_end(self):
+        if self.num_timesteps > self._last_save:
+            self._save()
+        self.checkpointer.close()
+
+
+class MetricsCallback(BaseCallback):
+    """One metrics.MetricsWriter row per finished episode of any worker.
+
+    Reads the Monitor "episode" entries of the step infos; on resume the
+    episodes logged after the loaded checkpoint's timesteps are dropped.
+    """
+
+    def __init__(self, directory, verbose=0):
+        super().__init__(verbose)
+        self.directory = directory
+        self.writer = None
+
+    def _on_training_start(self):
+        self.writer = MetricsWriter(self.directory, PPO_COLUMNS)
+        # Resumed from a checkpoint: drop what was logged after it
+        if self.num_timesteps > 0:
+            self.writer.truncate_at("timesteps", self.num_timesteps + 1)
+
+    def _on_step(self):
+        for info in self.locals["infos"]:
+            episode = info.get("episode")
+            if episode is not None:
+                self.writer.append(episode=len(self.writer), reward=episode["r"], length=episode["l"],
+                                   collisions=int(info.get("collision", False)),
+                                   timesteps=self.num_timesteps, wall_time=time.time())
+        return True
+
+    def _on_training_end(self):
+        self.writer.close()
@@ -0,0 +1,184 @@
+import io
+import os
+import re
+import pickle
+import queue
+import random
+import zipfile
+import threading
+import numpy as np
+
+
+class AsyncCheckpointer:
+    """Periodic training checkpoints written by a background thread.
+
+    save(step, data) takes bytes already serialized on the caller's thread
+    (a consistent copy, cheap next to the disk write) and returns at once.
+    The writer thread writes `<prefix>_<step>.<ext>.tmp`, fsyncs it, renames
+    it into place and keeps only the newest `keep` checkpoints, so a crash at
+    any point leaves complete files only.
+    """
+
+    def __init__(self, directory, keep=3, prefix="ckpt", ext="pkl"):
+        self.directory = directory
+        self.keep = keep
+        self.prefix = prefix
+        self.ext = ext
+        self.error = None
+        self._queue = queue.Queue()
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="checkpointer", daemon=True)
+        self._thread.start()
+
+    def path(self, step):
+        return os.path.join(self.directory, f"{self.prefix}_{step:09d}.{self.ext}")
+
+    def checkpoints(self):
+        return list_checkpoints(self.directory, self.prefix, self.ext)
+
+    def save(self, step, data):
+        if self.error is not None:
+            raise RuntimeError("A previous checkpoint write failed") from self.error
+        self._queue.put((step, data))
+
+    def _write(self, step, data):
+        path = self.path(step)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        for old in self.checkpoints()[:-self.keep]:
+            os.remove(old)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            except OSError as exc:
+                # Training goes on; the next save() reports it
+                self.error = exc
+            finally:
+                self._queue.task_done()
+
+    def wait(self):
+        """Block until every queued checkpoint is on disk."""
+        self._queue.join()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise RuntimeError("A checkpoint write failed") from self.error
+
+    def latest(self, load):
+        return latest_checkpoint(self.directory, load, self.prefix, self.ext)
+
+    def clear(self):
+        """Delete every checkpoint once the queued ones are written (the run is complete)."""
+        self.wait()
+        clear_checkpoints(self.directory, self.prefix, self.ext)
+
+
+def list_checkpoints(directory, prefix="ckpt", ext="pkl"):
+    """Paths of the complete checkpoints, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    pattern = re.compile(rf"^{re.escape(prefix)}_(\d+)\.{re.escape(ext)}$")
+    found = []
+    for name in os.listdir(directory):
+        match = pattern.match(name)
+        if match:
+            found.append((int(match.group(1)), os.path.join(directory, name)))
+    return [path for _, path in sorted(found)]
+
+
+def clear_checkpoints(directory, prefix="ckpt", ext="pkl"):
+    """Delete the checkpoints of a run that went to the end.
+
+    A finished run leaves nothing to resume from, so the next one starts
+    over instead of resuming at the end and training for 0 steps.
+    """
+    for path in list_checkpoints(directory, prefix, ext):
+        os.remove(path)
+
+
+def latest_checkpoint(directory, load, prefix="ckpt", ext="pkl"):
+    """(path, load(path)) of the newest checkpoint that loads, or None.
+
+    A checkpoint that fails to load (truncated by a full disk, written by an
+    older version...) is skipped in favour of the previous one.
+    """
+    for path in reversed(list_checkpoints(directory, prefix, ext)):
+        try:
+            return path, load(path)
+        except Exception as exc:
+            print(f"Skipping unreadable checkpoint {path}: {exc!r}")
+    return None
+
+
+def rng_state():
+    return {"random": random.getstate(), "numpy": np.random.get_state()}
+
+
+def set_rng_state(state):
+    random.setstate(state["random"])
+    np.random.set_state(state["numpy"])
+
+
+def dumps_state(state):
+    """Serialize a checkpoint dict (arrays, RNG states, histories) to bytes."""
+    return pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_state(path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+# Member of the checkpoint zips holding the RNG states, ignored by PPO.load
+RNG_MEMBER = "rng_state.pkl"
+
+
+def dumps_sb3_model(model):
+    """An SB3 model zip (policy, optimizer state, counters) as bytes, in memory.
+
+    The python / numpy / torch RNG states are added to the zip, in one file
+    with the weights; restore them with load_sb3_rng_state(path) after
+    PPO.load, which reseeds the generators.
+    """
+    import torch
+    buffer = io.BytesIO()
+    model.save(buffer)
+    state = {**rng_state(), "torch": torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state["torch_cuda"] = torch.cuda.get_rng_state_all()
+    with zipfile.ZipFile(buffer, "a") as archive:
+        archive.writestr(RNG_MEMBER, pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+    return buffer.getvalue()
+
+
+def load_sb3_rng_state(path):
+    """Restore the RNG states of a dumps_sb3_model checkpoint; False if it has none."""
+    import torch
+    with zipfile.ZipFile(path) as archive:
+        if RNG_MEMBER not in archive.namelist():
+            return False
+        state = pickle.loads(archive.read(RNG_MEMBER))
+    set_rng_state(state)
+    torch.set_rng_state(state["torch"])
+    if "torch_cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["torch_cuda"])
+    return True
+
+
+def check_zip(path):
+    with zipfile.ZipFile(path) as archive:
+        bad = archive.testzip()
+    if bad is not None:
+        raise zipfile.BadZipFile(f"Corrupt member {bad}")
+    return path
@@ -0,0 +1,161 @@
+"""Append-only columns stored as chunks of preallocated .npy memmaps.
+
+The storage behind recorder.TransitionWriter and metrics.MetricsWriter. Each
+chunk is a directory of one .npy file per column, created full size with
+open_memmap, so RAM use is bounded by the dirty pages of one chunk. The
+manifest (dtypes, chunk names and valid lengths) is rewritten atomically
+after the data of every flush: after a crash, readers see everything up to
+the last flush and nothing half written. Opening an existing directory
+appends to it.
+
+    directory/
+        manifest.json
+        chunk_000000/<column>.npy ...
+"""
+import os
+import json
+import time
+import shutil
+import numpy as np
+
+MANIFEST = "manifest.json"
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST)) as f:
+        return json.load(f)
+
+
+class ChunkedWriter:
+    """Appends rows of named columns; `columns` maps a name to a dtype or (dtype, row shape).
+
+    Rows become visible to readers at flush(), which happens every
+    flush_every rows or, with flush_interval, every flush_interval seconds,
+    whichever comes first.
+    """
+
+    def __init__(self, directory, columns, chunk_size=65536, flush_every=4096, flush_interval=None):
+        self.directory = directory
+        self.dtypes, self.shapes = {}, {}
+        for name, spec in columns.items():
+            dtype, shape = spec if isinstance(spec, tuple) else (spec, ())
+            self.dtypes[name] = np.dtype(dtype).str
+            self.shapes[name] = tuple(shape)
+        self.chunk_size = chunk_size
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.chunks = []
+        # Chunk names are never reused, even after truncate()
+        self._next_chunk = 0
+        self._arrays = None
+        self._row = 0
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+
+        if os.path.exists(os.path.join(directory, MANIFEST)):
+            manifest = read_manifest(directory)
+            if manifest["dtypes"] != self.dtypes:
+                raise ValueError(f"{directory} holds columns {manifest['dtypes']}, not {self.dtypes}")
+            shapes = self._stored_shapes(manifest)
+            if shapes != self.shapes:
+                raise ValueError(f"{directory} holds rows of shapes {shapes}, not {self.shapes}")
+            self.chunks = manifest["chunks"]
+            self.chunk_size = manifest["chunk_size"]
+            self._next_chunk = manifest.get("next_chunk", len(self.chunks))
+        if self.chunks and self.chunks[-1]["length"] < self.chunk_size:
+            # Continue the last chunk after the rows the manifest vouches for
+            self._open_chunk(self.chunks[-1]["name"], mode="r+")
+            self._row = self.chunks[-1]["length"]
+        else:
+            self._new_chunk()
+
+    def _stored_shapes(self, manifest):
+        if "shapes" in manifest:
+            return {column: tuple(shape) for column, shape in manifest["shapes"].items()}
+        # Older manifests: from the .npy headers of the first chunk
+        chunk_dir = os.path.join(self.directory, manifest["chunks"][0]["name"])
+        return {column: np.load(os.path.join(chunk_dir, column + ".npy"), mmap_mode="r").shape[1:]
+                for column in manifest["dtypes"]}
+
+    def _open_chunk(self, name, mode):
+        chunk_dir = os.path.join(self.directory, name)
+        os.makedirs(chunk_dir, exist_ok=True)
+        self._arrays = {}
+        for column, dtype in self.dtypes.items():
+            path = os.path.join(chunk_dir, column + ".npy")
+            if mode == "w+":
+                self._arrays[column] = np.lib.format.open_memmap(
+                    path, mode="w+", dtype=dtype, shape=(self.chunk_size,) + self.shapes[column])
+            else:
+                self._arrays[column] = np.load(path, mmap_mode="r+")
+
+    def _new_chunk(self):
+        name = f"chunk_{self._next_chunk:06d}"
+        self._next_chunk += 1
+        self._open_chunk(name, mode="w+")
+        self.chunks.append({"name": name, "length": 0})
+        self._row = 0
+
+    def append(self, **row):
+        """One row; columns left out stay 0."""
+        if self._row == self.chunk_size:
+            self.flush()
+            self._new_chunk()
+        for column, value in row.items():
+            self._arrays[column][self._row] = value
+        self._row += 1
+        self._unflushed += 1
+        if self._unflushed >= self.flush_every or (
+                self.flush_interval is not None
+                and time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def manifest(self):
+        return {
+            "columns": list(self.dtypes),
+            "dtypes": self.dtypes,
+            "shapes": {column: list(shape) for column, shape in self.shapes.items()},
+            "chunk_size": self.chunk_size,
+            "chunks": self.chunks,
+            "next_chunk": self._next_chunk,
+        }
+
+    def flush(self):
+        # Data first, then the manifest that makes it visible
+        for array in self._arrays.values():
+            array.flush()
+        self.chunks[-1]["length"] = self._row
+        tmp = os.path.join(self.directory, MANIFEST + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.manifest(), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.directory, MANIFEST))
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+
+    def truncate(self, n_rows):
+        """Keep the first n_rows rows; the chunks past them are deleted."""
+        self.flush()
+        offsets = np.cumsum([0] + [c["length"] for c in self.chunks])
+        k = min(int(np.searchsorted(offsets[1:], n_rows, side="left")), len(self.chunks) - 1)
+        row = int(min(max(n_rows - offsets[k], 0), self.chunks[k]["length"]))
+        dropped = [c["name"] for c in self.chunks[k + 1:]]
+        self.chunks = self.chunks[:k + 1]
+        self._open_chunk(self.chunks[-1]["name"], mode="r+")
+        # Rows appended later may leave columns out: they must read 0 again
+        for array in self._arrays.values():
+            array[row:] = 0
+        self._row = row
+        self.flush()
+        for name in dropped:
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def __len__(self):
+        return sum(c["length"] for c in self.chunks[:-1]) + self._row
+
+    def close(self):
+        if self._arrays is not None:
+            self.flush()
+            self._arrays = None
@@ -0,0 +1,179 @@
+"""Single entry point for the training, evaluation and tooling workflows.
+
+    python cli.py train-q --episodes 500 --plot results/q_learning.png
+    python cli.py train-ppo --timesteps 100000 --envs 8
+    python cli.py train-ppo --actor-learner --envs 8 --max-staleness 1
+    python cli.py evaluate --policy qtable --episodes 50
+    python cli.py convert
+    python cli.py benchmark --obstacles 20 200 --workers 1
+    python cli.py sweep q --param alpha=0.05,0.1,0.2 --workers 8
+    python cli.py replay results/trajectories/episode_000003.npz --gui --start 40
+    python cli.py metrics logs/q_learning/metrics --follow
+
+Only the standard library is imported up front; each subcommand imports
+what it needs (stable_baselines3/torch for PPO, matplotlib only to plot,
+never pandas), so short jobs such as convert start in milliseconds. The
+startup time (CLI plus the subcommand's imports) and run time go to stderr.
+"""
+import os
+import sys
+import time
+import argparse
+import importlib
+
+_T0 = time.perf_counter()
+_import_seconds = 0.0
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_DIR = os.path.join(SRC_DIR, "..", "benchmarks")
+
+
+def _import(name):
+    global _import_seconds
+    t0 = time.perf_counter()
+    try:
+        return importlib.import_module(name)
+    finally:
+        _import_seconds += time.perf_counter() - t0
+
+
+def cmd_train_q(args):
+    q_learning = _import("q_learning")
+    kwargs = {"max_steps": args.max_steps}
+    if args.backend:
+        kwargs["backend"] = args.backend
+    q_table_path = args.q_table
+    if args.distance_edges or args.speed_edges:
+        # Bins for the lanes of the network, built by train() once SumoEnv read it
+        kwargs["distance_edges"] = args.distance_edges
+        kwargs["speed_edges"] = args.speed_edges
+        q_table_path = q_table_path or q_learning.SPARSE_Q_TABLE_PATH
+    if args.pretrain_steps:
+        kwargs["pretrain_steps"] = args.pretrain_steps
+    q_table, rewards, epsilons = q_learning.train(n_episodes=args.episodes,
+                                                  q_table_path=q_table_path or q_learning.Q_TABLE_PATH,
+                                                  history_path=args.history, **kwargs)
+    if args.plot or args.show:
+        q_learning.plot_training(rewards, epsilons, path=args.plot, show=args.show)
+    if args.test_episodes:
+        q_learning.test_visual(q_table, n_episodes=args.test_episodes, record_dir=args.record_test)
+
+
+def cmd_train_ppo(args):
+    if args.actor_learner:
+        _import("actor_learner").train(total_timesteps=args.timesteps, n_actors=args.envs,
+                                       max_staleness=args.max_staleness, max_steps=args.max_steps)
+        return
+    deep_rl_train = _import("deep_rl_train")
+    deep_rl_train.train(total_timesteps=args.timesteps, n_envs=args.envs, max_steps=args.max_steps)
+
+
+def cmd_evaluate(args):
+    _import("evaluate").main(args.argv)
+
+
+def cmd_convert(args):
+    _import("evaluation_result2").convert(args.q_table, args.history, args.q_csv, args.rewards_csv,
+                                         metrics_dir=args.metrics)
+
+
+def cmd_benchmark(args):
+    sys.path.insert(0, BENCH_DIR)
+    _import("bench_env").main(args.argv)
+
+
+def cmd_sweep(args):
+    _import("sweep").main(args.argv)
+
+
+def cmd_replay(args):
+    _import("replay").main(args.argv)
+
+
+def cmd_metrics(args):
+    _import("metrics").main(args.argv)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="SUMO lane-change RL workflows")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("train-q", help="tabular Q-learning on SumoEnv")
+    p.add_argument("--episodes", type=int, default=500)
+    p.add_argument("--max-steps", type=int, default=200)
+    p.add_argument("--backend", default=None, help="traci or libsumo ($SUMO_BACKEND)")
+    p.add_argument("--q-table", default=None,
+                   help="q_table_highway.npy, or q_table_highway.qtable/ with --*-edges")
+    p.add_argument("--distance-edges", type=float, nargs="+", default=None,
+                   help="finer distance bins (metres): sparse Q-table over raw features")
+    p.add_argument("--speed-edges", type=float, nargs="+", default=None,
+                   help="also bin the ego speed (m/s): sparse Q-table")
+    p.add_argument("--pretrain-steps", type=int, default=0,
+                   help="pretrain a new dense Q-table for this many batched steps on the NumPy surrogate")
+    p.add_argument("--history", default="src/rewards_history.npy")
+    p.add_argument("--plot", default=None, help="save the training curves to this image (headless)")
+    p.add_argument("--show", action="store_true", help="open the training curves in a window")
+    p.add_argument("--test-episodes", type=int, default=0, help="greedy episodes in sumo-gui afterwards")
+    p.add_argument("--record-test", default=None, metavar="DIR",
+                   help="run the test episodes headless and record them to DIR (see replay.py)")
+    p.set_defaults(func=cmd_train_q)
+
+    p = sub.add_parser("train-ppo", help="PPO on SumoContinuousEnv workers")
+    p.add_argument("--timesteps", type=int, default=100_000)
+    p.add_argument("--envs", type=int, default=int(os.environ.get("N_ENVS", os.cpu_count() or 1)))
+    p.add_argument("--max-steps", type=int, default=200)
+    p.add_argument("--actor-learner", action="store_true",
+                   help="simulate while the learner trains (actor_learner.py), --envs actors")
+    p.add_argument("--max-staleness", type=int, default=1,
+                   help="with --actor-learner: max policy updates behind the learner a segment may be")
+    p.set_defaults(func=cmd_train_ppo)
+
+    # Options of these are parsed by the underlying scripts
+    p = sub.add_parser("evaluate", help="batched parallel evaluation (see evaluate.py --help)",
+                       add_help=False)
+    p.set_defaults(func=cmd_evaluate, passthrough=True)
+
+    p = sub.add_parser("benchmark", help="env throughput benchmark (see bench_env.py --help)",
+                       add_help=False)
+    p.set_defaults(func=cmd_benchmark, passthrough=True)
+
+    p = sub.add_parser("sweep", help="parallel hyperparameter sweep (see sweep.py --help)",
+                       add_help=False)
+    p.set_defaults(func=cmd_sweep, passthrough=True)
+
+    p = sub.add_parser("replay", help="replay recorded trajectories (see replay.py --help)",
+                       add_help=False)
+    p.set_defaults(func=cmd_replay, passthrough=True)
+
+    p = sub.add_parser("metrics", help="summarize, tail or plot a metrics log (see metrics.py --help)",
+                       add_help=False)
+    p.set_defaults(func=cmd_metrics, passthrough=True)
+
+    p = sub.add_parser("convert", help="Q-table and reward history to CSV")
+    p.add_argument("--q-table", default="src/q_table_highway.npy")
+    p.add_argument("--history", default="src/rewards_history.npy")
+    p.add_argument("--q-csv", default="q_table_results.csv")
+    p.add_argument("--rewards-csv", default="rewards_history.csv")
+    p.add_argument("--metrics", default="logs/q_learning/metrics", metavar="DIR",
+                   help="metrics log exported instead of --history when it exists")
+    p.set_defaults(func=cmd_convert)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    args.argv = extra
+    if args.argv and not getattr(args, "passthrough", False):
+        parser.error(f"unrecognized arguments: {' '.join(args.argv)}")
+    t_start = time.perf_counter()
+    try:
+        args.func(args)
+    finally:
+        run = time.perf_counter() - t_start - _import_seconds
+        startup = t_start - _T0 + _import_seconds
+        print(f"[{args.command}] startup {startup * 1000:.1f} ms "
+              f"(imports {_import_seconds * 1000:.1f} ms), run {run:.2f} s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,101 @@
 import os
 from stable_baselines3 import PPO
-from stable_baselines3.common.monitor import Monitor
-from stable_baselines3.common.vec_env import DummyVecEnv
-from env_continuous import SumoContinuousEnv
+from vec_env import make_sumo_vec_env
+from callbacks import ProfilerCallback, AsyncCheckpointCallback, MetricsCallback
+from checkpoints import latest_checkpoint, clear_checkpoints, check_zip, load_sb3_rng_state
 
 LOG_DIR = "logs/ppo_lane_change"
 MODEL_DIR = "models"
+# Written in the background every CHECKPOINT_EVERY timesteps, the newest
+# valid one is resumed from when an interrupted run restarts; a run that
+# reaches total_timesteps deletes them
+CHECKPOINT_DIR = f"{MODEL_DIR}/checkpoints"
+CHECKPOINT_EVERY = 10_000
+TOTAL_TIMESTEPS = 100_000
 
-os.makedirs(LOG_DIR, exist_ok=True)
-os.makedirs(MODEL_DIR, exist_ok=True)
+# One SUMO worker process per core
+N_ENVS = int(os.environ.get("N_ENVS", os.cpu_count() or 1))
+BATCH_SIZE = 64
 
+# PROFILE=1 records env/TraCI timings per episode and learner timings per rollout
+PROFILE = os.environ.get("PROFILE") == "1"
+# RECORD_DIR=<dir> keeps every transition on disk (recorder.TransitionDataset)
+RECORD_DIR = os.environ.get("RECORD_DIR")
+# One row per episode, read live or in slices with metrics.MetricsLog
+METRICS_DIR = f"{LOG_DIR}/metrics"
 
-def make_env():
-    env = SumoContinuousEnv(
-        sumo_cfg="data/obstacles.sumocfg",
-        max_steps=200
-    )
-    env = Monitor(env)   # REQUIRED for episode rewards
-    return env
 
+def train(total_timesteps=TOTAL_TIMESTEPS, n_envs=N_ENVS, profile=PROFILE, record_dir=RECORD_DIR,
+          sumo_cfg="data/obstacles.sumocfg", max_steps=200, learning_rate=3e-4, n_steps=None,
+          batch_size=BATCH_SIZE, gamma=0.99, seed=None, checkpoint_dir=CHECKPOINT_DIR,
+          model_path=f"{MODEL_DIR}/ppo_lane_change", tensorboard_log=LOG_DIR, callbacks=(),
+          verbose=1, metrics_dir=METRICS_DIR):
+    """Train PPO on n_envs SUMO workers, resuming from the newest checkpoint; returns the model.
+
+    checkpoint_dir / model_path / tensorboard_log / metrics_dir set to None
+    turn off checkpoints, the final save, TensorBoard and the metrics log
+    (e.g. for sweep trials). Profiles are TensorBoard events written under
+    tensorboard_log, so profiling is off without it.
+    """
+    for directory in (tensorboard_log, model_path and os.path.dirname(model_path)):
+        if directory:
+            os.makedirs(directory, exist_ok=True)
 
-env = DummyVecEnv([make_env])
+    profile = profile and tensorboard_log is not None
+    # By default the rollout stays ~2048 steps in total whatever the worker count
+    n_steps = n_steps or max(2048 // n_envs, batch_size)
+    env = make_sumo_vec_env(
+        n_envs=n_envs,
+        seed=seed,
+        sumo_cfg=sumo_cfg,
+        max_steps=max_steps,
+        profile_dir=os.path.join(tensorboard_log, "profile") if profile else None,
+        record_dir=record_dir
+    )
 
-model = PPO(
-    policy="MlpPolicy",
-    env=env,
-    verbose=1,
-    tensorboard_log=LOG_DIR,
-    learning_rate=3e-4,
-    n_steps=2048,
-    batch_size=64,
-    gamma=0.99
-)
+    latest = latest_checkpoint(checkpoint_dir, check_zip, prefix="ppo", ext="zip") if checkpoint_dir else None
+    if latest is not None:
+        model = PPO.load(latest[0], env=env, tensorboard_log=tensorboard_log)
+        # After load, which reseeds them with the model's seed
+        load_sb3_rng_state(latest[0])
+        if seed is not None:
+            # The workers' SUMO state is not in the checkpoint: new episode
+            # seeds, derived from the resume point so a rerun is the same
+            env.seed(seed + model.num_timesteps)
+        print(f"Resuming from {latest[0]} ({model.num_timesteps} timesteps)")
+    else:
+        model = PPO(
+            policy="MlpPolicy",
+            env=env,
+            verbose=verbose,
+            tensorboard_log=tensorboard_log,
+            learning_rate=learning_rate,
+            n_steps=n_steps,
+            batch_size=batch_size,
+            gamma=gamma,
+            seed=seed
+        )
 
-model.learn(total_timesteps=100_000)
+    callbacks = list(callbacks)
+    if checkpoint_dir:
+        callbacks.append(AsyncCheckpointCallback(checkpoint_dir, save_freq=CHECKPOINT_EVERY))
+    if profile:
+        callbacks.append(ProfilerCallback())
+    if metrics_dir:
+        callbacks.append(MetricsCallback(metrics_dir))
+    model.learn(total_timesteps=max(total_timesteps - model.num_timesteps, 0), callback=callbacks,
+                reset_num_timesteps=latest is None)
 
-model.save(f"{MODEL_DIR}/ppo_lane_change")
+    if model_path:
+        model.save(model_path)
+        print("Training finished and model saved.")
+    # A finished run leaves nothing to resume: the next one starts over
+    if checkpoint_dir and model.num_timesteps >= total_timesteps:
+        clear_checkpoints(checkpoint_dir, prefix="ppo", ext="zip")
+    env.close()
+    return model
 
-env.close()
-print("Training finished and model saved.")
 
+if __name__ == "__main__":
+    # Worker processes re-import this module, so training only starts under the guard
+    train()
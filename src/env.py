@@ -1,128 +1,289 @@
 import os
 import traci
+import numpy as np
 import random
 import time
+from utils import EgoObserver, start_sumo, close_sumo, resolve_backend, n_states
+from scenario import cached_scenario, route_metadata
+from profiling import NULL_PROFILER
+from snapshots import SNAPSHOT_ARGS, Snapshot
+from streaming import ObstacleStream
 
 class SumoEnv:
-    def __init__(self, sumo_cfg=None, max_steps=200, use_gui=False):
+    # Nom de l'action i : 1 = LEFT (voie + 1), 2 = RIGHT (voie - 1)
+    action_names = ("keep", "left", "right")
+
+    def __init__(self, sumo_cfg=None, max_steps=200, use_gui=False, warm_reset=True,
+                 backend=None, profiler=None, snapshots=None, frame_skip=1, step_length=1.0,
+                 lane_change_duration=1.0, stream_window=None, observation="bins"):
         base_dir = os.path.dirname(os.path.abspath(__file__))
-        # Correction du chemin pour pointer vers src/data/
-        self.sumo_cfg = os.path.join(base_dir, "data", "obstacles.sumocfg")
+        # Chemin relatif à src/ (par défaut src/data/obstacles.sumocfg), ou absolu
+        self.sumo_cfg = os.path.join(base_dir, sumo_cfg or os.path.join("data", "obstacles.sumocfg"))
+        # max_steps compte des pas de simulation : un épisode dure
+        # max_steps * step_length secondes quel que soit frame_skip
         self.max_steps = max_steps
+        # Une décision de l'agent = frame_skip pas SUMO de step_length secondes
+        self.frame_skip = frame_skip
+        self.step_length = step_length
+        # Durée (s) pendant laquelle la demande changeLane est maintenue
+        self.lane_change_duration = lane_change_duration
+        # (voie cible, pas où la demande expire) : pas dans l'état SUMO sauvegardé
+        self._lane_request = None
         self.ego_id = "vehAgent"
         self.step_count = 0
+        # L'épisode s'est terminé par une collision (pas par la fin de la route ni un plantage de SUMO)
+        self.collision = False
         self.dist_bins = [5, 15, 30]
+        # Voies de l'edge de départ (r_0) lues dans le réseau, via le cache
+        # des scénarios (rien n'est redemandé à SUMO pendant l'épisode)
+        scenario = route_metadata(cached_scenario(self.sumo_cfg))
+        self.n_lanes = scenario["n_lanes"]
+        self.lane_speeds = scenario["lane_speeds"]
+        # État : [voie, distance leader, distance devant dans chaque autre voie]
+        self.n_states = n_states(self.n_lanes)
+        self.empty_state = [0] + [2] * self.n_lanes
+        # "bins" : l'état discret ci-dessus ; "features" : les valeurs brutes
+        # [voie, distances..., vitesse] à discrétiser soi-même (qtable.Discretizer)
+        if observation not in ("bins", "features"):
+            raise ValueError(f"observation doit être 'bins' ou 'features', pas '{observation}'")
+        self.observation = observation
+        # Observation et reward lus depuis les subscriptions TraCI
+        self.observer = EgoObserver(self.ego_id, horizon=100, n_lanes=self.n_lanes)
         self.use_gui = use_gui  # Ne pas oublier d'assigner ceci !
+        # Warm reset : on recharge le scénario dans le processus SUMO déjà lancé
+        # (traci.load) au lieu de le tuer et le relancer à chaque épisode.
+        self.warm_reset = warm_reset
+        # Connexion TraCI propre à l'instance (plusieurs envs par processus)
+        self.conn = None
+        # "traci" (socket) ou "libsumo" (SUMO dans le processus, sans GUI)
+        self.backend = resolve_backend(backend, gui=use_gui)
+        # Instrumentation optionnelle (profiling.Profiler)
+        self.profiler = profiler or NULL_PROFILER
+        # Cache optionnel (snapshots.SnapshotCache) : état SUMO sauvegardé après
+        # l'insertion de l'ego, restauré aux resets suivants ; snapshot()/restore()
+        self.snapshots = snapshots
+        self.last_reset_time = 0.0
+        self.last_reset_warm = False
+        # Passé à SUMO (--seed) une fois fixé par reset(seed=...)
+        self.sumo_seed = None
+        # (lookahead, trailing) en mètres : les obstacles sont insérés à cette
+        # distance devant l'ego et retirés à cette distance derrière, au lieu
+        # de partir tous à t=0 (streaming.ObstacleStream)
+        self.stream = None
+        if stream_window is not None:
+            self.stream = ObstacleStream(self.sumo_cfg, scenario["edge"], *stream_window)
 
     def discretize_distance(self, dist):
         if dist < self.dist_bins[0]: return 0  # Close
         elif dist < self.dist_bins[1]: return 1 # Medium
         else: return 2 # Far
 
+    def get_features(self):
+        # [voie, distance leader, distance devant dans chaque autre voie, vitesse]
+        obs = self.observer
+        if not obs.alive:
+            return np.array([0.0] + [obs.horizon] * self.n_lanes + [0.0])
+        return np.concatenate(([obs.lane, obs.leader_dist], obs.ahead_in_other_lanes(), [obs.speed]))
+
     def get_state(self):
+        if self.observation == "features":
+            return self.get_features()
         # Sécurité critique : si le véhicule a crashé/disparu
-        if self.ego_id not in traci.vehicle.getIDList():
-            return [0, 2, 2] 
+        if not self.observer.alive:
+            return list(self.empty_state)
 
-        try:
-            lane = traci.vehicle.getLaneIndex(self.ego_id)
-            leader = traci.vehicle.getLeader(self.ego_id, dist=100)
-            dist_current = leader[1] if leader else 100
-            ego_pos = traci.vehicle.getLanePosition(self.ego_id)
-            
-            other_lane = 1 - lane
-            min_dist = 100
-            for veh in traci.vehicle.getIDList():
-                if veh != self.ego_id:
-                    if traci.vehicle.getLaneIndex(veh) == other_lane:
-                        veh_pos = traci.vehicle.getLanePosition(veh)
-                        dist = veh_pos - ego_pos
-                        if 0 < dist < min_dist: min_dist = dist
-            return [lane, self.discretize_distance(dist_current), self.discretize_distance(min_dist)]
-        except:
-            return [0, 2, 2]
+        lane = self.observer.lane
+        dist_current = self.observer.leader_dist
+        others = self.observer.ahead_in_other_lanes()
+        return [lane, self.discretize_distance(dist_current)] + \
+            [self.discretize_distance(d) for d in others]
 
     def compute_reward(self, action, lane_valid, dist_current_idx):
         if not lane_valid: return -10
         
         # Si le véhicule n'est plus là (collision détectée)
-        if self.ego_id not in traci.vehicle.getIDList():
+        if not self.observer.alive:
             return -100
 
-        try:
-            speed = traci.vehicle.getSpeed(self.ego_id)
-            r_step = speed / 13.89 # Normalisé par rapport à 50km/h
-        except:
-            r_step = 0
+        # Normalisé par la vitesse limite de la voie (13.89 m/s = 50 km/h)
+        r_step = self.observer.speed / self.lane_speeds[self.observer.lane]
         
         r_lane_change = -0.5 if action != 0 else 0
         r_collision = -50 if dist_current_idx == 0 else 0 
 
         return r_step + r_lane_change + r_collision
 
-    def reset(self):
-        try:
-            traci.close()
-        except:
-            pass
-        
-        # Attente très courte (Mac est sensible aux ports)
-        time.sleep(0.2)
-
-        sumo_binary = "sumo-gui" if self.use_gui else "sumo"
-        
-        traci.start([
-            sumo_binary, "-c", self.sumo_cfg,
+    def _sumo_args(self):
+        args = [
+            "-c", self.sumo_cfg,
             "--start", "true",
             "--quit-on-end", "true",
             "--no-warnings", "true"
-        ])
-        
+        ]
+        if self.step_length != 1.0:
+            args += ["--step-length", str(self.step_length)]
+        if self.sumo_seed is not None:
+            args += ["--seed", str(self.sumo_seed)]
+        if self.snapshots is not None:
+            args += SNAPSHOT_ARGS
+        if self.stream is not None:
+            args += self.stream.sumo_args()
+        return args
+
+    def _start_sumo(self, load_state=None):
+        # Retourne True si le scénario a été rechargé à chaud
+        args = self._sumo_args()
+        if load_state is not None:
+            args += ["--load-state", load_state]
+        if self.warm_reset and self.conn is not None:
+            try:
+                self.conn.load(args)
+                return True
+            except Exception as e:
+                print(f"Warm reset impossible, relance de SUMO: {e}")
+
+        close_sumo(self.conn)
+        sumo_binary = "sumo-gui" if self.use_gui else "sumo"
+        conn = start_sumo([sumo_binary] + args, label_prefix=self.ego_id,
+                          backend=self.backend)
+        self.conn = self.profiler.wrap(conn)
+        return False
+
+    def reset(self, seed=None):
+        self.profiler.end_episode()
+        t0 = time.perf_counter()
+        # Sans seed, SUMO garde la précédente (ou sa graine par défaut)
+        if seed is not None:
+            self.sumo_seed = seed
         self.step_count = 0
-        traci.simulationStep()
+        self._lane_request = None
+        self.observer.alive = False
+        self.collision = False
+
+        # État sauvegardé lors d'un reset précédent, s'il existe
+        key = state = None
+        if self.snapshots is not None:
+            tag = f"{type(self).__name__}-dt{self.step_length:g}"
+            if self.stream is not None:
+                tag += f"-{self.stream.tag()}"
+            key = self.snapshots.reset_key(self.sumo_cfg, self.sumo_seed, tag=tag)
+            state = self.snapshots.get(key)
+
+        with self.profiler.section("sumo_start"):
+            self.last_reset_warm = self._start_sumo(load_state=state)
 
         try:
-            # On utilise un type de véhicule standard si 'obstacle' n'est pas défini
-            traci.vehicle.add(self.ego_id, routeID="r_0")
-            traci.simulationStep()
-            traci.vehicle.setLaneChangeMode(self.ego_id, 0)
+            if state is None:
+                if self.stream is not None:
+                    # Premier tronçon inséré au premier pas, comme le fichier de routes
+                    self.stream.sync(self.conn, 0.0)
+                self.conn.simulationStep()
+                # On utilise un type de véhicule standard si 'obstacle' n'est pas défini
+                self.conn.vehicle.add(self.ego_id, routeID="r_0")
+                self.conn.simulationStep()
+                if key is not None:
+                    self.snapshots.put(key, self.conn.simulation.saveState)
+            # Les réglages TraCI ne font pas partie de l'état SUMO sauvegardé
+            self.conn.vehicle.setLaneChangeMode(self.ego_id, 0)
+            self.observer.subscribe(self.conn)
+            if self.stream is not None and state is not None:
+                self.stream.sync(self.conn, self.observer.lane_pos)
         except Exception as e:
             print(f"Erreur Reset: {e}")
 
-        return self.get_state()
+        state = self.get_state()
+        self.last_reset_time = time.perf_counter() - t0
+        return state
 
     def step(self, action):
         # 1. Vérifier existence
-        if self.ego_id not in traci.vehicle.getIDList():
-            return [0, 2, 2], -100, True
+        if not self.observer.alive:
+            return self.get_state(), -100, True
 
         lane_valid = True
         try:
-            lane = traci.vehicle.getLaneIndex(self.ego_id)
+            lane = self.observer.lane
+            target = None
             if action == 1: # LEFT
-                if lane < 1: traci.vehicle.changeLane(self.ego_id, lane + 1, 1)
+                if lane < self.n_lanes - 1: target = lane + 1
                 else: lane_valid = False
             elif action == 2: # RIGHT
-                if lane > 0: traci.vehicle.changeLane(self.ego_id, lane - 1, 1)
+                if lane > 0: target = lane - 1
                 else: lane_valid = False
+            if target is not None:
+                self.conn.vehicle.changeLane(self.ego_id, target, self.lane_change_duration)
+                self._lane_request = (target, self.step_count +
+                                      round(self.lane_change_duration / self.step_length))
         except:
             lane_valid = False
 
-        traci.simulationStep()
-        self.step_count += 1
-        
-        # 2. Vérifier si encore vivant après le step
-        if self.ego_id not in traci.vehicle.getIDList():
-            return [0, 2, 2], -100, True
+        # frame_skip pas SUMO ; le reward est la somme des pas, les pénalités
+        # de changement de voie ne comptent qu'une fois
+        reward = 0
+        for k in range(self.frame_skip):
+            last = k == self.frame_skip - 1 or self.step_count + 1 >= self.max_steps
+            try:
+                with self.profiler.section("simulation_step"):
+                    self.conn.simulationStep()
+                with self.profiler.section("observation"):
+                    # Entre deux décisions, seules les variables de l'ego sont décodées
+                    alive = self.observer.update(context=last)
+                if alive and self.stream is not None:
+                    with self.profiler.section("stream"):
+                        self.stream.update(self.conn, self.observer.lane_pos)
+            except (traci.exceptions.FatalTraCIError, ConnectionError):
+                # SUMO a planté : fin d'épisode sans pénalité, le prochain reset le relance
+                close_sumo(self.conn)
+                self.conn = None
+                self.observer.alive = False
+                return self.get_state(), reward, True
+            self.step_count += 1
 
-        next_state = self.get_state()
-        reward = self.compute_reward(action, lane_valid, next_state[1])
+            # 2. Vérifier si encore vivant après le step (collision pendant le saut détectée)
+            if not alive:
+                # Disparu : collision, ou fin de la route atteinte (même pénalité)
+                self.collision = self.ego_id in self.conn.simulation.getCollidingVehiclesIDList()
+                return self.get_state(), reward - 100, True
+
+            with self.profiler.section("reward"):
+                dist_current_idx = self.discretize_distance(self.observer.leader_dist)
+                if k == 0:
+                    reward += self.compute_reward(action, lane_valid, dist_current_idx)
+                else:
+                    reward += self.compute_reward(0, True, dist_current_idx)
+            if last:
+                break
+
+        with self.profiler.section("observation"):
+            next_state = self.get_state()
         done = self.step_count >= self.max_steps
         
         return next_state, reward, done
 
+    def snapshot(self):
+        # Sauvegarde l'état courant ; restore() y revient autant de fois que voulu
+        if self.snapshots is None:
+            raise RuntimeError("snapshot() nécessite SumoEnv(snapshots=SnapshotCache())")
+        path = self.snapshots.put(self.snapshots.branch_key(), self.conn.simulation.saveState)
+        return Snapshot(path, self.step_count, self._lane_request)
+
+    def restore(self, snapshot):
+        if not os.path.exists(snapshot.path):
+            raise FileNotFoundError(f"Snapshot {snapshot.path} supprimé du cache")
+        self._start_sumo(load_state=snapshot.path)
+        self.step_count = snapshot.step_count
+        self._lane_request = snapshot.lane_request
+        self.collision = False
+        self.conn.vehicle.setLaneChangeMode(self.ego_id, 0)
+        if self._lane_request is not None and self._lane_request[1] > self.step_count:
+            lane, until = self._lane_request
+            self.conn.vehicle.changeLane(self.ego_id, lane, (until - self.step_count) * self.step_length)
+        self.observer.subscribe(self.conn)
+        if self.stream is not None:
+            self.stream.sync(self.conn, self.observer.lane_pos)
+        return self.get_state()
+
     def close(self):
-        try:
-            traci.close()
-        except:
-            pass
\ No newline at end of file
+        self.profiler.end_episode()
+        close_sumo(self.conn)
+        self.conn = None
\ No newline at end of file
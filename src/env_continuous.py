@@ -4,25 +4,78 @@ import numpy as np
 import gymnasium as gym
 from gymnasium import spaces
 import random
+import time
+from utils import EgoObserver, start_sumo, close_sumo, resolve_backend, TRACI_ERRORS
+from profiling import NULL_PROFILER
+from snapshots import SNAPSHOT_ARGS, Snapshot
+from scenario import cached_scenario, route_metadata
+from streaming import ObstacleStream
+
+# Raised by traci when the SUMO process died or the socket was closed
+SUMO_CRASH_ERRORS = (traci.exceptions.FatalTraCIError, ConnectionError)
 
 
 class SumoContinuousEnv(gym.Env):
+    # Action i; lane 0 is the rightmost, so 1 (lane - 1) moves right
+    action_names = ("keep", "right", "left")
 
-    def __init__(self, sumo_cfg="data/obstacles.sumocfg", max_steps=200, gui=False):
+    def __init__(self, sumo_cfg="data/obstacles.sumocfg", max_steps=200, gui=False,
+                 warm_reset=True, max_restarts=3, backend=None, profiler=None, snapshots=None,
+                 frame_skip=1, step_length=1.0, lane_change_duration=50.0, stream_window=None):
         super().__init__()
 
         base_dir = os.path.dirname(os.path.abspath(__file__))
         self.sumo_cfg = os.path.join(base_dir, sumo_cfg)
+        # In simulation steps: an episode lasts max_steps * step_length seconds
+        # whatever the frame skip
         self.max_steps = max_steps
+        # One agent decision advances frame_skip SUMO steps of step_length s
+        self.frame_skip = frame_skip
+        self.step_length = step_length
+        # How long (s) a changeLane request is held
+        self.lane_change_duration = lane_change_duration
         self.gui = gui
+        # With warm_reset the SUMO process is kept alive between episodes and
+        # the scenario is reloaded in place with traci.load().
+        self.warm_reset = warm_reset
+        # Own TraCI connection, several envs can live in one process
+        self.conn = None
+        self.max_restarts = max_restarts
+        # "traci" or the in-process "libsumo"; also read from $SUMO_BACKEND
+        self.backend = resolve_backend(backend, gui=gui)
+        # Optional profiling.Profiler; times env sections and every TraCI call
+        self.profiler = profiler or NULL_PROFILER
+        # Optional snapshots.SnapshotCache: resets restore the state saved
+        # after _setup_episode, and snapshot()/restore() branch mid-episode
+        self.snapshots = snapshots
+        # Passed to SUMO as --seed once reset(seed=...) sets it
+        self.sumo_seed = None
+        # (target lane, step it expires): TraCI requests are not in SUMO states
+        self._lane_request = None
 
         self.ego_id = "vehAgent"
         self.step_count = 0
-
+        # Lanes of the ego's first edge and the ego's max speed (the reward
+        # normalizer), from the cached net and route files
+        scenario = route_metadata(cached_scenario(self.sumo_cfg))
+        self.edge = scenario["edge"]
+        self.n_lanes = scenario["n_lanes"]
+        self.max_speed = scenario["max_speed"]
+        self.horizon = 100.0
+        self.observer = EgoObserver(self.ego_id, horizon=self.horizon, n_lanes=self.n_lanes)
+        # (lookahead, trailing) in metres: obstacles are inserted when they get
+        # that close ahead of the ego and removed that far behind it, instead
+        # of all departing at t=0 (streaming.ObstacleStream)
+        self.stream = None
+        if stream_window is not None:
+            self.stream = ObstacleStream(self.sumo_cfg, self.edge, *stream_window,
+                                         on_insert=self._apply_obstacle_overrides)
+
+        # [lane, leader distance, distance ahead in every other lane]
         self.action_space = spaces.Discrete(3)
         self.observation_space = spaces.Box(
-            low=np.array([0, 0.0, 0.0], dtype=np.float32),
-            high=np.array([1, 100.0, 100.0], dtype=np.float32),
+            low=np.array([0] + [0.0] * self.n_lanes, dtype=np.float32),
+            high=np.array([self.n_lanes - 1] + [self.horizon] * self.n_lanes, dtype=np.float32),
             dtype=np.float32
         )
 
@@ -31,46 +84,140 @@ class SumoContinuousEnv(gym.Env):
         random.seed(seed)
 
     def _safe_close_traci(self):
-        try:
-            if traci.isLoaded():
-                traci.close()
-        except Exception:
-            pass
+        close_sumo(self.conn)
+        self.conn = None
 
-    def _start_sumo(self):
-        self._safe_close_traci()
-        traci.start([
-            "sumo-gui" if self.gui else "sumo",
+    def _end_episode(self):
+        # Keep the process alive for the next warm reset
+        if not self.warm_reset:
+            self._safe_close_traci()
+
+    def _sumo_args(self):
+        args = [
             "-c", self.sumo_cfg,
             "--start", "true",
             "--collision.action", "remove",
             "--xml-validation", "never",
             "--quit-on-end", "true"
-        ])
+        ]
+        if self.step_length != 1.0:
+            args += ["--step-length", str(self.step_length)]
+        if self.sumo_seed is not None:
+            args += ["--seed", str(self.sumo_seed)]
+        if self.snapshots is not None:
+            args += SNAPSHOT_ARGS
+        if self.stream is not None:
+            args += self.stream.sumo_args()
+        return args
+
+    def _start_sumo(self, load_state=None):
+        # Returns True when the scenario was reloaded in the running process
+        args = self._sumo_args()
+        if load_state is not None:
+            args += ["--load-state", load_state]
+        if self.warm_reset and self.conn is not None:
+            try:
+                self.conn.load(args)
+                return True
+            except TRACI_ERRORS + SUMO_CRASH_ERRORS:
+                pass
 
-    def get_state(self):
-        lane = traci.vehicle.getLaneIndex(self.ego_id)
-
-        leader = traci.vehicle.getLeader(self.ego_id, dist=100)
-        dist_current = leader[1] if leader else 100.0
-
-        ego_pos = traci.vehicle.getLanePosition(self.ego_id)
-        other_lane = 1 - lane
-        min_dist = 100.0
-
-        for veh in traci.vehicle.getIDList():
-            if veh == self.ego_id:
-                continue
-            if traci.vehicle.getLaneIndex(veh) == other_lane:
-                d = traci.vehicle.getLanePosition(veh) - ego_pos
-                if 0 < d < min_dist:
-                    min_dist = d
+        self._safe_close_traci()
+        conn = start_sumo(["sumo-gui" if self.gui else "sumo"] + args,
+                          label_prefix=self.ego_id, backend=self.backend)
+        self.conn = self.profiler.wrap(conn)
+        return False
+
+    @staticmethod
+    def _apply_obstacle_overrides(conn, veh):
+        conn.vehicle.setSpeed(veh, 0)
+        conn.vehicle.setLaneChangeMode(veh, 0)
+
+    def _apply_overrides(self):
+        # Settings made through TraCI, lost when a saved state is loaded
+        conn = self.conn
+        for veh in conn.vehicle.getIDList():
+            if veh != self.ego_id:
+                self._apply_obstacle_overrides(conn, veh)
+
+        conn.vehicle.setLaneChangeMode(self.ego_id, 0)
+        if self._lane_request is not None:
+            lane, until = self._lane_request
+            if until > self.step_count:
+                conn.vehicle.changeLane(self.ego_id, lane, (until - self.step_count) * self.step_length)
+
+    def _setup_episode(self):
+        conn = self.conn
+        if self.stream is not None:
+            # The first window departs in the same step as the ego, and before
+            # it like the route file vehicles
+            self.stream.sync(conn, 0.0)
+        conn.vehicle.add(self.ego_id, "r_0", typeID="obstacle", depart=0)
+        conn.simulationStep()
+        self._apply_overrides()
+        self.observer.subscribe(conn)
+
+    def _subscribe(self):
+        # After a saved state is loaded
+        self.observer.subscribe(self.conn)
+        if self.stream is not None:
+            self.stream.sync(self.conn, self.observer.lane_pos)
+
+    def _reset_snapshot_key(self):
+        tag = f"{type(self).__name__}-dt{self.step_length:g}"
+        if self.stream is not None:
+            tag += f"-{self.stream.tag()}"
+        return self.snapshots.reset_key(self.sumo_cfg, self.sumo_seed, tag)
+
+    def _start_episode(self):
+        # Restore the state saved after a previous setup, or set up and save it
+        if self.snapshots is None:
+            with self.profiler.section("sumo_start"):
+                warm = self._start_sumo()
+            self._setup_episode()
+            return warm
+
+        key = self._reset_snapshot_key()
+        state = self.snapshots.get(key)
+        with self.profiler.section("sumo_start"):
+            warm = self._start_sumo(load_state=state)
+        if state is None:
+            self._setup_episode()
+            self.snapshots.put(key, self.conn.simulation.saveState)
+        else:
+            self._apply_overrides()
+            self._subscribe()
+        return warm
+
+    def snapshot(self):
+        """Save the current simulation state; restore() rewinds to it, any number of times."""
+        if self.snapshots is None:
+            raise RuntimeError("snapshot() needs the env to be created with snapshots=SnapshotCache()")
+        path = self.snapshots.put(self.snapshots.branch_key(), self.conn.simulation.saveState)
+        return Snapshot(path, self.step_count, self._lane_request)
+
+    def restore(self, snapshot):
+        """Continue from a snapshot(); returns the observation at that step."""
+        if not os.path.exists(snapshot.path):
+            raise FileNotFoundError(f"Snapshot {snapshot.path} was evicted from the cache")
+        self._start_sumo(load_state=snapshot.path)
+        self.step_count = snapshot.step_count
+        self._lane_request = snapshot.lane_request
+        self._apply_overrides()
+        self._subscribe()
+        return self.get_state()
 
-        return np.array([lane, dist_current, min_dist], dtype=np.float32)
+    def get_state(self):
+        obs = self.observer
+        state = np.empty(self.observation_space.shape, dtype=np.float32)
+        state[0] = obs.lane
+        state[1] = obs.leader_dist
+        state[2:] = obs.ahead_in_other_lanes()
+        return state
 
     def compute_reward(self, action, lane_valid, dist_current):
-        speed = traci.vehicle.getSpeed(self.ego_id)
-        max_speed = traci.vehicle.getMaxSpeed(self.ego_id)
+        speed = self.observer.speed
+        max_speed = self.max_speed
 
         r_speed = speed / max_speed if max_speed > 0 else 0.0
         r_lane = -0.1 if action in [1, 2] else 0.0
@@ -84,59 +231,100 @@ class SumoContinuousEnv(gym.Env):
     def reset(self, seed=None, options=None):
         super().reset(seed=seed)
         self.seed(seed)
+        if seed is not None:
+            self.sumo_seed = seed
 
         self.step_count = 0
-        self._start_sumo()
-
-        traci.vehicle.add(self.ego_id, "r_0", typeID="obstacle", depart=0)
-        traci.simulationStep()
-
-        for veh in traci.vehicle.getIDList():
-            if veh != self.ego_id:
-                traci.vehicle.setSpeed(veh, 0)
-                traci.vehicle.setLaneChangeMode(veh, 0)
-
-        traci.vehicle.setLaneChangeMode(self.ego_id, 0)
+        self._lane_request = None
+        self.profiler.end_episode()
+        t0 = time.perf_counter()
+        for attempt in range(self.max_restarts + 1):
+            try:
+                warm = self._start_episode()
+                break
+            except SUMO_CRASH_ERRORS:
+                # SUMO died under us: drop the connection and respawn it
+                self._safe_close_traci()
+                if attempt == self.max_restarts:
+                    raise
 
-        return self.get_state(), {}
+        state = self.get_state()
+        info = {"reset_time": time.perf_counter() - t0, "warm_reset": warm}
+        return state, info
 
     def step(self, action):
 
-        if self.ego_id not in traci.vehicle.getIDList():
-            self._safe_close_traci()
+        if not self.observer.alive:
+            self._end_episode()
             state = np.zeros(self.observation_space.shape, dtype=np.float32)
             return state, -20.0, True, False, {}
 
-        lane = traci.vehicle.getLaneIndex(self.ego_id)
+        lane = self.observer.lane
         lane_valid = True
 
+        target = None
         if action == 1 and lane > 0:
-            traci.vehicle.changeLane(self.ego_id, lane - 1, 50)
-        elif action == 2 and lane < 1:
-            traci.vehicle.changeLane(self.ego_id, lane + 1, 50)
+            target = lane - 1
+        elif action == 2 and lane < self.n_lanes - 1:
+            target = lane + 1
         elif action in [1, 2]:
             lane_valid = False
 
-        traci.simulationStep()
-        self.step_count += 1
-
-        if self.ego_id not in traci.vehicle.getIDList():
+        # frame_skip SUMO steps; rewards are summed, the lane change terms of
+        # the decision count once
+        reward = 0.0
+        try:
+            if target is not None:
+                self.conn.vehicle.changeLane(self.ego_id, target, self.lane_change_duration)
+                self._lane_request = (target, self.step_count +
+                                      round(self.lane_change_duration / self.step_length))
+
+            for k in range(self.frame_skip):
+                last = k == self.frame_skip - 1 or self.step_count + 1 >= self.max_steps
+                with self.profiler.section("simulation_step"):
+                    self.conn.simulationStep()
+                with self.profiler.section("observation"):
+                    # Only the ego variables are decoded between two decisions
+                    alive = self.observer.update(context=last)
+                if alive and self.stream is not None:
+                    with self.profiler.section("stream"):
+                        self.stream.update(self.conn, self.observer.lane_pos)
+                self.step_count += 1
+
+                # A collision during the skipped steps ends the episode too
+                if not alive:
+                    self._end_episode()
+                    state = np.zeros(self.observation_space.shape, dtype=np.float32)
+                    return state, reward - 20.0, True, False, {"collision": True}
+
+                with self.profiler.section("reward"):
+                    dist_current = np.float32(self.observer.leader_dist)
+                    if k == 0:
+                        reward += self.compute_reward(action, lane_valid, dist_current)
+                    else:
+                        reward += self.compute_reward(0, True, dist_current)
+                if last:
+                    break
+        except SUMO_CRASH_ERRORS:
+            # Not the agent's fault: truncate, the next reset restarts SUMO
             self._safe_close_traci()
+            self.observer.alive = False
             state = np.zeros(self.observation_space.shape, dtype=np.float32)
-            return state, -20.0, True, False, {}
+            return state, reward, False, True, {"sumo_crash": True}
 
-        state = self.get_state()
-        reward = self.compute_reward(action, lane_valid, state[1])
+        with self.profiler.section("observation"):
+            state = self.get_state()
 
         terminated = self.step_count >= self.max_steps
         truncated = False
 
         if terminated:
-            self._safe_close_traci()
+            self._end_episode()
 
         return state, reward, terminated, truncated, {}
 
     def close(self):
+        self.profiler.end_episode()
         self._safe_close_traci()
 
 
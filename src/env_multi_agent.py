@@ -0,0 +1,206 @@
+import numpy as np
+import traci.constants as tc
+from env_continuous import SumoContinuousEnv, SUMO_CRASH_ERRORS
+from utils import EGO_VARS, NEIGHBOR_VARS, CONTEXT_MARGIN, LaneIndex
+
+# Gap between two agents at insertion, they start in lane 0 at 5, 105, 205...
+AGENT_SPACING = 100.0
+
+
+class SumoMultiAgentEnv(SumoContinuousEnv):
+    """n_agents controlled vehicles sharing one SUMO instance.
+
+    Every agent sees and is rewarded like the ego of SumoContinuousEnv;
+    reset() and step() work on (n_agents, obs_dim) observations and
+    (n_agents,) actions and rewards. The neighbours of all agents come from a
+    single context subscription on the road edge, indexed once per step.
+
+    An agent that collides (or leaves the road) is done on its own and
+    respawn(i) puts it back at its start position; SUMO inserts it as soon
+    as the place is free. Until then it sees its start position, its actions
+    are ignored and its steps carry info["pending"] = True: they are not
+    transitions and must not be learned from. All episodes end together
+    after max_steps. Use vec_env.MultiAgentVecEnv to train on the agents as
+    SB3 sub-environments.
+    """
+
+    def __init__(self, n_agents=4, sumo_cfg="data/obstacles.sumocfg", max_steps=200, **kwargs):
+        if kwargs.get("snapshots") is not None:
+            raise ValueError("SumoMultiAgentEnv does not support snapshots")
+        if kwargs.get("stream_window") is not None:
+            raise ValueError("SumoMultiAgentEnv does not support obstacle streaming")
+        super().__init__(sumo_cfg=sumo_cfg, max_steps=max_steps, **kwargs)
+        self.n_agents = n_agents
+        self.agent_ids = [f"vehAgent_{i}" for i in range(n_agents)]
+        self.depart_pos = 5.0 + AGENT_SPACING * np.arange(n_agents)
+        # self.edge (first edge of r_0) holds the neighbours of every agent
+        self.index = LaneIndex(self.n_lanes)
+
+        self.alive = np.zeros(n_agents, dtype=bool)
+        # Respawned agents waiting for SUMO to insert them
+        self.pending = np.zeros(n_agents, dtype=bool)
+        self.lane = np.zeros(n_agents, dtype=np.int64)
+        self.lane_pos = np.zeros(n_agents)
+        self.speed = np.zeros(n_agents)
+        self.leader_dist = np.full(n_agents, self.horizon)
+
+    def _apply_overrides(self):
+        conn = self.conn
+        agents = set(self.agent_ids)
+        for veh in conn.vehicle.getIDList():
+            if veh not in agents:
+                conn.vehicle.setSpeed(veh, 0)
+                conn.vehicle.setLaneChangeMode(veh, 0)
+
+    def _add_agent(self, i, depart):
+        self.conn.vehicle.add(self.agent_ids[i], "r_0", typeID="obstacle", depart=depart,
+                              departPos=str(self.depart_pos[i]), departLane="0")
+
+    def _subscribe_agent(self, i):
+        conn = self.conn
+        agent = self.agent_ids[i]
+        conn.vehicle.setLaneChangeMode(agent, 0)
+        conn.vehicle.subscribe(agent, EGO_VARS)
+        conn.vehicle.subscribeLeader(agent, self.horizon)
+
+    def _setup_episode(self):
+        conn = self.conn
+        for i in range(self.n_agents):
+            self._add_agent(i, depart=0)
+        conn.simulationStep()
+        self._apply_overrides()
+
+        # A range of 0 misses vehicles off the edge's centre line
+        conn.edge.subscribeContext(self.edge, tc.CMD_GET_VEHICLE_VARIABLE, CONTEXT_MARGIN, NEIGHBOR_VARS)
+        conn.simulation.subscribe([tc.VAR_DEPARTED_VEHICLES_IDS])
+        self.pending[:] = False
+        for i in range(self.n_agents):
+            self._subscribe_agent(i)
+        self._update()
+
+    def _update(self, context=True):
+        conn = self.conn
+        if self.pending.any():
+            departed = set(conn.simulation.getSubscriptionResults().get(tc.VAR_DEPARTED_VEHICLES_IDS, ()))
+            for i in np.flatnonzero(self.pending):
+                if self.agent_ids[i] in departed:
+                    self._subscribe_agent(i)
+                    self.pending[i] = False
+
+        results = conn.vehicle.getAllSubscriptionResults()
+        for i, agent in enumerate(self.agent_ids):
+            res = results.get(agent)
+            self.alive[i] = bool(res) and not self.pending[i]
+            if not self.alive[i]:
+                continue
+            self.lane[i] = res[tc.VAR_LANE_INDEX]
+            self.lane_pos[i] = res[tc.VAR_LANEPOSITION]
+            self.speed[i] = res[tc.VAR_SPEED]
+            leader = res[tc.VAR_LEADER]
+            self.leader_dist[i] = leader[1] if leader and leader[0] else self.horizon
+        if not context:
+            return
+
+        ctx = conn.edge.getContextSubscriptionResults(self.edge) or {}
+        n = len(ctx)
+        lanes = np.fromiter((v[tc.VAR_LANE_INDEX] for v in ctx.values()), dtype=np.int32, count=n)
+        pos = np.fromiter((v[tc.VAR_LANEPOSITION] for v in ctx.values()), dtype=np.float64, count=n)
+        self.index.update(tuple(ctx), lanes, pos)
+
+    def _states(self, lane, lane_pos, leader_dist):
+        state = np.empty((len(lane),) + self.observation_space.shape, dtype=np.float32)
+        state[:, 0] = lane
+        state[:, 1] = leader_dist
+        # Every lane but the agent's own, in ascending lane index
+        ahead = self.index.leaders(lane_pos, self.horizon)
+        others = np.arange(self.n_lanes) != np.asarray(lane)[:, None]
+        state[:, 2:] = ahead[others].reshape(len(lane), self.n_lanes - 1)
+        return state
+
+    def _start_states(self, agents):
+        # What the agents will see once inserted at their start position
+        lane = np.zeros(len(agents), dtype=np.int64)
+        pos = self.depart_pos[agents]
+        return self._states(lane, pos, self.index.leaders(pos, self.horizon)[:, 0])
+
+    def get_state(self):
+        state = self._states(self.lane, self.lane_pos, self.leader_dist)
+        state[~self.alive] = 0.0
+        if self.pending.any():
+            state[self.pending] = self._start_states(np.flatnonzero(self.pending))
+        return state
+
+    def respawn(self, i):
+        """Re-insert agent i at its start position; returns what it will see there."""
+        self._add_agent(i, depart="now")
+        self.pending[i] = True
+        self.alive[i] = False
+        return self._start_states([i])[0]
+
+    def compute_reward(self, action, lane_valid, dist_current):
+        # Same terms as SumoContinuousEnv, for all agents at once
+        r_speed = self.speed / self.max_speed if self.max_speed > 0 else np.zeros(self.n_agents)
+        r_lane = np.where(np.isin(action, [1, 2]), -0.1, 0.0)
+        r_collision = np.where(dist_current < 2.0, -10.0, 0.0)
+        r_collision = np.where(lane_valid, r_collision, -5.0)
+        return r_speed + r_lane + r_collision
+
+    def step(self, actions):
+        actions = np.asarray(actions).reshape(self.n_agents)
+        # Agents not in the simulation when the step begins take no part in it
+        infos = [{} if alive else {"pending": True} for alive in self.alive]
+        active = self.alive.copy()
+        changing = np.isin(actions, [1, 2])
+        target = np.where(actions == 1, self.lane - 1, self.lane + 1)
+        in_road = (target >= 0) & (target < self.n_lanes)
+        lane_valid = ~changing | in_road
+
+        reward = np.zeros(self.n_agents)
+        crashed = np.zeros(self.n_agents, dtype=bool)
+        try:
+            for i in np.flatnonzero(active & changing & in_road):
+                self.conn.vehicle.changeLane(self.agent_ids[i], int(target[i]), self.lane_change_duration)
+
+            for k in range(self.frame_skip):
+                last = k == self.frame_skip - 1 or self.step_count + 1 >= self.max_steps
+                with self.profiler.section("simulation_step"):
+                    self.conn.simulationStep()
+                with self.profiler.section("observation"):
+                    self._update(context=last)
+                self.step_count += 1
+
+                # Collided agents are removed by SUMO and stop collecting reward
+                lost = active & ~self.alive
+                reward[lost] -= 20.0
+                crashed |= lost
+                active &= self.alive
+
+                with self.profiler.section("reward"):
+                    dist_current = self.leader_dist.astype(np.float32)
+                    if k == 0:
+                        r = self.compute_reward(actions, lane_valid, dist_current)
+                    else:
+                        r = self.compute_reward(np.zeros_like(actions), True, dist_current)
+                reward[active] += r[active]
+                if last:
+                    break
+        except SUMO_CRASH_ERRORS:
+            # Every agent is truncated, the next reset restarts SUMO
+            self._safe_close_traci()
+            self.alive[:] = False
+            state = np.zeros((self.n_agents,) + self.observation_space.shape, dtype=np.float32)
+            truncated = np.ones(self.n_agents, dtype=bool)
+            for info in infos:
+                info["sumo_crash"] = True
+            return state, reward, ~truncated, truncated, infos
+
+        with self.profiler.section("observation"):
+            state = self.get_state()
+
+        if self.step_count >= self.max_steps:
+            terminated = np.ones(self.n_agents, dtype=bool)
+            self._end_episode()
+        else:
+            terminated = crashed
+        truncated = np.zeros(self.n_agents, dtype=bool)
+        return state, reward, terminated, truncated, infos
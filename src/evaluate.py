@@ -0,0 +1,233 @@
+"""Parallel evaluation of a trained policy on SUMO worker processes.
+
+Every worker runs its own env and SUMO; the observations of all live
+workers go through the policy in one batched predict call per step. Each
+finished episode is appended to the CSV at once, and --resume skips the
+episodes already in it.
+
+    python evaluate.py --policy ppo --model models/ppo_lane_change
+    python evaluate.py --policy qtable --model q_table_highway.npy --workers 8
+    python evaluate.py --policy qtable --record results/trajectories   # then replay.py
+"""
+import os
+import csv
+import time
+import argparse
+import multiprocessing as mp
+from collections import deque
+import numpy as np
+
+CSV_PATH = "results/evaluation_results.csv"
+COLUMNS = ["episode", "total_reward", "episode_length", "seed"]
+
+
+def _make_env(env_name, env_kwargs):
+    if env_name == "discrete":
+        from env import SumoEnv
+        return SumoEnv(**env_kwargs)
+    from env_continuous import SumoContinuousEnv
+    return SumoContinuousEnv(**env_kwargs)
+
+
+def _worker(remote, env_name, env_kwargs, record_dir):
+    env = _make_env(env_name, env_kwargs)
+    if record_dir:
+        from trajectories import record_trajectories
+        env = record_trajectories(env, record_dir)
+    gym_api = env_name != "discrete"
+    try:
+        while True:
+            cmd, arg = remote.recv()
+            if cmd == "reset":
+                episode, seed = arg
+                if record_dir:
+                    env.writer.episode = episode
+                # Both envs pass the seed to SUMO (--seed)
+                obs = env.reset(seed=seed)
+                remote.send(obs[0] if gym_api else obs)
+            elif cmd == "step":
+                out = env.step(arg)
+                # (s, r, done) for SumoEnv, (s, r, terminated, truncated, info) for the gym env
+                done = out[2] or out[3] if gym_api else out[2]
+                remote.send((out[0], out[1], done))
+            elif cmd == "close":
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        env.close()
+        remote.close()
+
+
+class _Worker:
+    def __init__(self, ctx, env_name, env_kwargs, record_dir=None):
+        self.ctx = ctx
+        self.args = (env_name, env_kwargs, record_dir)
+        self._spawn()
+        self.episode = self.seed = None
+        self.obs = None
+        self.total_reward = 0.0
+        self.steps = 0
+
+    def _spawn(self):
+        self.remote, child = self.ctx.Pipe()
+        self.process = self.ctx.Process(target=_worker, args=(child,) + self.args, daemon=True)
+        self.process.start()
+        child.close()
+
+    def send(self, msg):
+        try:
+            self.remote.send(msg)
+        except OSError:
+            pass  # worker gone: the next recv() raises EOFError
+
+    def start(self, episode, seed):
+        self.episode, self.seed = episode, seed
+        self.total_reward, self.steps = 0.0, 0
+        self.send(("reset", (episode, seed)))
+
+    def restart(self):
+        self.remote.close()
+        self.process.kill()
+        self.process.join()
+        self._spawn()
+
+    def close(self):
+        self.send(("close", None))
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+def _finished_episodes(csv_path):
+    if not os.path.exists(csv_path):
+        return set()
+    with open(csv_path, newline="") as f:
+        return {int(row["episode"]) for row in csv.DictReader(f)}
+
+
+def evaluate(policy, n_episodes=50, n_workers=None, csv_path=CSV_PATH, seed=0, resume=False,
+             start_method="forkserver", verbose=True, record_dir=None, **env_kwargs):
+    """Run n_episodes of `policy` (see policies.py) and append one CSV row per episode.
+
+    Episode i resets with seed + i, so a run is reproducible whatever the
+    number of workers. An episode whose worker dies is reported and left out
+    of the CSV (--resume runs it again); the worker is restarted. Returns the
+    rows of this run.
+    """
+    finished = _finished_episodes(csv_path) if resume else set()
+    todo = deque(ep for ep in range(n_episodes) if ep not in finished)
+    if not todo:
+        return []
+    n_workers = min(n_workers or os.cpu_count() or 1, len(todo))
+
+    os.makedirs(os.path.dirname(os.path.abspath(csv_path)), exist_ok=True)
+    append = resume and os.path.exists(csv_path)
+    ctx = mp.get_context(start_method)
+    # Observation settings the policy was trained with (e.g. raw features)
+    env_kwargs = {**getattr(policy, "env_kwargs", {}), **env_kwargs}
+    workers = [_Worker(ctx, policy.env, env_kwargs, record_dir) for _ in range(n_workers)]
+    rows, failed = [], []
+    t0 = time.perf_counter()
+
+    def fail(w, exc):
+        failed.append(w.episode)
+        if verbose:
+            print(f"Episode {w.episode} | Failed: worker {w.process.pid} died ({exc!r})")
+        if len(starting) < len(todo):
+            w.restart()
+            starting.append(w)
+    try:
+        with open(csv_path, "a" if append else "w", newline="") as f:
+            writer = csv.writer(f)
+            if not append:
+                writer.writerow(COLUMNS)
+
+            starting = workers
+            live = []
+            while starting or live:
+                # Resets of the workers starting a new episode run in parallel
+                for w in starting:
+                    ep = todo.popleft()
+                    w.start(ep, seed + ep)
+                resetting, starting = starting, []
+                for w in resetting:
+                    try:
+                        w.obs = w.remote.recv()
+                    except (EOFError, OSError) as exc:
+                        fail(w, exc)
+                        continue
+                    live.append(w)
+                if not live:
+                    continue
+
+                actions = policy.predict(np.stack([np.asarray(w.obs) for w in live]))
+                for w, action in zip(live, actions):
+                    w.send(("step", action))
+
+                still_live = []
+                for w in live:
+                    try:
+                        w.obs, reward, done = w.remote.recv()
+                    except (EOFError, OSError) as exc:
+                        fail(w, exc)
+                        continue
+                    w.total_reward += reward
+                    w.steps += 1
+                    if not done:
+                        still_live.append(w)
+                        continue
+                    row = [w.episode, w.total_reward, w.steps, w.seed]
+                    writer.writerow(row)
+                    f.flush()
+                    rows.append(row)
+                    if verbose:
+                        print(f"Episode {w.episode} | Reward: {w.total_reward:.2f} | Steps: {w.steps}")
+                    # Several workers can finish in the same step
+                    if len(starting) < len(todo):
+                        starting.append(w)
+                live = still_live
+    finally:
+        for w in workers:
+            w.close()
+
+    if verbose and rows:
+        elapsed = time.perf_counter() - t0
+        print(f"{len(rows)} episodes in {elapsed:.1f} s with {n_workers} workers | "
+              f"mean reward {np.mean([r[1] for r in rows]):.2f} | "
+              f"mean length {np.mean([r[2] for r in rows]):.1f} | results in {csv_path}")
+    if verbose and failed:
+        print(f"{len(failed)} episode(s) failed, rerun them with --resume: {sorted(failed)}")
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parallel batched evaluation of a trained policy")
+    parser.add_argument("--policy", choices=["ppo", "qtable"], default="ppo")
+    parser.add_argument("--model", default=None,
+                        help="PPO zip (default models/ppo_lane_change) or Q-table .npy "
+                             "(default q_table_highway.npy) or sparse .qtable directory")
+    parser.add_argument("--episodes", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=None, help="default: one per core")
+    parser.add_argument("--csv", default=CSV_PATH)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--resume", action="store_true", help="skip episodes already in the CSV")
+    parser.add_argument("--max-steps", type=int, default=200)
+    parser.add_argument("--backend", default=None, help="traci or libsumo ($SUMO_BACKEND)")
+    parser.add_argument("--record", default=None, metavar="DIR",
+                        help="save each episode's trajectory to DIR/episode_<n>.npz (see replay.py)")
+    args = parser.parse_args(argv)
+
+    from policies import PPOPolicy, QTablePolicy
+    if args.policy == "ppo":
+        policy = PPOPolicy(args.model or "models/ppo_lane_change")
+    else:
+        policy = QTablePolicy(args.model or "q_table_highway.npy")
+
+    evaluate(policy, n_episodes=args.episodes, n_workers=args.workers, csv_path=args.csv,
+             seed=args.seed, resume=args.resume, max_steps=args.max_steps, backend=args.backend,
+             record_dir=args.record)
+
+
+if __name__ == "__main__":
+    main()
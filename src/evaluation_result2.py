@@ -1,40 +1,65 @@
-import numpy as np
-import pandas as pd
+import csv
 import os
+import numpy as np
+
+Q_TABLE_PATH = "src/q_table_highway.npy"
+HISTORY_PATH = "src/rewards_history.npy"
+# Journal écrit pendant l'entraînement (metrics.py), lu par blocs
+METRICS_DIR = "logs/q_learning/metrics"
+BLOCK_ROWS = 65536
+
+# 0: Stay, 1: Left, 2: Right (selon ta logique)
+ACTION_COLUMNS = ['Action_Stay', 'Action_Left', 'Action_Right']
+
+
+def _write_csv(path, header, rows):
+    # Même format que DataFrame.to_csv, sans dépendre de pandas
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def _metrics_rows(log):
+    # Bloc par bloc : seules les tranches de colonnes en cours sont en mémoire
+    others = [c for c in log.columns if c not in ("episode", "reward")]
+    for start in range(0, len(log), BLOCK_ROWS):
+        block = log.read(["episode", "reward"] + others, start, start + BLOCK_ROWS)
+        yield from zip(*(block[c].tolist() for c in ["episode", "reward"] + others))
+
+
+def convert(q_table_path=Q_TABLE_PATH, history_path=HISTORY_PATH,
+            q_csv="q_table_results.csv", rewards_csv="rewards_history.csv", metrics_dir=METRICS_DIR):
+    # --- 1. CONVERTIR LA Q-TABLE ---
+    if os.path.exists(q_table_path):
+        q_table = np.load(q_table_path)
+
+        # Une ligne par état : son index puis la valeur de chaque action
+        _write_csv(q_csv, ['State_Index'] + ACTION_COLUMNS,
+                   ([state] + row.tolist() for state, row in enumerate(q_table)))
+        print(f"✅ Q-Table convertie : {q_csv}")
+    else:
+        print("❌ Fichier q_table_highway.npy introuvable.")
+
+    # --- 2. CONVERTIR L'HISTORIQUE DES REWARDS ---
+    # Depuis le journal de métriques s'il existe : toutes ses colonnes, sans
+    # tout charger ; sinon depuis rewards_history.npy
+    if metrics_dir and os.path.exists(os.path.join(metrics_dir, "manifest.json")):
+        from metrics import MetricsLog
+        log = MetricsLog(metrics_dir)
+        others = [c for c in log.columns if c not in ("episode", "reward")]
+        _write_csv(rewards_csv, ['Episode', 'Total_Reward'] + others, _metrics_rows(log))
+        print(f"✅ Métriques converties ({len(log)} épisodes) : {rewards_csv}")
+    elif os.path.exists(history_path):
+        rewards = np.load(history_path)
+
+        # Une colonne Episode et une colonne Reward
+        _write_csv(rewards_csv, ['Episode', 'Total_Reward'],
+                   ([episode, reward] for episode, reward in enumerate(rewards.tolist())))
+        print(f"✅ Historique converti : {rewards_csv}")
+    else:
+        print("❌ Fichier rewards_history.npy introuvable.")
+
 
-# --- 1. CONVERTIR LA Q-TABLE ---
-q_table_path = "src/q_table_highway.npy"
-
-if os.path.exists(q_table_path):
-    q_table = np.load(q_table_path)
-    
-    # On crée des noms de colonnes pour les actions
-    # 0: Stay, 1: Left, 2: Right (selon ta logique)
-    df_q = pd.DataFrame(q_table, columns=['Action_Stay', 'Action_Left', 'Action_Right'])
-    
-    # On ajoute une colonne pour l'index de l'état
-    df_q.index.name = 'State_Index'
-    
-    # Sauvegarde en CSV
-    df_q.to_csv("q_table_results.csv")
-    print("✅ Q-Table convertie : q_table_results.csv")
-else:
-    print("❌ Fichier q_table_highway.npy introuvable.")
-
-# --- 2. CONVERTIR L'HISTORIQUE DES REWARDS ---
-history_path = "src/rewards_history.npy"
-
-if os.path.exists(history_path):
-    rewards = np.load(history_path)
-    
-    # On crée un DataFrame avec une colonne Episode et une colonne Reward
-    df_rewards = pd.DataFrame({
-        'Episode': np.arange(len(rewards)),
-        'Total_Reward': rewards
-    })
-    
-    # Sauvegarde en CSV
-    df_rewards.to_csv("rewards_history.csv", index=False)
-    print("✅ Historique converti : rewards_history.csv")
-else:
-    print("❌ Fichier rewards_history.npy introuvable.")
\ No newline at end of file
+if __name__ == "__main__":
+    convert()
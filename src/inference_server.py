@@ -0,0 +1,333 @@
+"""Micro-batching inference for the lane-change policies.
+
+Requests from many vehicles or simulations are queued; a single thread
+takes the first one, waits at most max_delay for more (or until max_batch
+observations) and answers all of them with one policy.predict call, i.e.
+one PPO forward pass or one vectorized Q-table lookup.
+
+In process:
+
+    batcher = MicroBatcher(PPOPolicy("models/ppo_lane_change"))
+    action = batcher.predict(obs)            # thread-safe, blocks until batched
+
+Over a local socket, for other processes:
+
+    python inference_server.py --policy ppo --port 6000      # prints the run's key
+    client = PolicyClient(("127.0.0.1", 6000), authkey=key); actions = client.predict(obs_batch)
+
+    python inference_server.py --policy qtable --bench-clients 64   # load test
+
+Nothing received is unpickled: a request is a small header and the raw
+float32 observations, a reply a status byte and the int64 actions (or an
+error message). Connections must also pass the HMAC challenge of the run's
+key, either $POLICY_SERVER_KEY or a random one printed at startup.
+"""
+import os
+import time
+import queue
+import struct
+import secrets
+import threading
+from concurrent.futures import Future
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+import numpy as np
+from profiling import summarize
+
+DEFAULT_ADDRESS = ("127.0.0.1", 6000)
+KEY_ENV = "POLICY_SERVER_KEY"
+# Request: ndim (1: one observation, 2: a batch), rows, obs_dim, then float32 data
+REQUEST_HEADER = struct.Struct("<BII")
+# Reply: status, then int64 actions (OK) or a UTF-8 error message (ERROR)
+REPLY_OK, REPLY_ERROR = 0, 1
+MAX_REQUEST_BYTES = 64 * 1024 * 1024
+
+
+def default_authkey():
+    """$POLICY_SERVER_KEY, or None when it is not set."""
+    key = os.environ.get(KEY_ENV)
+    return key.encode() if key else None
+
+
+def encode_request(obs):
+    obs = np.ascontiguousarray(obs, dtype=np.float32)
+    if obs.ndim not in (1, 2):
+        raise ValueError(f"Expected one observation or a 2-D batch, got shape {obs.shape}")
+    rows, cols = (1, obs.shape[0]) if obs.ndim == 1 else obs.shape
+    return REQUEST_HEADER.pack(obs.ndim, rows, cols) + obs.tobytes()
+
+
+def decode_request(data):
+    if len(data) < REQUEST_HEADER.size:
+        raise ValueError("Truncated request header")
+    ndim, rows, cols = REQUEST_HEADER.unpack_from(data)
+    if ndim not in (1, 2) or (ndim == 1 and rows != 1):
+        raise ValueError(f"Bad request header ({ndim}, {rows}, {cols})")
+    if len(data) - REQUEST_HEADER.size != rows * cols * 4:
+        raise ValueError(f"Request carries {len(data) - REQUEST_HEADER.size} bytes, "
+                         f"not {rows} x {cols} float32")
+    obs = np.frombuffer(data, dtype=np.float32, offset=REQUEST_HEADER.size).reshape(rows, cols)
+    return obs[0] if ndim == 1 else obs
+
+
+class MicroBatcher:
+    """Collects predict requests into batched policy.predict calls.
+
+    A request is one observation or an (n, obs_dim) array of them, and gets
+    back one action or n actions. Latency (submit to answer) and batch sizes
+    are kept for stats().
+    """
+
+    def __init__(self, policy, max_batch=256, max_delay=0.002):
+        self.policy = policy
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._latencies = []
+        self._batch_sizes = []
+        self._t0 = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, obs):
+        future = Future()
+        self._queue.put((np.asarray(obs), future, time.perf_counter()))
+        return future
+
+    def predict(self, obs, timeout=None):
+        return self.submit(obs).result(timeout)
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        rows = 1 if first[0].ndim == 1 else len(first[0])
+        deadline = time.perf_counter() + self.max_delay
+        while rows < self.max_batch:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.perf_counter(), 0.0))
+            except queue.Empty:
+                break
+            if item is None:
+                # Answer what we have, then stop
+                self._queue.put(None)
+                break
+            batch.append(item)
+            rows += 1 if item[0].ndim == 1 else len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            try:
+                obs = np.concatenate([o[None] if o.ndim == 1 else o for o, _, _ in batch])
+                actions = np.asarray(self.policy.predict(obs))
+            except Exception:
+                # A malformed request must not fail the others: answer one by one
+                self._run_each(batch)
+                continue
+            done = time.perf_counter()
+            i = 0
+            for o, future, t_submit in batch:
+                if o.ndim == 1:
+                    future.set_result(actions[i])
+                    i += 1
+                else:
+                    future.set_result(actions[i:i + len(o)])
+                    i += len(o)
+                self._latencies.append(done - t_submit)
+            self._batch_sizes.append(len(obs))
+
+    def _run_each(self, batch):
+        for o, future, t_submit in batch:
+            try:
+                actions = np.asarray(self.policy.predict(o[None] if o.ndim == 1 else o))
+            except Exception as exc:
+                future.set_exception(exc)
+                continue
+            future.set_result(actions[0] if o.ndim == 1 else actions)
+            self._latencies.append(time.perf_counter() - t_submit)
+            self._batch_sizes.append(len(actions))
+
+    def stats(self, reset=False):
+        """Request latency percentiles (ms), batch sizes and throughput since the last reset."""
+        latencies, sizes = self._latencies, self._batch_sizes
+        elapsed = time.perf_counter() - self._t0
+        if reset:
+            self._latencies, self._batch_sizes = [], []
+            self._t0 = time.perf_counter()
+        if not latencies:
+            return {"requests": 0, "observations": 0, "batches": 0}
+        return {
+            "requests": len(latencies),
+            "observations": int(sum(sizes)),
+            "batches": len(sizes),
+            "mean_batch": float(np.mean(sizes)),
+            "requests_per_sec": len(latencies) / elapsed,
+            "observations_per_sec": sum(sizes) / elapsed,
+            "latency": summarize(latencies),
+        }
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+def format_stats(stats):
+    if not stats["requests"]:
+        return "no requests"
+    lat = stats["latency"]
+    return (f"{stats['requests']} requests ({stats['observations']} obs) in {stats['batches']} batches "
+            f"(mean {stats['mean_batch']:.1f}) | {stats['requests_per_sec']:.0f} req/s, "
+            f"{stats['observations_per_sec']:.0f} obs/s | latency p50 {lat['p50_ms']:.3f} ms, "
+            f"p99 {lat['p99_ms']:.3f} ms, max {lat['max_ms']:.3f} ms")
+
+
+class PolicyServer:
+    """Serves a MicroBatcher on a local socket, one thread per client connection.
+
+    Without authkey, $POLICY_SERVER_KEY is used or a random key is generated
+    for this run (self.authkey, to hand to the clients).
+    """
+
+    def __init__(self, batcher, address=DEFAULT_ADDRESS, authkey=None):
+        self.batcher = batcher
+        self.authkey = authkey or default_authkey() or secrets.token_hex(16).encode()
+        self.listener = Listener(address, authkey=self.authkey)
+        self.address = self.listener.address
+        self._closed = False
+
+    def _serve_client(self, conn):
+        with conn:
+            while True:
+                try:
+                    data = conn.recv_bytes(MAX_REQUEST_BYTES)
+                except (EOFError, OSError):
+                    return
+                try:
+                    actions = np.asarray(self.batcher.predict(decode_request(data)), dtype=np.int64)
+                    reply = bytes([REPLY_OK]) + actions.tobytes()
+                except Exception as exc:
+                    reply = bytes([REPLY_ERROR]) + f"{type(exc).__name__}: {exc}".encode()
+                try:
+                    conn.send_bytes(reply)
+                except OSError:
+                    return
+
+    def serve_forever(self):
+        while not self._closed:
+            try:
+                conn = self.listener.accept()
+            except (AuthenticationError, EOFError):
+                # Wrong key, or a client gone during the handshake
+                continue
+            except OSError:
+                if self._closed:
+                    return
+                raise
+            threading.Thread(target=self._serve_client, args=(conn,), daemon=True).start()
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="policy-server", daemon=True).start()
+        return self
+
+    def close(self):
+        self._closed = True
+        self.listener.close()
+
+
+class PolicyClient:
+    """Blocking client of a PolicyServer; predict() takes one observation or a batch.
+
+    authkey is the server's key, $POLICY_SERVER_KEY by default.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=None):
+        authkey = authkey or default_authkey()
+        if authkey is None:
+            raise ValueError(f"No key for the policy server: pass authkey or set ${KEY_ENV}")
+        self.conn = Client(address, authkey=authkey)
+
+    def predict(self, obs):
+        single = np.ndim(obs) == 1
+        self.conn.send_bytes(encode_request(obs))
+        reply = self.conn.recv_bytes()
+        if reply[0] != REPLY_OK:
+            raise RuntimeError(f"Policy server error: {reply[1:].decode(errors='replace')}")
+        actions = np.frombuffer(reply, dtype=np.int64, offset=1)
+        return actions[0] if single else actions
+
+    def close(self):
+        self.conn.close()
+
+
+def load_test(batcher, n_clients=64, n_requests=500, obs_dim=3, seed=0):
+    """n_clients threads each sending n_requests single observations back to back."""
+    def client(k):
+        rng = np.random.default_rng(seed + k)
+        # Lane 0/1 and distance bins 0/1: valid for both policies
+        for obs in rng.integers(0, 2, (n_requests, obs_dim)):
+            batcher.predict(obs)
+
+    batcher.stats(reset=True)
+    threads = [threading.Thread(target=client, args=(k,)) for k in range(n_clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return batcher.stats(reset=True)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Micro-batching policy inference server")
+    parser.add_argument("--policy", choices=["ppo", "qtable"], default="ppo")
+    parser.add_argument("--model", default=None,
+                        help="PPO zip (default models/ppo_lane_change) or Q-table .npy "
+                             "(default q_table_highway.npy)")
+    parser.add_argument("--host", default=DEFAULT_ADDRESS[0],
+                        help="interface to bind; anything but loopback needs $POLICY_SERVER_KEY")
+    parser.add_argument("--port", type=int, default=DEFAULT_ADDRESS[1])
+    parser.add_argument("--max-batch", type=int, default=256)
+    parser.add_argument("--max-delay-ms", type=float, default=2.0, help="latency budget for batching")
+    parser.add_argument("--report-every", type=float, default=10.0, help="seconds between stats lines")
+    parser.add_argument("--bench-clients", type=int, default=0,
+                        help="run an in-process load test with this many clients instead of serving")
+    parser.add_argument("--bench-requests", type=int, default=500, help="requests per load-test client")
+    args = parser.parse_args()
+
+    from policies import PPOPolicy, QTablePolicy
+    if args.policy == "ppo":
+        policy = PPOPolicy(args.model or "models/ppo_lane_change")
+    else:
+        policy = QTablePolicy(args.model or "q_table_highway.npy")
+    batcher = MicroBatcher(policy, max_batch=args.max_batch, max_delay=args.max_delay_ms / 1000.0)
+
+    if args.bench_clients:
+        print(format_stats(load_test(batcher, args.bench_clients, args.bench_requests)))
+        batcher.close()
+        return
+
+    if args.host not in ("127.0.0.1", "localhost", "::1") and default_authkey() is None:
+        batcher.close()
+        parser.error(f"binding {args.host} needs a key shared with the clients in ${KEY_ENV}")
+    server = PolicyServer(batcher, (args.host, args.port)).start()
+    print(f"Serving {args.policy} policy on {server.address[0]}:{server.address[1]}")
+    if default_authkey() is None:
+        print(f"Clients need the key of this run: {KEY_ENV}={server.authkey.decode()}")
+    try:
+        while True:
+            time.sleep(args.report_every)
+            print(format_stats(batcher.stats(reset=True)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        batcher.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""Append-only, chunked columnar log of per-episode training metrics.
+
+Training appends one row per episode (reward, length, epsilon, collisions,
+timings...) as it goes; nothing is kept in memory and nothing is converted
+at the end. The storage is chunked.ChunkedWriter's, as for recorded
+transitions: chunks of preallocated .npy memmaps, one file per column, and
+a manifest rewritten atomically after the data of every flush.
+
+    logs/q_learning/metrics/
+        manifest.json           columns, dtypes, chunk names and flushed lengths
+        chunk_000000/reward.npy ...
+
+Readers only see flushed rows, open the chunks memory-mapped and read the
+column slices they ask for, while the run is still writing:
+
+    log = MetricsLog("logs/q_learning/metrics")
+    rewards = log.column("reward", start=-1000)       # last 1000 episodes
+    for rows in log.follow(["episode", "reward"]):    # live tail
+        ...
+
+    python metrics.py logs/q_learning/metrics --follow
+    python metrics.py logs/q_learning/metrics --plot reward --every 100
+"""
+import os
+import time
+import argparse
+import numpy as np
+from chunked import ChunkedWriter, read_manifest
+
+# Columns written by q_learning.train
+Q_LEARNING_COLUMNS = {
+    "episode": np.int64,
+    "reward": np.float64,
+    "length": np.int32,
+    "epsilon": np.float32,
+    # 1 when the ego left the simulation before max_steps (collision)
+    "collisions": np.int32,
+    "reset_time": np.float32,
+    "episode_time": np.float32,
+    "wall_time": np.float64,
+}
+# Columns written by callbacks.MetricsCallback (PPO, one row per finished episode)
+PPO_COLUMNS = {
+    "episode": np.int64,
+    "reward": np.float64,
+    "length": np.int32,
+    "collisions": np.int32,
+    "timesteps": np.int64,
+    "wall_time": np.float64,
+}
+
+
+class MetricsWriter(ChunkedWriter):
+    """Appends rows to a metrics directory; opening an existing one appends to it.
+
+    Rows become visible to readers at flush(), which happens every
+    flush_every rows or flush_interval seconds, whichever comes first.
+    """
+
+    def __init__(self, directory, columns, chunk_size=65536, flush_every=256, flush_interval=1.0):
+        super().__init__(directory, columns, chunk_size=chunk_size, flush_every=flush_every,
+                         flush_interval=flush_interval)
+
+    def truncate_at(self, column, value):
+        """Drop the trailing rows whose `column` is >= value.
+
+        For a column that never decreases within a run, such as the episode
+        number: when a run resumes from a checkpoint, truncate_at("episode",
+        start_episode) forgets the episodes it logged after the checkpoint,
+        which are about to be replayed. The scan goes back from the end and
+        stops at the first row below value, so earlier runs are kept.
+        """
+        self.flush()
+        end = len(self)
+        keep = 0
+        for chunk in reversed(self.chunks):
+            end -= chunk["length"]
+            values = np.load(os.path.join(self.directory, chunk["name"], column + ".npy"),
+                             mmap_mode="r")[:chunk["length"]]
+            below = np.flatnonzero(values < value)
+            if len(below):
+                keep = end + int(below[-1]) + 1
+                break
+        self.truncate(keep)
+
+
+class MetricsLog:
+    """Read-only view of a metrics directory, possibly still being written.
+
+    Chunks are memory-mapped on first use and cut to their flushed length;
+    refresh() picks up the rows flushed since. Negative start/stop count
+    from the end, as in slices.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._maps = {}
+        self.refresh()
+
+    def refresh(self):
+        """Re-read the manifest; returns the number of rows."""
+        manifest = read_manifest(self.directory)
+        self.columns = manifest["columns"]
+        self.dtypes = manifest["dtypes"]
+        self.chunks = manifest["chunks"]
+        lengths = [c["length"] for c in self.chunks]
+        self.offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        # Forget the chunks dropped by a truncation
+        names = {c["name"] for c in self.chunks}
+        self._maps = {key: m for key, m in self._maps.items() if key[0] in names}
+        return len(self)
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def _chunk_column(self, k, column):
+        key = (self.chunks[k]["name"], column)
+        if key not in self._maps:
+            self._maps[key] = np.load(os.path.join(self.directory, key[0], column + ".npy"), mmap_mode="r")
+        return self._maps[key][:self.chunks[k]["length"]]
+
+    def column(self, column, start=0, stop=None):
+        """Rows [start, stop) of one column; only the chunks they span are read."""
+        if column not in self.columns:
+            raise KeyError(f"No column '{column}' in {self.directory} ({', '.join(self.columns)})")
+        start, stop, _ = slice(start, stop).indices(len(self))
+        stop = max(stop, start)
+        first = max(int(np.searchsorted(self.offsets, start, side="right")) - 1, 0)
+        parts = []
+        for k in range(first, len(self.chunks)):
+            if self.offsets[k] >= stop:
+                break
+            lo = max(start - self.offsets[k], 0)
+            hi = min(stop, self.offsets[k + 1]) - self.offsets[k]
+            parts.append(self._chunk_column(k, column)[lo:hi])
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=self.dtypes[column])
+
+    def read(self, columns=None, start=0, stop=None):
+        return {c: self.column(c, start, stop) for c in (columns or self.columns)}
+
+    def follow(self, columns=None, start=None, poll_interval=1.0, timeout=None):
+        """Yield the rows flushed since the last yield, as read() dicts; runs until timeout.
+
+        start=None begins with the rows flushed from now on.
+        """
+        position = len(self) if start is None else start
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while deadline is None or time.monotonic() < deadline:
+            n = self.refresh()
+            if n < position:
+                position = n  # truncated by a resumed run
+            if n > position:
+                yield self.read(columns, position, n)
+                position = n
+            else:
+                time.sleep(poll_interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect, tail or plot a metrics directory")
+    parser.add_argument("directory")
+    parser.add_argument("--follow", action="store_true", help="print episodes as they are flushed")
+    parser.add_argument("--last", type=int, default=100, help="episodes in the summary")
+    parser.add_argument("--plot", nargs="+", default=None, metavar="COLUMN",
+                        help="plot these columns against the episode")
+    parser.add_argument("--every", type=int, default=1, help="plot one row out of EVERY")
+    parser.add_argument("--save", default=None, help="save the plot to this image (headless)")
+    args = parser.parse_args(argv)
+
+    log = MetricsLog(args.directory)
+    if args.plot:
+        import matplotlib
+        if args.save:
+            matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+        x = log.column("episode")[::args.every] if "episode" in log.columns else None
+        fig, axes = plt.subplots(len(args.plot), 1, figsize=(12, 3 * len(args.plot)), squeeze=False)
+        for ax, column in zip(axes[:, 0], args.plot):
+            y = log.column(column)[::args.every]
+            ax.plot(np.arange(len(y)) * args.every if x is None else x, y, linewidth=0.8)
+            ax.set_ylabel(column)
+        axes[-1, 0].set_xlabel("episode")
+        fig.tight_layout()
+        if args.save:
+            fig.savefig(args.save)
+            print(f"Saved {args.save}")
+        else:
+            plt.show()
+        return
+
+    n = len(log)
+    print(f"{n} rows, columns: {', '.join(log.columns)}")
+    if n:
+        last = log.read(start=-args.last)
+        print(f"mean of the last {min(n, args.last)}: "
+              + " | ".join(f"{c} {np.mean(v):.4g}" for c, v in last.items()))
+    if args.follow:
+        try:
+            for rows in log.follow():
+                for i in range(len(rows[log.columns[0]])):
+                    print(" | ".join(f"{c} {rows[c][i]:.4g}" for c in log.columns), flush=True)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
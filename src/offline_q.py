@@ -0,0 +1,108 @@
+"""Offline Q-iteration on SumoEnv transitions recorded with recorder.py.
+
+The dataset is read once, chunk by chunk, and reduced with bincount to the
+per (state, action) statistics the Bellman backup needs: visit count,
+reward sum and next-state counts of the non-terminal transitions. Every
+sweep then applies the batch-mean backup to all visited pairs at once
+
+    Q[s, a] += alpha * (mean(r) + gamma * sum_s' p(s'|s, a) max Q[s'] - Q[s, a])
+
+which is the same as averaging r + gamma * max Q[s'] over the transitions,
+at a cost that no longer depends on the dataset size.
+
+    RECORD_DIR=datasets/q python q_learning.py      # collect
+    python offline_q.py --data datasets/q --gamma 0.95
+"""
+import time
+import argparse
+import numpy as np
+from recorder import TransitionDataset
+from utils import state_to_index, n_states as count_states
+
+
+def transition_statistics(dataset, n_states, n_actions=3):
+    n_pairs = n_states * n_actions
+    counts = np.zeros(n_pairs)
+    reward_sums = np.zeros(n_pairs)
+    next_counts = np.zeros(n_pairs * n_states)
+    for chunk in dataset.iter_chunks():
+        s = state_to_index(chunk["obs"].astype(np.int64))
+        s_next = state_to_index(chunk["next_obs"].astype(np.int64))
+        pair = s * n_actions + chunk["action"].astype(np.int64)
+        counts += np.bincount(pair, minlength=n_pairs)
+        reward_sums += np.bincount(pair, weights=chunk["reward"], minlength=n_pairs)
+        # Terminal transitions do not bootstrap
+        live = ~chunk["done"]
+        next_counts += np.bincount(pair[live] * n_states + s_next[live], minlength=n_pairs * n_states)
+    return counts, reward_sums, next_counts.reshape(n_pairs, n_states)
+
+
+def fit_q_table(stats, q_table, alpha=1.0, gamma=0.95, tol=1e-6, max_sweeps=10_000):
+    """Synchronous Q-iteration sweeps, in place on `q_table`, until max |dQ| < tol.
+
+    Pairs never visited keep their value. Returns the per-sweep history as
+    (max |dQ|, seconds) tuples.
+    """
+    counts, reward_sums, next_counts = stats
+    seen = counts > 0
+    mean_reward = reward_sums[seen] / counts[seen]
+    p_next = next_counts[seen] / counts[seen, None]
+
+    flat = q_table.reshape(-1)
+    history = []
+    for _ in range(max_sweeps):
+        t0 = time.perf_counter()
+        target = mean_reward + gamma * (p_next @ q_table.max(axis=1))
+        step = alpha * (target - flat[seen])
+        flat[seen] += step
+        delta = float(np.abs(step).max()) if step.size else 0.0
+        history.append((delta, time.perf_counter() - t0))
+        if delta < tol:
+            break
+    return history
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline Q-iteration on recorded SumoEnv transitions")
+    parser.add_argument("--data", required=True, help="recorder directory (or a parent of several)")
+    parser.add_argument("--out", default="q_table_highway.npy")
+    parser.add_argument("--init", default=None, help="start from this Q-table instead of zeros")
+    parser.add_argument("--alpha", type=float, default=1.0)
+    parser.add_argument("--gamma", type=float, default=0.95)
+    parser.add_argument("--tol", type=float, default=1e-6)
+    parser.add_argument("--max-sweeps", type=int, default=10_000)
+    parser.add_argument("--verbose", action="store_true", help="print every sweep")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    dataset = TransitionDataset(args.data)
+    obs = dataset.chunk(0)["obs"]
+    if not np.issubdtype(obs.dtype, np.integer):
+        raise ValueError("offline Q-iteration needs discrete SumoEnv states, "
+                         f"got {obs.dtype} observations")
+    n_lanes = obs.shape[1] - 1
+    n_states = count_states(n_lanes)
+    stats = transition_statistics(dataset, n_states)
+    t_stats = time.perf_counter() - t0
+    print(f"{len(dataset)} transitions, {int((stats[0] > 0).sum())}/{stats[0].size} "
+          f"(state, action) pairs visited | statistics in {t_stats * 1000:.1f} ms")
+
+    q_table = np.load(args.init) if args.init else np.zeros((n_states, 3))
+    history = fit_q_table(stats, q_table, alpha=args.alpha, gamma=args.gamma,
+                          tol=args.tol, max_sweeps=args.max_sweeps)
+    if args.verbose:
+        for k, (delta, seconds) in enumerate(history):
+            print(f"Sweep {k} | max |dQ|: {delta:.3e} | {seconds * 1e3:.3f} ms")
+    times = np.array([seconds for _, seconds in history]) * 1000.0
+    converged = history[-1][0] < args.tol
+    print(f"{len(history)} sweeps ({'converged' if converged else 'not converged'}, "
+          f"max |dQ| {history[-1][0]:.2e}) | total {times.sum():.2f} ms | "
+          f"per sweep mean {times.mean():.4f} ms, p50 {np.percentile(times, 50):.4f} ms, "
+          f"max {times.max():.4f} ms")
+
+    np.save(args.out, q_table)
+    print(f"--- Q-Table sauvegardée sous le nom '{args.out}' ---")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import os
+import numpy as np
+from utils import state_to_index
+from qtable import SparseQTable
+
+
+class PPOPolicy:
+    """Trained SB3 PPO model, evaluated on SumoContinuousEnv observations."""
+
+    env = "continuous"
+
+    def __init__(self, path="models/ppo_lane_change", device="cpu"):
+        from stable_baselines3 import PPO
+        self.path = path
+        self.model = PPO.load(path, device=device)
+
+    def predict(self, obs):
+        # One forward pass for the whole (n, obs_dim) batch
+        actions, _ = self.model.predict(np.asarray(obs, dtype=np.float32), deterministic=True)
+        return actions
+
+
+class QTablePolicy:
+    """Greedy policy of a Q-table trained on SumoEnv's discrete states.
+
+    A directory is a qtable.SparseQTable, memory-mapped, evaluated on the raw
+    features its discretizer was trained on.
+    """
+
+    env = "discrete"
+
+    def __init__(self, path="q_table_highway.npy"):
+        self.path = path
+        self.env_kwargs = {}
+        if os.path.isdir(path):
+            self.q_table = SparseQTable.load(path)
+            self.env_kwargs = {"observation": "features"}
+        else:
+            self.q_table = np.load(path)
+
+    def predict(self, obs):
+        if self.env_kwargs:
+            return self.q_table.greedy(self.q_table.discretizer.key(obs))
+        states = state_to_index(np.asarray(obs, dtype=np.int64))
+        return np.argmax(self.q_table[states], axis=1)
@@ -0,0 +1,166 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+import numpy as np
+
+# Env sections timed by SumoEnv / SumoContinuousEnv, plus the agent side
+SECTIONS = ("sumo_start", "simulation_step", "observation", "reward", "action_selection")
+
+# Histogram bin edges in milliseconds (log-spaced, 1 us .. 10 s)
+HIST_EDGES_MS = np.logspace(-3, 4, 15)
+
+
+class Profiler:
+    """Opt-in wall-time recorder for the env sections and every TraCI call.
+
+    Samples are kept for the current episode only; end_episode() turns them
+    into a per-name summary (count, total, mean, percentiles, histogram),
+    appends it to `episodes` and optionally streams it to TensorBoard.
+    TraCI calls are recorded under "traci/<domain>.<method>".
+    """
+
+    enabled = True
+
+    def __init__(self, tensorboard_dir=None, verbose=False):
+        self.tensorboard_dir = tensorboard_dir
+        self.verbose = verbose
+        self.samples = defaultdict(list)
+        self.episodes = []
+        self._writer = None
+
+    @contextmanager
+    def section(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples[name].append(time.perf_counter() - t0)
+
+    def record(self, name, seconds):
+        self.samples[name].append(seconds)
+
+    def wrap(self, conn):
+        return TracedConnection(conn, self)
+
+    def end_episode(self):
+        if not self.samples:
+            return None
+        summary = {name: summarize(values) for name, values in self.samples.items()}
+        self.samples = defaultdict(list)
+        self.episodes.append(summary)
+        if self.tensorboard_dir is not None:
+            self._write_tensorboard(summary, len(self.episodes) - 1)
+        if self.verbose:
+            print(format_summary(summary))
+        return summary
+
+    def _write_tensorboard(self, summary, episode):
+        if self._writer is None:
+            from torch.utils.tensorboard import SummaryWriter
+            self._writer = SummaryWriter(self.tensorboard_dir)
+        for name, stats in summary.items():
+            tag = f"profile/{name}"
+            self._writer.add_scalar(f"{tag}/mean_ms", stats["mean_ms"], episode)
+            self._writer.add_scalar(f"{tag}/count", stats["count"], episode)
+            self._writer.add_histogram_raw(
+                tag, min=stats["min_ms"], max=stats["max_ms"], num=stats["count"],
+                sum=stats["total_ms"], sum_squares=stats["sum_sq_ms"],
+                bucket_limits=HIST_EDGES_MS[1:].tolist(), bucket_counts=stats["hist"],
+                global_step=episode)
+        self._writer.flush()
+
+    def close(self):
+        self.end_episode()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class NullProfiler:
+    """Stand-in used when profiling is off: every hook is a no-op."""
+
+    enabled = False
+
+    def section(self, name):
+        return nullcontext()
+
+    def record(self, name, seconds):
+        pass
+
+    def wrap(self, conn):
+        return conn
+
+    def end_episode(self):
+        return None
+
+    def close(self):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+def summarize(values):
+    ms = np.asarray(values) * 1000.0
+    hist = np.histogram(np.clip(ms, HIST_EDGES_MS[0], HIST_EDGES_MS[-1]), bins=HIST_EDGES_MS)[0]
+    return {
+        "count": int(ms.size),
+        "total_ms": float(ms.sum()),
+        "sum_sq_ms": float(np.square(ms).sum()),
+        "mean_ms": float(ms.mean()),
+        "min_ms": float(ms.min()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+        "hist": hist.tolist(),
+    }
+
+
+def format_summary(summary):
+    lines = [f"{'name':<36}{'count':>8}{'total ms':>11}{'mean ms':>10}{'p50':>9}{'p99':>9}{'max':>9}"]
+    for name, s in sorted(summary.items(), key=lambda kv: -kv[1]["total_ms"]):
+        lines.append(f"{name:<36}{s['count']:>8}{s['total_ms']:>11.2f}{s['mean_ms']:>10.4f}"
+                     f"{s['p50_ms']:>9.4f}{s['p99_ms']:>9.4f}{s['max_ms']:>9.3f}")
+    return "\n".join(lines)
+
+
+class _TracedDomain:
+    def __init__(self, domain, name, profiler):
+        self._domain = domain
+        self._name = name
+        self._profiler = profiler
+
+    def __getattr__(self, attr):
+        value = getattr(self._domain, attr)
+        if not callable(value):
+            return value
+        return _timed(value, f"traci/{self._name}.{attr}", self._profiler)
+
+
+class TracedConnection:
+    """Proxy around a traci connection (or the libsumo module) timing each call."""
+
+    def __init__(self, conn, profiler):
+        self.unwrapped = conn
+        self._profiler = profiler
+        self._domains = {}
+
+    def __getattr__(self, attr):
+        value = getattr(self.unwrapped, attr)
+        # libsumo domains are classes, traci domains are plain objects
+        if callable(value) and not isinstance(value, type):
+            return _timed(value, f"traci/{attr}", self._profiler)
+        if attr not in self._domains:
+            self._domains[attr] = _TracedDomain(value, attr, self._profiler)
+        return self._domains[attr]
+
+
+def _timed(fn, name, profiler):
+    def call(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler.samples[name].append(time.perf_counter() - t0)
+    return call
@@ -1,113 +1,296 @@
 import random
 import numpy as np
-import matplotlib.pyplot as plt
 from env import SumoEnv
+from utils import state_to_index
+from qtable import SparseQTable, Discretizer, DISTANCE_EDGES
+from profiling import Profiler, NULL_PROFILER, format_summary
+from recorder import record_transitions
+from trajectories import record_trajectories
+from metrics import MetricsWriter, Q_LEARNING_COLUMNS
+from checkpoints import AsyncCheckpointer, dumps_state, load_state, rng_state, set_rng_state
 import time
 import inspect
 import os  # Nécessaire pour vérifier si le fichier existe
 
-def state_to_index(state):
-    lane, d1, d2 = state
-    return int(lane * 9 + d1 * 3 + d2)
-
 # --- CONFIGURATION ---
-alpha = 0.1 
+alpha = 0.1
 gamma = 0.95
-epsilon = 1.0 
+epsilon = 1.0
 epsilon_decay = 0.998
 min_epsilon = 0.05
 nbr_episode = 500  # Augmenté pour un vrai apprentissage
 
-n_state = 18
 n_actions = 3
+Q_TABLE_PATH = "q_table_highway.npy"
+# Table creuse (qtable.SparseQTable) : un dossier chargé en mmap
+SPARSE_Q_TABLE_PATH = "q_table_highway.qtable"
 HISTORY_PATH = "src/rewards_history.npy"
-# --- INITIALISATION OU CHARGEMENT DE LA Q-TABLE ---
-if os.path.exists("q_table_highway.npy"):
-    q_table = np.load("q_table_highway.npy")
-    # Si on charge une table apprise, on peut réduire epsilon pour moins de hasard
-    epsilon = 0.3 
-    print("--- Q-Table chargée avec succès ! Reprise de l'apprentissage... ---")
-else:
-    q_table = np.zeros((n_state, n_actions))
-    print("--- Nouvelle Q-Table créée ---")
-
-# --- POUR LES GRAPHIQUES ---
-rewards_history = []
-epsilons_history = []
-
-print("Arguments acceptés par SumoEnv:", inspect.signature(SumoEnv.__init__))
-
-# ENTRAÎNEMENT SANS GUI
-env = SumoEnv(use_gui=False)
-
-print("--- Début de l'entraînement (Mode Rapide) ---")
-
-for episode in range(nbr_episode):
-    state_raw = env.reset()
-    state = state_to_index(state_raw)
-    done = False
-    total_reward = 0
-
-    for step in range(env.max_steps):
-        if random.uniform(0, 1) < epsilon:
-            action = random.randint(0, 2)
+# PROFILE=1 : timings SUMO / TraCI / agent par épisode (+ TensorBoard)
+PROFILE = os.environ.get("PROFILE") == "1"
+# RECORD_DIR=<dossier> : enregistre toutes les transitions (recorder.TransitionDataset)
+RECORD_DIR = os.environ.get("RECORD_DIR")
+# Points de reprise écrits en arrière-plan, on garde les CHECKPOINT_KEEP derniers
+CHECKPOINT_DIR = "checkpoints/q_learning"
+CHECKPOINT_EVERY = 25
+CHECKPOINT_KEEP = 3
+# Une ligne par épisode (reward, longueur, epsilon, collisions, temps), écrite
+# pendant l'entraînement : lue en direct / en partie avec metrics.MetricsLog
+METRICS_DIR = "logs/q_learning/metrics"
+
+
+def train(n_episodes=nbr_episode, q_table_path=Q_TABLE_PATH, history_path=HISTORY_PATH,
+          checkpoint_dir=CHECKPOINT_DIR, profile=PROFILE, record_dir=RECORD_DIR,
+          alpha=alpha, gamma=gamma, epsilon=epsilon, epsilon_decay=epsilon_decay,
+          min_epsilon=min_epsilon, seed=None, report=None, verbose=True, discretizer=None,
+          metrics_dir=METRICS_DIR, pretrain_steps=0, distance_edges=None, speed_edges=None,
+          **env_kwargs):
+    """Apprentissage tabulaire sur SumoEnv ; renvoie (q_table, rewards_history, epsilons_history).
+
+    q_table_path / history_path / checkpoint_dir / metrics_dir à None : ni
+    chargement ni sauvegarde (essais d'un sweep). report(episode, rewards_history) est
+    appelé après chaque épisode ; s'il renvoie False l'entraînement s'arrête.
+
+    Avec un qtable.Discretizer, les observations brutes de SumoEnv sont
+    discrétisées avec ses bornes et la Q-table est une SparseQTable (seuls
+    les états visités sont alloués), sauvegardée dans le dossier q_table_path.
+    distance_edges / speed_edges : le Discretizer est construit avec ces
+    bornes pour le nombre de voies du réseau (Discretizer.for_env).
+
+    pretrain_steps > 0 : une nouvelle Q-table (dense) est d'abord pré-apprise
+    sur le simulateur NumPy (surrogate.pretrain_q_table, 1024 épisodes en
+    parallèle), sans SUMO.
+    """
+    sparse = discretizer is not None or distance_edges is not None or speed_edges is not None
+    if pretrain_steps and sparse:
+        raise ValueError("Le pré-apprentissage sur le surrogate ne remplit que la Q-table dense")
+    eps = epsilon
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+
+    # ENTRAÎNEMENT SANS GUI
+    profiler = Profiler(tensorboard_dir="logs/q_learning/profile") if profile else NULL_PROFILER
+    if sparse:
+        env_kwargs["observation"] = "features"
+        if q_table_path == Q_TABLE_PATH:
+            q_table_path = SPARSE_Q_TABLE_PATH
+    env = SumoEnv(use_gui=False, profiler=profiler, **env_kwargs)
+    if sparse and discretizer is None:
+        discretizer = Discretizer.for_env(env.n_lanes, distance_edges or DISTANCE_EDGES, speed_edges or ())
+    elif sparse and len(discretizer.sizes) != env.n_lanes + 2:
+        env.close()
+        raise ValueError(f"Le Discretizer a {len(discretizer.sizes)} features, "
+                         f"SumoEnv en donne {env.n_lanes + 2} ({env.n_lanes} voies)")
+    if record_dir:
+        env = record_transitions(env, record_dir)
+    # Taille de l'espace d'états selon le nombre de voies du réseau (18 pour 2 voies)
+    n_state = env.n_states
+
+    # État -> ligne de la Q-table : index dense ou clé de la table creuse
+    encode = state_to_index if discretizer is None else discretizer.key
+
+    # --- POUR LES GRAPHIQUES ---
+    rewards_history = []
+    epsilons_history = []
+    reset_times = []
+    start_episode = 0
+
+    # --- REPRISE D'UN ENTRAÎNEMENT INTERROMPU, OU CHARGEMENT DE LA Q-TABLE ---
+    # Les points de sauvegarde n'existent que pendant un entraînement : ils
+    # sont effacés quand il va au bout. Relancer après un entraînement
+    # terminé repart donc de la Q-table sauvegardée, avec epsilon = 0.3.
+    checkpointer = AsyncCheckpointer(checkpoint_dir, keep=CHECKPOINT_KEEP) if checkpoint_dir else None
+    latest = checkpointer.latest(load_state) if checkpointer else None
+    if latest is not None:
+        ckpt = latest[1]
+        q_table = ckpt["q_table"]
+        eps = ckpt["epsilon"]
+        rewards_history = ckpt["rewards_history"]
+        epsilons_history = ckpt["epsilons_history"]
+        set_rng_state(ckpt["rng"])
+        start_episode = ckpt["episode"] + 1
+        print(f"--- Reprise depuis {latest[0]} (épisode {start_episode}) ---")
+    elif discretizer is not None:
+        if q_table_path and os.path.exists(q_table_path):
+            # Chargée en mémoire (mmap_mode=None) puisqu'elle va être modifiée
+            q_table = SparseQTable.load(q_table_path, mmap_mode=None)
+            if q_table.discretizer.to_dict() != discretizer.to_dict():
+                raise ValueError(f"{q_table_path} a été apprise avec d'autres bornes de discrétisation")
+            eps = 0.3
+            print(f"--- Q-Table creuse chargée ({len(q_table)} états) ---")
         else:
-            action = np.argmax(q_table[state, :])
-
-        next_state_raw, reward, done = env.step(action)
-        next_state_int = state_to_index(next_state_raw)
-
-        # Mise à jour
-        old_value = q_table[state, action]
-        next_max = np.max(q_table[next_state_int, :])
-        q_table[state, action] = (1 - alpha) * old_value + alpha * (reward + gamma * next_max)
-
-        state = next_state_int
-        total_reward += reward
-        if done: break
-
-    rewards_history.append(total_reward)
-    epsilons_history.append(epsilon)
-    epsilon = max(min_epsilon, epsilon * epsilon_decay)
-    
-    if episode % 10 == 0:
-        print(f"Episode {episode} | Reward: {total_reward:.2f} | Epsilon: {epsilon:.3f}")
-
-env.close()
-
-# --- SAUVEGARDE DE LA Q-TABLE ---
-np.save("q_table_highway.npy", q_table)
-print("--- Q-Table sauvegardée sous le nom 'q_table_highway.npy' ---")
-np.save(HISTORY_PATH, np.array(rewards_history))
-print("--- Q-Table et Historique sauvegardés dans src/ ---")
-# --- AFFICHAGE DES COURBES ---
-plt.figure(figsize=(12, 5))
-plt.subplot(1, 2, 1)
-plt.plot(rewards_history, color='blue', alpha=0.3, label='Reward Brut')
-if len(rewards_history) > 10:
-    rolling_mean = np.convolve(rewards_history, np.ones(10)/10, mode='valid')
-    plt.plot(rolling_mean, color='red', label='Moyenne Mobile (10)')
-plt.title('Évolution du Reward')
-plt.xlabel('Épisodes')
-plt.legend()
-
-plt.subplot(1, 2, 2)
-plt.plot(epsilons_history, color='green')
-plt.title('Décroissance de l\'Epsilon')
-plt.xlabel('Épisodes')
-plt.tight_layout()
-plt.show()
-
-# --- PHASE DE TEST VISUEL ---
-print("\n--- Début des tests (Visualisation) ---")
-env = SumoEnv(use_gui=True) 
-for ep in range(5):
-    state_raw = env.reset()
-    state = state_to_index(state_raw) 
-    done = False
-    while not done:
-        action = np.argmax(q_table[state, :])
-        next_state_raw, reward, done = env.step(action)
-        state = state_to_index(next_state_raw) 
-    print(f"Test Episode {ep} terminé.")
-env.close()
\ No newline at end of file
+            q_table = SparseQTable(n_actions, discretizer)
+    elif q_table_path and os.path.exists(q_table_path):
+        q_table = np.load(q_table_path)
+        # Si on charge une table apprise, on peut réduire epsilon pour moins de hasard
+        eps = 0.3
+        print("--- Q-Table chargée avec succès ! Reprise de l'apprentissage... ---")
+    else:
+        q_table = np.zeros((n_state, n_actions))
+        if verbose:
+            print("--- Nouvelle Q-Table créée ---")
+        if pretrain_steps:
+            from surrogate import pretrain_q_table
+            pretrain_q_table(q_table, n_steps=pretrain_steps, seed=seed,
+                             sumo_cfg=env.sumo_cfg, max_steps=env.max_steps)
+            if verbose:
+                print(f"--- Q-Table pré-apprise sur le surrogate ({pretrain_steps} pas) ---")
+
+    # Journal ouvert en ajout ; en reprise, les épisodes journalisés après le
+    # point de sauvegarde vont être rejoués et sont d'abord retirés
+    metrics = MetricsWriter(metrics_dir, Q_LEARNING_COLUMNS) if metrics_dir else None
+    if metrics is not None and latest is not None:
+        metrics.truncate_at("episode", start_episode)
+
+    def save_checkpoint(episode):
+        # Copie cohérente sérialisée ici, l'écriture disque se fait dans un autre thread
+        checkpointer.save(episode, dumps_state({
+            "episode": episode,
+            "q_table": q_table,
+            "epsilon": eps,
+            "rewards_history": rewards_history,
+            "epsilons_history": epsilons_history,
+            "rng": rng_state(),
+        }))
+
+    if verbose:
+        print("Arguments acceptés par SumoEnv:", inspect.signature(SumoEnv.__init__))
+        print("--- Début de l'entraînement (Mode Rapide) ---")
+
+    completed = True
+    for episode in range(start_episode, n_episodes):
+        t_episode = time.perf_counter()
+        state_raw = env.reset()
+        reset_times.append(env.last_reset_time)
+        state = encode(state_raw)
+        done = False
+        total_reward = 0
+
+        for step in range(env.max_steps):
+            with profiler.section("action_selection"):
+                if random.uniform(0, 1) < eps:
+                    action = random.randint(0, 2)
+                elif discretizer is None:
+                    action = np.argmax(q_table[state, :])
+                else:
+                    action = int(q_table.greedy(state))
+
+            next_state_raw, reward, done = env.step(action)
+            next_state_int = encode(next_state_raw)
+
+            # Mise à jour
+            if discretizer is None:
+                old_value = q_table[state, action]
+                next_max = np.max(q_table[next_state_int, :])
+                q_table[state, action] = (1 - alpha) * old_value + alpha * (reward + gamma * next_max)
+            else:
+                q_table.update(state, action, reward + gamma * q_table.max(next_state_int), alpha)
+
+            state = next_state_int
+            total_reward += reward
+            if done: break
+
+        rewards_history.append(total_reward)
+        epsilons_history.append(eps)
+        if metrics is not None:
+            metrics.append(episode=episode, reward=total_reward, length=step + 1, epsilon=eps,
+                           collisions=int(env.collision), reset_time=env.last_reset_time,
+                           episode_time=time.perf_counter() - t_episode, wall_time=time.time())
+        eps = max(min_epsilon, eps * epsilon_decay)
+
+        if verbose and episode % 10 == 0:
+            print(f"Episode {episode} | Reward: {total_reward:.2f} | Epsilon: {eps:.3f} "
+                  f"| Reset: {np.mean(reset_times[-10:]) * 1000:.1f} ms")
+            if profile and profiler.episodes:
+                print(format_summary(profiler.episodes[-1]))
+
+        if checkpointer and (episode + 1) % CHECKPOINT_EVERY == 0:
+            save_checkpoint(episode)
+        # Arrêt anticipé demandé par l'appelant (élagage d'un sweep)
+        if report is not None and report(episode, rewards_history) is False:
+            completed = False
+            break
+
+    env.close()
+    profiler.close()
+    if checkpointer:
+        checkpointer.close()
+    if metrics is not None:
+        metrics.close()
+
+    # --- SAUVEGARDE DE LA Q-TABLE ---
+    if q_table_path and discretizer is not None:
+        q_table.save(q_table_path)
+        print(f"--- Q-Table creuse ({len(q_table)} états, {q_table.nbytes / 1024:.1f} Ko) "
+              f"sauvegardée dans '{q_table_path}' ---")
+    elif q_table_path:
+        np.save(q_table_path, q_table)
+        print(f"--- Q-Table sauvegardée sous le nom '{q_table_path}' ---")
+    if history_path:
+        np.save(history_path, np.array(rewards_history))
+        print("--- Q-Table et Historique sauvegardés dans src/ ---")
+    # Entraînement terminé et sauvegardé : plus rien à reprendre
+    if checkpointer and completed:
+        checkpointer.clear()
+    return q_table, rewards_history, epsilons_history
+
+
+def plot_training(rewards_history, epsilons_history, path=None, show=True):
+    # --- AFFICHAGE DES COURBES ---
+    # Sans écran (show=False) : backend Agg, figure seulement enregistrée dans `path`
+    import matplotlib
+    if not show:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(12, 5))
+    plt.subplot(1, 2, 1)
+    plt.plot(rewards_history, color='blue', alpha=0.3, label='Reward Brut')
+    if len(rewards_history) > 10:
+        rolling_mean = np.convolve(rewards_history, np.ones(10)/10, mode='valid')
+        plt.plot(rolling_mean, color='red', label='Moyenne Mobile (10)')
+    plt.title('Évolution du Reward')
+    plt.xlabel('Épisodes')
+    plt.legend()
+
+    plt.subplot(1, 2, 2)
+    plt.plot(epsilons_history, color='green')
+    plt.title('Décroissance de l\'Epsilon')
+    plt.xlabel('Épisodes')
+    plt.tight_layout()
+    if path:
+        plt.savefig(path)
+        print(f"--- Courbes enregistrées dans {path} ---")
+    if show:
+        plt.show()
+    plt.close()
+
+
+def test_visual(q_table, n_episodes=5, record_dir=None):
+    # --- PHASE DE TEST VISUEL ---
+    # Avec record_dir : pas de GUI, les épisodes sont enregistrés (trajectories.py)
+    # et se rejouent ensuite avec replay.py, sans ralentir le test
+    print("\n--- Début des tests (Visualisation) ---")
+    sparse = isinstance(q_table, SparseQTable)
+    env = SumoEnv(use_gui=record_dir is None, observation="features" if sparse else "bins")
+    if record_dir:
+        env = record_trajectories(env, record_dir)
+    encode = q_table.discretizer.key if sparse else state_to_index
+    for ep in range(n_episodes):
+        state_raw = env.reset()
+        state = encode(state_raw)
+        done = False
+        while not done:
+            action = int(q_table.greedy(state)) if sparse else np.argmax(q_table[state, :])
+            next_state_raw, reward, done = env.step(action)
+            state = encode(next_state_raw)
+        print(f"Test Episode {ep} terminé.")
+    env.close()
+    if record_dir:
+        print(f"--- Trajectoires dans {record_dir}, à rejouer avec replay.py ---")
+
+
+if __name__ == "__main__":
+    q_table, rewards_history, epsilons_history = train()
+    plot_training(rewards_history, epsilons_history)
+    test_visual(q_table)
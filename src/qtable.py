@@ -0,0 +1,221 @@
+"""Sparse Q-tables over finely discretized SumoEnv features.
+
+A Discretizer maps raw feature vectors (lane, distances, speed...) to one
+integer key per state with per-feature bin edges; the number of possible
+states is the product of the bin counts, which quickly gets too large for a
+dense table. SparseQTable only stores the states actually visited: sorted
+uint64 keys and a float32 row of action values per key, looked up and
+updated a whole batch at a time with searchsorted.
+
+On disk a table is a directory that loads back memory-mapped:
+
+    q_table_highway.qtable/
+        keys.npy      uint64 (n,), sorted
+        values.npy    float32 (n, n_actions)
+        meta.json     bin edges, n_actions, format version
+"""
+import os
+import json
+import numpy as np
+
+FORMAT_VERSION = 1
+# SumoEnv's historical distance bins: < 5 m, < 15 m, further
+DISTANCE_EDGES = (5.0, 15.0)
+
+
+class Discretizer:
+    """Per-feature bin edges and the mixed-radix key of the binned vector.
+
+    Feature i falls in bin searchsorted(edges[i], x, side="right"), one of
+    len(edges[i]) + 1 bins; the first feature is the most significant digit.
+    A feature with no edges has one bin and does not change the key.
+    """
+
+    def __init__(self, edges):
+        self.edges = [np.asarray(e, dtype=np.float64) for e in edges]
+        self.sizes = [len(e) + 1 for e in self.edges]
+        n_states = 1
+        for size in self.sizes:
+            n_states *= size
+        if n_states >= 2 ** 63:
+            raise ValueError(f"{n_states} states do not fit in a 64 bit key, use fewer bins")
+        self.n_states = n_states
+        radix = [1]
+        for size in reversed(self.sizes[1:]):
+            radix.append(radix[-1] * size)
+        self.radix = np.array(radix[::-1], dtype=np.uint64)
+
+    @classmethod
+    def for_env(cls, n_lanes, distance_edges=DISTANCE_EDGES, speed_edges=()):
+        """Bins for SumoEnv.get_features(): lane, n_lanes distances, speed.
+
+        With the default edges the keys are the historical state_to_index of
+        SumoEnv's discrete states, so a dense table converts with from_dense().
+        """
+        lane_edges = np.arange(1, n_lanes) - 0.5
+        return cls([lane_edges] + [distance_edges] * n_lanes + [speed_edges])
+
+    def bins(self, features):
+        features = np.asarray(features, dtype=np.float64)
+        out = np.empty(features.shape, dtype=np.int64)
+        for i, edges in enumerate(self.edges):
+            out[..., i] = np.searchsorted(edges, features[..., i], side="right")
+        return out
+
+    def key(self, features):
+        """uint64 key of one (k,) feature vector, or (n,) keys of an (n, k) batch."""
+        bins = self.bins(features).astype(np.uint64)
+        return (bins * self.radix).sum(axis=-1, dtype=np.uint64)
+
+    def to_dict(self):
+        return {"edges": [e.tolist() for e in self.edges]}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["edges"])
+
+
+class SparseQTable:
+    """Action values of the visited states only, in float32.
+
+    get() and greedy() never allocate: unseen states read as `default`.
+    update() allocates the missing states of the batch, then applies
+    Q[s, a] += alpha * (mean target - Q[s, a]) once per distinct pair, so
+    repeated pairs in a batch count as one visit with their mean target (as
+    in surrogate.pretrain_q_table). A single transition is plain Q-learning.
+
+    New states go to a small sorted level first, merged into the main arrays
+    once it holds 1/32 of them: inserting into the main arrays directly would
+    move all of them for every new state.
+    """
+
+    def __init__(self, n_actions=3, discretizer=None, keys=None, values=None, default=0.0):
+        self.n_actions = n_actions
+        self.discretizer = discretizer
+        self.default = default
+        self.keys = np.zeros(0, dtype=np.uint64) if keys is None else keys
+        self.values = np.zeros((0, n_actions), dtype=np.float32) if values is None else values
+        self._new_keys = np.zeros(0, dtype=np.uint64)
+        self._new_values = np.zeros((0, n_actions), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.keys) + len(self._new_keys)
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + self.values.nbytes + self._new_keys.nbytes + self._new_values.nbytes
+
+    @staticmethod
+    def _find(sorted_keys, keys):
+        pos = np.searchsorted(sorted_keys, keys)
+        if not len(sorted_keys):
+            return pos, np.zeros(keys.shape, dtype=bool)
+        return pos, sorted_keys[np.minimum(pos, len(sorted_keys) - 1)] == keys
+
+    def get(self, keys):
+        """(n_actions,) values of one key, or (n, n_actions) of an (n,) batch."""
+        keys = np.asarray(keys, dtype=np.uint64)
+        out = np.full(keys.shape + (self.n_actions,), self.default, dtype=np.float32)
+        pos, found = self._find(self.keys, keys)
+        out[found] = self.values[pos[found]]
+        if len(self._new_keys) and not found.all():
+            new_pos, new_found = self._find(self._new_keys, keys)
+            out[new_found] = self._new_values[new_pos[new_found]]
+        return out
+
+    def greedy(self, keys):
+        return np.argmax(self.get(keys), axis=-1)
+
+    def max(self, keys):
+        return self.get(keys).max(axis=-1)
+
+    def compact(self):
+        """Merge the recently added states into the main sorted arrays."""
+        if not len(self._new_keys):
+            return
+        at = np.searchsorted(self.keys, self._new_keys)
+        self.keys = np.insert(self.keys, at, self._new_keys)
+        self.values = np.insert(np.asarray(self.values), at, self._new_values, axis=0)
+        self._new_keys = np.zeros(0, dtype=np.uint64)
+        self._new_values = np.zeros((0, self.n_actions), dtype=np.float32)
+
+    def _allocate(self, keys):
+        # Keys in neither level go to the recent one
+        _, found = self._find(self.keys, keys)
+        _, new_found = self._find(self._new_keys, keys)
+        missing = np.unique(keys[~(found | new_found)])
+        if not len(missing):
+            return
+        at = np.searchsorted(self._new_keys, missing)
+        self._new_keys = np.insert(self._new_keys, at, missing)
+        self._new_values = np.insert(self._new_values, at, np.full(
+            (len(missing), self.n_actions), self.default, dtype=np.float32), axis=0)
+        if len(self._new_keys) > max(1024, len(self.keys) // 32):
+            self.compact()
+
+    @staticmethod
+    def _apply(values, rows, actions, targets, alpha, n_actions):
+        pair, inverse = np.unique(rows * n_actions + actions, return_inverse=True)
+        mean = np.bincount(inverse, weights=targets) / np.bincount(inverse)
+        flat = values.reshape(-1)
+        flat[pair] += (alpha * (mean - flat[pair])).astype(np.float32)
+
+    def update(self, keys, actions, targets, alpha):
+        keys = np.atleast_1d(np.asarray(keys, dtype=np.uint64))
+        actions = np.atleast_1d(np.asarray(actions, dtype=np.int64))
+        targets = np.atleast_1d(np.asarray(targets, dtype=np.float64))
+        self._allocate(keys)
+        pos, found = self._find(self.keys, keys)
+        if found.any():
+            if not self.values.flags.writeable:
+                # Memory-mapped read-only: copy before the first write
+                self.values = np.array(self.values)
+            self._apply(self.values, pos[found], actions[found], targets[found], alpha, self.n_actions)
+        if not found.all():
+            new_pos, _ = self._find(self._new_keys, keys[~found])
+            self._apply(self._new_values, new_pos, actions[~found], targets[~found], alpha,
+                        self.n_actions)
+
+    @classmethod
+    def from_dense(cls, q_table, discretizer=None, default=0.0):
+        """The rows of a dense (n_states, n_actions) table that differ from `default`."""
+        q_table = np.asarray(q_table)
+        keep = (q_table != default).any(axis=1)
+        return cls(q_table.shape[1], discretizer, keys=np.flatnonzero(keep).astype(np.uint64),
+                   values=q_table[keep].astype(np.float32), default=default)
+
+    def to_dense(self, n_states=None):
+        self.compact()
+        n_states = n_states or self.discretizer.n_states
+        q_table = np.full((n_states, self.n_actions), self.default)
+        q_table[self.keys.astype(np.int64)] = self.values
+        return q_table
+
+    def save(self, path):
+        self.compact()
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "keys.npy"), np.asarray(self.keys))
+        np.save(os.path.join(path, "values.npy"), np.asarray(self.values))
+        meta = {
+            "format": FORMAT_VERSION,
+            "n_actions": self.n_actions,
+            "default": self.default,
+            "discretizer": self.discretizer.to_dict() if self.discretizer else None,
+        }
+        # Written last: a directory with meta.json is complete
+        with open(os.path.join(path, "meta.json.tmp"), "w") as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(path, "meta.json.tmp"), os.path.join(path, "meta.json"))
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """A saved table; by default memory-mapped, values copied on the first update."""
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta["format"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported Q-table format {meta['format']} in {path}")
+        discretizer = Discretizer.from_dict(meta["discretizer"]) if meta["discretizer"] else None
+        return cls(meta["n_actions"], discretizer,
+                   keys=np.load(os.path.join(path, "keys.npy"), mmap_mode=mmap_mode),
+                   values=np.load(os.path.join(path, "values.npy"), mmap_mode=mmap_mode),
+                   default=meta["default"])
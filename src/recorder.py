@@ -0,0 +1,198 @@
+import os
+import numpy as np
+import gymnasium as gym
+from chunked import ChunkedWriter, MANIFEST, read_manifest
+
+FIELDS = ("obs", "action", "reward", "next_obs", "done")
+
+
+class TransitionWriter(ChunkedWriter):
+    """Appends transitions to preallocated, chunked .npy memmaps (chunked.ChunkedWriter).
+
+    RAM use is bounded by the dirty pages of one chunk; after a crash,
+    readers see everything up to the last flush and nothing half written.
+    Opening an existing directory appends to it.
+    """
+
+    def __init__(self, directory, obs_shape, obs_dtype=np.float32, action_dtype=np.int8,
+                 chunk_size=65536, flush_every=4096):
+        self.obs_shape = tuple(obs_shape)
+        super().__init__(directory, {
+            "obs": (obs_dtype, self.obs_shape),
+            "action": action_dtype,
+            "reward": np.float32,
+            "next_obs": (obs_dtype, self.obs_shape),
+            "done": np.bool_,
+        }, chunk_size=chunk_size, flush_every=flush_every)
+
+    def append(self, obs, action, reward, next_obs, done):
+        super().append(obs=obs, action=action, reward=reward, next_obs=next_obs, done=done)
+
+    def manifest(self):
+        return {**super().manifest(), "fields": list(FIELDS), "obs_shape": list(self.obs_shape)}
+
+
+class TransitionDataset:
+    """Read-only view over one recorder directory, or over every one below a root.
+
+    Chunks are opened with mmap_mode="r" and cut to their flushed length, so
+    chunk(k)[field] and slices that stay within a chunk are zero-copy views;
+    a slice across chunks is concatenated.
+    """
+
+    def __init__(self, path):
+        self.chunks = []
+        # What slices of a dataset without rows return, set from the first manifest
+        self._empty = None
+        dirs = sorted(root for root, _, files in os.walk(path) if MANIFEST in files)
+        if not dirs:
+            raise FileNotFoundError(f"No {MANIFEST} under {path}")
+        for directory in dirs:
+            manifest = read_manifest(directory)
+            if self._empty is None:
+                obs_shape = tuple(manifest["obs_shape"])
+                self._empty = {field: np.empty((0,) + (obs_shape if field in ("obs", "next_obs") else ()),
+                                               dtype=manifest["dtypes"][field])
+                               for field in FIELDS}
+            for chunk in manifest["chunks"]:
+                if chunk["length"] == 0:
+                    continue
+                chunk_dir = os.path.join(directory, chunk["name"])
+                self.chunks.append({
+                    field: np.load(os.path.join(chunk_dir, field + ".npy"), mmap_mode="r")[:chunk["length"]]
+                    for field in manifest["fields"]
+                })
+        self.fields = FIELDS
+        lengths = [len(c["done"]) for c in self.chunks]
+        self.offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def chunk(self, k):
+        return self.chunks[k]
+
+    def iter_chunks(self):
+        return iter(self.chunks)
+
+    def column(self, field):
+        """Views of one field, one per chunk."""
+        return [c[field] for c in self.chunks]
+
+    def _chunk_of(self, index):
+        return min(int(np.searchsorted(self.offsets, index, side="right")) - 1, len(self.chunks) - 1)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            n = len(self)
+            if not -n <= index < n:
+                raise IndexError(index)
+            index = int(index) % n
+            k = self._chunk_of(index)
+            return {field: self.chunks[k][field][index - self.offsets[k]] for field in self.fields}
+
+        if not self.chunks:
+            return {field: self._empty[field][index] for field in self.fields}
+        start, stop, step = index.indices(len(self))
+        if step < 0:
+            return {field: np.concatenate(self.column(field))[index] for field in self.fields}
+        stop = max(stop, start)
+        k = self._chunk_of(start)
+        if k < 0 or stop <= self.offsets[k + 1]:
+            # Within one chunk: a view on the memmap
+            base = self.offsets[max(k, 0)]
+            return {field: self.chunks[max(k, 0)][field][start - base:stop - base:step]
+                    for field in self.fields}
+        out = {}
+        for field in self.fields:
+            parts = []
+            for j in range(k, len(self.chunks)):
+                if self.offsets[j] >= stop:
+                    break
+                lo, hi = max(start - self.offsets[j], 0), min(stop, self.offsets[j + 1]) - self.offsets[j]
+                parts.append(self.chunks[j][field][lo:hi])
+            out[field] = np.concatenate(parts)[::step]
+        return out
+
+
+def _time_limit(env):
+    # SumoEnv and SumoContinuousEnv end an episode at max_steps with done /
+    # terminated set, the ego still alive: a time limit, not a terminal state
+    env = getattr(env, "unwrapped", env)
+    return env.step_count >= env.max_steps and env.observer.alive
+
+
+class TransitionRecorder:
+    """Records every SumoEnv transition (reset() -> s, step(a) -> (s, r, done)).
+
+    The time limit is stored as done=False, so that offline learning
+    bootstraps from next_obs; done is left to collisions.
+    """
+
+    def __init__(self, env, directory, **writer_kwargs):
+        self.env = env
+        if getattr(env, "observation", "bins") == "features":
+            # Raw [lane, distances..., speed] features (qtable.Discretizer)
+            writer_kwargs.setdefault("obs_dtype", np.float32)
+            obs_shape = (env.n_lanes + 2,)
+        else:
+            writer_kwargs.setdefault("obs_dtype", np.int8)
+            obs_shape = (env.n_lanes + 1,)
+        self.writer = TransitionWriter(directory, obs_shape=obs_shape, **writer_kwargs)
+        self._obs = None
+
+    def reset(self, *args, **kwargs):
+        self._obs = self.env.reset(*args, **kwargs)
+        return self._obs
+
+    def step(self, action):
+        next_obs, reward, done = self.env.step(action)
+        self.writer.append(self._obs, action, reward, next_obs, done and not _time_limit(self.env))
+        self._obs = next_obs
+        return next_obs, reward, done
+
+    def close(self):
+        self.writer.close()
+        self.env.close()
+
+    def __getattr__(self, name):
+        return getattr(self.env, name)
+
+
+class GymTransitionRecorder(gym.Wrapper):
+    """Records every transition of a gym env such as SumoContinuousEnv.
+
+    done is `terminated` only, and SumoContinuousEnv's terminated=True at
+    max_steps is stored as done=False: an episode cut by the time limit or a
+    SUMO crash still bootstraps from next_obs.
+    """
+
+    def __init__(self, env, directory, **writer_kwargs):
+        super().__init__(env)
+        writer_kwargs.setdefault("obs_dtype", env.observation_space.dtype)
+        self.writer = TransitionWriter(directory, obs_shape=env.observation_space.shape,
+                                       **writer_kwargs)
+        self._obs = None
+
+    def reset(self, **kwargs):
+        obs, info = self.env.reset(**kwargs)
+        self._obs = obs
+        return obs, info
+
+    def step(self, action):
+        next_obs, reward, terminated, truncated, info = self.env.step(action)
+        done = terminated and not _time_limit(self.env)
+        self.writer.append(self._obs, action, reward, next_obs, done)
+        self._obs = next_obs
+        return next_obs, reward, terminated, truncated, info
+
+    def close(self):
+        self.writer.close()
+        super().close()
+
+
+def record_transitions(env, directory, **writer_kwargs):
+    """Wrap SumoEnv or a gym env so that its transitions go to `directory`."""
+    if isinstance(env, gym.Env):
+        return GymTransitionRecorder(env, directory, **writer_kwargs)
+    return TransitionRecorder(env, directory, **writer_kwargs)
@@ -0,0 +1,173 @@
+"""Replay episodes recorded with trajectories.py, after the fact.
+
+    python replay.py results/trajectories                         # list the episodes
+    python replay.py results/trajectories/episode_000003.npz      # plot
+    python replay.py episode_000003.npz --step 40 --save ep3.png  # plot, frame 40 in the top panel
+    python replay.py episode_000003.npz --gui --start 40 --delay 100
+
+The plot shows a bird's-eye view of one frame, the position over time of
+the ego and of the vehicles around it, and the actions and rewards. In
+sumo-gui the vehicles are placed at their recorded positions frame by frame
+(nothing is simulated), so --start seeks straight to any frame; --end stops
+earlier. The evaluation that recorded the episode never waited for either.
+"""
+import os
+import argparse
+import numpy as np
+from trajectories import Trajectory, list_trajectories
+
+# Around the ego in the bird's-eye view (metres)
+VIEW_BEHIND = 30.0
+VIEW_AHEAD = 120.0
+
+
+def action_names(trajectory):
+    """Action number -> name, as recorded from the env (plain numbers in older files)."""
+    names = {-1: "reset"}
+    names.update(enumerate(trajectory.meta.get("action_names", ())))
+    return names
+
+
+def plot(trajectory, step=0, path=None, show=True):
+    """Bird's-eye view at `step`, space-time diagram and actions/rewards."""
+    import matplotlib
+    if not show:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    traj = trajectory
+    n_lanes = traj.meta["n_lanes"]
+    frame = traj[step]
+    fig, (ax_view, ax_xt, ax_r) = plt.subplots(
+        3, 1, figsize=(12, 9), gridspec_kw={"height_ratios": [1, 3, 1.5]})
+
+    # Bird's-eye view: lane 0 at the bottom like in sumo-gui
+    x0 = frame["ego_pos"]
+    ax_view.scatter(frame["positions"], frame["lanes"], marker="s", s=60, color="grey", label="vehicles")
+    if frame["ego_alive"]:
+        ax_view.scatter([x0], [frame["ego_lane"]], marker=">", s=90, color="red", label="ego")
+    ax_view.set_xlim(x0 - VIEW_BEHIND, x0 + VIEW_AHEAD)
+    ax_view.set_ylim(-0.5, n_lanes - 0.5)
+    ax_view.set_yticks(range(n_lanes))
+    ax_view.set_ylabel("lane")
+    ax_view.set_title(f"{os.path.basename(traj.path)} | frame {step % len(traj)} | t={frame['time']:g} s | "
+                      f"{action_names(traj).get(frame['action'], frame['action'])} | "
+                      f"reward {frame['reward']:.2f}")
+
+    # Space-time: every vehicle sighting, coloured by lane, and the ego
+    counts = np.diff(traj.veh_offsets)
+    times = np.repeat(traj.time, counts)
+    for lane in range(n_lanes):
+        on_lane = traj.veh_lane == lane
+        ax_xt.scatter(times[on_lane], traj.veh_pos[on_lane], s=4, label=f"lane {lane}")
+    alive = traj.ego_alive
+    ax_xt.plot(traj.time[alive], traj.ego_pos[alive], color="red", label="ego")
+    ax_xt.axvline(frame["time"], color="black", linewidth=0.8)
+    ax_xt.set_ylabel("position (m)")
+    ax_xt.legend(loc="upper left", fontsize="small")
+
+    ax_r.step(traj.time[1:], traj.reward[1:], where="post", label="reward")
+    changes = traj.action > 0
+    ax_r.scatter(traj.time[changes], traj.reward[changes], color="orange", s=12, label="lane change")
+    ax_r.axvline(frame["time"], color="black", linewidth=0.8)
+    ax_r.set_xlabel("time (s)")
+    ax_r.legend(loc="lower left", fontsize="small")
+    fig.tight_layout()
+
+    if path:
+        fig.savefig(path)
+        print(f"Saved {path}")
+    if show:
+        plt.show()
+    plt.close(fig)
+
+
+def replay_sumo(trajectory, start=0, end=None, gui=True, delay=100, backend=None, on_frame=None):
+    """Place the recorded vehicles in SUMO frame by frame, from frame `start` to `end`.
+
+    Only the net is loaded; the vehicles stand still (speed 0) and are moved
+    to their recorded lane and position before every step. A vehicle added
+    for a frame shows up at the next one, once SUMO inserted it.
+    on_frame(i, conn) is called after the step of frame i.
+    """
+    from scenario import cached_scenario
+    from utils import start_sumo, close_sumo, resolve_backend
+
+    traj = trajectory
+    meta = traj.meta
+    edge, ego_id = meta["edge"], meta["ego_id"]
+    end = len(traj) if end is None else min(end, len(traj))
+    cmd = [
+        "sumo-gui" if gui else "sumo",
+        "-n", cached_scenario(meta["sumo_cfg"])["net_file"],
+        "--start", "true",
+        "--quit-on-end", "true",
+        "--collision.action", "none",
+        "--xml-validation", "never",
+        "--step-length", str(meta["step_length"]),
+        "--begin", str(float(traj.time[start])),
+        "--no-step-log", "true",
+    ]
+    if gui:
+        cmd += ["--delay", str(delay)]
+    conn = start_sumo(cmd, label_prefix="replay", backend=resolve_backend(backend, gui=gui))
+    try:
+        conn.route.add("replay", [edge])
+        conn.vehicletype.copy("DEFAULT_VEHTYPE", "replay_ego")
+        conn.vehicletype.setColor("replay_ego", (255, 0, 0, 255))
+        conn.vehicletype.copy("DEFAULT_VEHTYPE", "replay_obstacle")
+        conn.vehicletype.setColor("replay_obstacle", (160, 160, 160, 255))
+        added, inserted = set(), set()
+
+        for i in range(start, end):
+            frame = traj[i]
+            wanted = dict(zip(frame["vehicles"], zip(frame["lanes"].tolist(), frame["positions"].tolist())))
+            if frame["ego_alive"]:
+                wanted[ego_id] = (frame["ego_lane"], frame["ego_pos"])
+            for veh in added - wanted.keys():
+                conn.vehicle.remove(veh)
+            added &= wanted.keys()
+            inserted &= added
+            for veh, (lane, pos) in wanted.items():
+                if veh in inserted:
+                    conn.vehicle.moveTo(veh, f"{edge}_{lane}", pos)
+                elif veh not in added:
+                    conn.vehicle.add(veh, "replay", typeID="replay_ego" if veh == ego_id else "replay_obstacle",
+                                     depart="now", departLane=str(lane), departPos=str(pos), departSpeed="0")
+                    conn.vehicle.setSpeed(veh, 0)
+                    added.add(veh)
+            conn.simulationStep()
+            inserted |= added & set(conn.simulation.getDepartedIDList())
+            if on_frame is not None:
+                on_frame(i, conn)
+    finally:
+        close_sumo(conn)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded trajectories in sumo-gui or as a plot")
+    parser.add_argument("path", help="an episode .npz, or a recording directory to list")
+    parser.add_argument("--step", type=int, default=0, help="frame shown in the plot's top panel")
+    parser.add_argument("--save", default=None, help="save the plot to this image (headless)")
+    parser.add_argument("--gui", action="store_true", help="replay in sumo-gui instead of plotting")
+    parser.add_argument("--start", type=int, default=0, help="first frame of the sumo-gui replay")
+    parser.add_argument("--end", type=int, default=None, help="frame where the sumo-gui replay stops")
+    parser.add_argument("--delay", type=int, default=100, help="sumo-gui delay per frame (ms)")
+    args = parser.parse_args(argv)
+
+    if os.path.isdir(args.path):
+        for path in list_trajectories(args.path):
+            traj = Trajectory(path)
+            print(f"{os.path.basename(path)}: {len(traj)} frames, {traj.time[-1]:g} s, "
+                  f"return {traj.reward.sum():.2f}{'' if traj.ego_alive[-1] else ', ego removed'}")
+        return
+
+    traj = Trajectory(args.path)
+    if args.gui:
+        replay_sumo(traj, start=args.start, end=args.end, delay=args.delay)
+    else:
+        plot(traj, step=args.step, path=args.save, show=args.save is None)
+
+
+if __name__ == "__main__":
+    main()
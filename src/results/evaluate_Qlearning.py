@@ -1,8 +1,20 @@
-import numpy as np
+import os
+import sys
 import matplotlib.pyplot as plt
 
-history = np.load("src/rewards_history.npy")
-plt.plot(history, label="Reward")
+METRICS_DIR = "logs/q_learning/metrics"
+
+if os.path.exists(os.path.join(METRICS_DIR, "manifest.json")):
+    # Journal écrit pendant l'entraînement : seule la colonne reward est lue
+    sys.path.insert(0, "src")
+    from metrics import MetricsLog
+    log = MetricsLog(METRICS_DIR)
+    episodes, history = log.column("episode"), log.column("reward")
+else:
+    import numpy as np
+    history = np.load("src/rewards_history.npy")
+    episodes = np.arange(len(history))
+plt.plot(episodes, history, label="Reward")
 plt.title("Historique d'apprentissage")
 plt.legend()
-plt.show()
\ No newline at end of file
+plt.show()
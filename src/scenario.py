@@ -0,0 +1,204 @@
+import os
+import pickle
+import hashlib
+import xml.etree.ElementTree as ET
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "sumo-lane-change", "scenarios")
+# Part of the cache file name: bump it when load_scenario's output changes
+CACHE_VERSION = 2
+
+# SUMO defaults for a "passenger" vType, used for every attribute the route
+# file leaves out.
+VTYPE_DEFAULTS = {
+    "length": 5.0,
+    "minGap": 2.5,
+    "accel": 2.6,
+    "decel": 4.5,
+    "emergencyDecel": 9.0,
+    "sigma": 0.5,
+    "tau": 1.0,
+    "maxSpeed": 200 / 3.6,
+    "speedFactor": 1.0,
+    "speedDev": 0.1,
+}
+
+
+def _config_files(sumo_cfg):
+    root = ET.parse(sumo_cfg).getroot()
+    base = os.path.dirname(os.path.abspath(sumo_cfg))
+    inputs = root.find("input")
+    net_file = os.path.join(base, inputs.find("net-file").get("value"))
+    route_files = [os.path.join(base, f.strip())
+                   for f in inputs.find("route-files").get("value").split(",")]
+    return net_file, route_files
+
+
+def scenario_hash(sumo_cfg):
+    """SHA-1 of the .sumocfg and of the net and route files it points to."""
+    net_file, route_files = _config_files(sumo_cfg)
+    h = hashlib.sha1()
+    for path in [sumo_cfg, net_file] + route_files:
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def _parse_net(net_file):
+    edges = {}
+    for edge in ET.parse(net_file).getroot().iter("edge"):
+        if edge.get("function") == "internal":
+            continue
+        lanes = sorted(edge.iter("lane"), key=lambda l: int(l.get("index")))
+        edges[edge.get("id")] = {
+            "n_lanes": len(lanes),
+            "length": float(lanes[0].get("length")),
+            "speed": float(lanes[0].get("speed")),
+            # Per lane, in lane index order
+            "lane_lengths": np.array([float(l.get("length")) for l in lanes]),
+            "lane_speeds": np.array([float(l.get("speed")) for l in lanes]),
+        }
+    return edges
+
+
+def _parse_routes(route_files):
+    vtypes, routes, vehicles = {}, {}, []
+    for route_file in route_files:
+        root = ET.parse(route_file).getroot()
+        for vt in root.iter("vType"):
+            params = dict(VTYPE_DEFAULTS)
+            for key, default in VTYPE_DEFAULTS.items():
+                if vt.get(key) is not None:
+                    params[key] = float(vt.get(key))
+            vtypes[vt.get("id")] = params
+        for r in root.iter("route"):
+            routes[r.get("id")] = r.get("edges").split()
+        for tag in ("trip", "vehicle"):
+            for v in root.iter(tag):
+                if tag == "trip":
+                    # A trip inside one edge is that edge, otherwise routed by SUMO
+                    edges = tuple(dict.fromkeys((v.get("from"), v.get("to"))))
+                else:
+                    edges = tuple(routes[v.get("route")])
+                vehicles.append({
+                    "id": v.get("id"),
+                    "type": v.get("type", "DEFAULT_VEHTYPE"),
+                    "depart": float(v.get("depart", 0)),
+                    "pos": float(v.get("departPos", 0)),
+                    "lane": int(v.get("departLane", 0)),
+                    # Empty: the simulation's --default.departspeed
+                    "depart_speed": v.get("departSpeed", ""),
+                    "edge": edges[0],
+                    "route": edges,
+                })
+    return vtypes, routes, vehicles
+
+
+def load_scenario(sumo_cfg):
+    """Static description of a SUMO scenario, read from its net and route files.
+
+    Returns a dict with the per-edge lane data, the vTypes and the scheduled
+    vehicles as NumPy arrays (id, lane, departPos, depart, first edge) sorted
+    by position, plus the list of their route edges.
+    """
+    net_file, route_files = _config_files(sumo_cfg)
+    edges = _parse_net(net_file)
+    vtypes, routes, vehicles = _parse_routes(route_files)
+    vehicles.sort(key=lambda v: v["pos"])
+    return {
+        "net_file": net_file,
+        "route_files": route_files,
+        "edges": edges,
+        "vtypes": vtypes,
+        "routes": routes,
+        "vehicle_ids": np.array([v["id"] for v in vehicles]),
+        "vehicle_types": np.array([v["type"] for v in vehicles]),
+        "vehicle_lanes": np.array([v["lane"] for v in vehicles], dtype=np.int32),
+        "vehicle_pos": np.array([v["pos"] for v in vehicles], dtype=np.float64),
+        "vehicle_depart": np.array([v["depart"] for v in vehicles], dtype=np.float64),
+        "vehicle_depart_speed": np.array([v["depart_speed"] for v in vehicles]),
+        "vehicle_edges": np.array([v["edge"] for v in vehicles]),
+        "vehicle_routes": [v["route"] for v in vehicles],
+    }
+
+
+_memory_cache = {}
+
+
+def cached_scenario(sumo_cfg, cache_dir=DEFAULT_CACHE_DIR):
+    """load_scenario() through a pickle cache keyed by scenario_hash.
+
+    The files are hashed on every call, so an edited net or route file is
+    parsed again; otherwise the dict comes from memory or from
+    `<cache_dir>/<hash>.v<CACHE_VERSION>.pkl`. Pass cache_dir=None to keep it
+    in memory only.
+    """
+    key = scenario_hash(sumo_cfg)
+    if key in _memory_cache:
+        return _memory_cache[key]
+
+    path = os.path.join(cache_dir, f"{key}.v{CACHE_VERSION}.pkl") if cache_dir else None
+    scenario = None
+    if path and os.path.exists(path):
+        try:
+            with open(path, "rb") as f:
+                scenario = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            scenario = None
+    if scenario is None:
+        scenario = load_scenario(sumo_cfg)
+        if path:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                pickle.dump(scenario, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+    _memory_cache[key] = scenario
+    return scenario
+
+
+# Route file elements that schedule traffic; everything else (vTypes, routes,
+# distributions) is kept in the definitions file
+TRAFFIC_TAGS = {"trip", "vehicle", "flow", "person", "personFlow", "container", "containerFlow"}
+
+
+def definitions_file(sumo_cfg, cache_dir=DEFAULT_CACHE_DIR):
+    """Path of a route file with the scenario's definitions but no traffic.
+
+    Written once per scenario hash next to the scenario cache; passed as
+    --route-files it replaces the .sumocfg's route files, so SUMO starts
+    with an empty road and the vehicles are inserted through TraCI.
+    """
+    path = os.path.join(cache_dir, scenario_hash(sumo_cfg) + ".defs.rou.xml")
+    if os.path.exists(path):
+        return path
+    routes = ET.Element("routes")
+    for route_file in _config_files(sumo_cfg)[1]:
+        for child in ET.parse(route_file).getroot():
+            if child.tag not in TRAFFIC_TAGS:
+                routes.append(child)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    ET.ElementTree(routes).write(tmp, encoding="UTF-8", xml_declaration=True)
+    os.replace(tmp, path)
+    return path
+
+
+def route_metadata(scenario, route="r_0", vtype="obstacle"):
+    """What an env driving `route` with a `vtype` vehicle needs from the scenario.
+
+    The first edge of the route gives the lane count, lengths and speed
+    limits; the vType gives the vehicle's own max speed (the reward's
+    normalizer in SumoContinuousEnv).
+    """
+    edge_id = scenario["routes"][route][0]
+    edge = scenario["edges"][edge_id]
+    params = scenario["vtypes"].get(vtype, VTYPE_DEFAULTS)
+    return {
+        "edge": edge_id,
+        "n_lanes": edge["n_lanes"],
+        "lane_lengths": edge["lane_lengths"],
+        "lane_speeds": edge["lane_speeds"],
+        "max_speed": params["maxSpeed"],
+        "vtype": params,
+    }
@@ -0,0 +1,81 @@
+import os
+import itertools
+from collections import namedtuple
+from scenario import scenario_hash
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "sumo-lane-change", "snapshots")
+
+# Options needed for a saved state to continue exactly like the original run:
+# the random number generators and full float precision (default is 2 digits).
+SNAPSHOT_ARGS = ["--save-state.rng", "true", "--save-state.precision", "17"]
+
+# What restore() needs besides the SUMO state: SUMO does not save the settings
+# made through TraCI, so the env re-applies them (see the envs' _apply_overrides).
+Snapshot = namedtuple("Snapshot", ["path", "step_count", "lane_request"])
+
+
+class SnapshotCache:
+    """SUMO state files on disk, least recently used evicted past max_entries.
+
+    Reset snapshots are keyed by scenario file hash, SUMO seed and env, so a
+    changed net or route file never restores a stale state. Branch snapshots
+    taken mid-episode share the same directory and eviction.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_entries=64):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self._hashes = {}
+        self._branch_counter = itertools.count()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def reset_key(self, sumo_cfg, seed=None, tag=""):
+        if sumo_cfg not in self._hashes:
+            self._hashes[sumo_cfg] = scenario_hash(sumo_cfg)[:16]
+        return f"{self._hashes[sumo_cfg]}-seed{seed}-{tag}"
+
+    def branch_key(self):
+        return f"branch-{os.getpid()}-{next(self._branch_counter)}"
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + ".xml")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            # mtime is the LRU clock
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, save_state):
+        """Write a state with save_state(path) (e.g. conn.simulation.saveState)."""
+        path = self.path(key)
+        # Same extension, SUMO picks the state format from it
+        tmp = os.path.join(self.cache_dir, f"{key}.{os.getpid()}.tmp.xml")
+        save_state(tmp)
+        os.replace(tmp, path)
+        self.evict()
+        return path
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".xml") and not name.endswith(".tmp.xml"):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except FileNotFoundError:
+                    pass  # evicted by another worker
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".xml"):
+                os.remove(os.path.join(self.cache_dir, name))
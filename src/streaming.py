@@ -0,0 +1,163 @@
+import heapq
+import traci.constants as tc
+from scenario import DEFAULT_CACHE_DIR, cached_scenario, definitions_file
+from utils import TRACI_ERRORS
+
+
+class ObstacleStream:
+    """Insert the scenario's vehicles as the ego approaches them and remove them behind it.
+
+    SUMO is started on definitions_file() instead of the route files. After
+    each simulation step, update(conn, ego_pos) inserts the vehicles whose
+    departPos is less than `lookahead` metres ahead of the ego (not before
+    their depart time) and removes the ones that are more than `trailing`
+    metres behind it. The schedule is sorted by departPos and walked with a
+    cursor, and only the vehicles inserted and not yet removed are looked at,
+    so a step costs the same on a 1 km road and on a 50 km one.
+
+    Positions are lane positions on the ego's edge: only vehicles departing
+    on that edge are streamed, the others are inserted at their depart time
+    and left to SUMO.
+    """
+
+    def __init__(self, sumo_cfg, edge, lookahead=200.0, trailing=50.0, on_insert=None,
+                 cache_dir=DEFAULT_CACHE_DIR):
+        self.lookahead = lookahead
+        self.trailing = trailing
+        # on_insert(conn, veh_id): TraCI settings for a vehicle, applied after
+        # the step that inserted it (like overrides made after the first step)
+        self.on_insert = on_insert
+        self.defs_file = definitions_file(sumo_cfg, cache_dir)
+
+        scenario = cached_scenario(sumo_cfg, cache_dir)
+        # One TraCI route per distinct edge list (a two-edge trip is routed by SUMO)
+        self.routes = {}
+        route_ids = [self.routes.setdefault(edges, f"stream_r{len(self.routes)}")
+                     for edges in scenario["vehicle_routes"]]
+        on_edge = scenario["vehicle_edges"] == edge
+        # Streamed vehicles in departPos order (load_scenario sorts by position)
+        streamed = on_edge.nonzero()[0]
+        self.ids = scenario["vehicle_ids"][streamed].tolist()
+        self.pos = scenario["vehicle_pos"][streamed].tolist()
+        self.lanes = scenario["vehicle_lanes"][streamed].tolist()
+        self.depart = scenario["vehicle_depart"][streamed].tolist()
+        self.types = scenario["vehicle_types"][streamed].tolist()
+        self.speeds = scenario["vehicle_depart_speed"][streamed].tolist()
+        self.route_ids = [route_ids[i] for i in streamed]
+        # The others in depart order
+        others = sorted((~on_edge).nonzero()[0], key=lambda i: scenario["vehicle_depart"][i])
+        self.others = [(float(scenario["vehicle_depart"][i]), str(scenario["vehicle_ids"][i]),
+                        route_ids[i], str(scenario["vehicle_types"][i]),
+                        int(scenario["vehicle_lanes"][i]), float(scenario["vehicle_pos"][i]),
+                        str(scenario["vehicle_depart_speed"][i]))
+                       for i in others]
+
+        # For the vehicles without a departSpeed, read from SUMO in sync()
+        self.default_speed = "0"
+        self._next = 0
+        self._next_other = 0
+        # Entered the window before their depart time
+        self._waiting = []
+        # Heap of (last known position, index) of the streamed vehicles in the simulation
+        self.active = []
+        # Added since the last update()
+        self._added = []
+
+    def sumo_args(self):
+        return ["--route-files", self.defs_file]
+
+    def tag(self):
+        return f"stream{self.lookahead:g}-{self.trailing:g}"
+
+    def sync(self, conn, ego_pos):
+        """Start over after SUMO (re)loaded the scenario or a saved state.
+
+        Vehicles already in the simulation are adopted, the ones behind the
+        window are skipped, the rest is inserted as usual.
+        """
+        for edges, route_id in self.routes.items():
+            try:
+                conn.route.add(route_id, list(edges))
+            except TRACI_ERRORS:
+                pass  # in the loaded state already
+        self.default_speed = conn.simulation.getOption("default.departspeed")
+        present = set(conn.vehicle.getIDList()) | set(conn.simulation.getPendingVehicles())
+        self._next = self._next_other = 0
+        self._waiting = []
+        self.active = []
+        self._added = []
+        back = ego_pos - self.trailing
+        while self._next < len(self.ids) and self.pos[self._next] < ego_pos + self.lookahead:
+            i = self._next
+            self._next += 1
+            if self.ids[i] in present:
+                self._adopt(conn, i)
+                if self.on_insert is not None:
+                    self.on_insert(conn, self.ids[i])
+            elif self.pos[i] >= back:
+                self._waiting.append(i)
+        # The others due before the loaded time were inserted before it
+        now = conn.simulation.getTime()
+        while self._next_other < len(self.others) and self.others[self._next_other][0] < now:
+            self._next_other += 1
+        self.update(conn, ego_pos)
+
+    def _adopt(self, conn, i):
+        conn.vehicle.subscribe(self.ids[i], (tc.VAR_LANEPOSITION,))
+        heapq.heappush(self.active, (self.pos[i], i))
+
+    def _add(self, conn, veh, route_id, type_id, lane, pos, speed):
+        # As if it departed from the route file, only later
+        conn.vehicle.add(veh, route_id, typeID=type_id, depart="now", departLane=str(lane),
+                         departPos=str(pos), departSpeed=speed or self.default_speed)
+        self._added.append(veh)
+
+    def update(self, conn, ego_pos):
+        if self.on_insert is not None:
+            for veh in self._added:
+                self.on_insert(conn, veh)
+        self._added = []
+
+        front, back = ego_pos + self.lookahead, ego_pos - self.trailing
+        while self._next < len(self.ids) and self.pos[self._next] < front:
+            self._waiting.append(self._next)
+            self._next += 1
+
+        now = None
+        if self._waiting or self._next_other < len(self.others):
+            now = conn.simulation.getTime()
+        if self._waiting:
+            waiting = []
+            for i in self._waiting:
+                if self.pos[i] < back:
+                    continue  # passed before it was due
+                if self.depart[i] > now:
+                    waiting.append(i)
+                    continue
+                self._add(conn, self.ids[i], self.route_ids[i], self.types[i], self.lanes[i],
+                          self.pos[i], self.speeds[i])
+                self._adopt(conn, i)
+            self._waiting = waiting
+        while self._next_other < len(self.others) and self.others[self._next_other][0] <= now:
+            self._add(conn, *self.others[self._next_other][1:])
+            self._next_other += 1
+
+        # Vehicles only move forward: only those last seen behind `back` can
+        # be behind it, a vehicle is looked at again once the ego passed it
+        while self.active and self.active[0][0] < back:
+            _, i = heapq.heappop(self.active)
+            veh = self.ids[i]
+            res = conn.vehicle.getSubscriptionResults(veh)
+            if res and res[tc.VAR_LANEPOSITION] >= back:
+                heapq.heappush(self.active, (res[tc.VAR_LANEPOSITION], i))
+                continue
+            if not res and veh not in conn.simulation.getPendingVehicles():
+                continue  # arrived
+            # Also removes a vehicle still waiting for insertion (invalid
+            # position), which SUMO would otherwise insert behind the window
+            # later; libsumo fails the next step if its subscription stays
+            try:
+                conn.vehicle.unsubscribe(veh)
+                conn.vehicle.remove(veh)
+            except TRACI_ERRORS:
+                pass
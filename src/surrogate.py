@@ -0,0 +1,374 @@
+import os
+import numpy as np
+from scenario import cached_scenario, VTYPE_DEFAULTS
+from utils import state_to_index
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CFG = os.path.join(BASE_DIR, "data", "obstacles.sumocfg")
+
+# SUMO inserts a vehicle with departPos="base" this far past its length
+POSITION_EPS = 0.1
+
+
+class HighwaySurrogate:
+    """SUMO-free batch of SumoContinuousEnv or SumoEnv episodes, stepped with NumPy.
+
+    The ego follows SUMO's Krauss model with the Euler update (step-length 1 s).
+    Obstacles are the vehicles of the route file and depart at their desired
+    speed. With env="continuous" they brake to a stop, as after the setSpeed(0)
+    of SumoContinuousEnv; with env="discrete" they keep driving like in SumoEnv,
+    at their desired speed less the mean dawdling, never closer to their leader
+    than minGap, and leave at the end of the road. Lane changes are
+    instantaneous like with laneChangeMode 0. The observation is the one of
+    SumoContinuousEnv. With env="continuous" the actions and rewards are those
+    of SumoContinuousEnv too (1 = lane - 1, 2 = lane + 1; an ego that collides
+    or leaves the road ends its episode with -20); with env="discrete" they are
+    those of SumoEnv (1 = LEFT = lane + 1, 2 = RIGHT = lane - 1, -10 for an
+    invalid change, -100 for a collision).
+    """
+
+    def __init__(self, n_envs, sumo_cfg=DEFAULT_CFG, max_steps=200, horizon=100.0,
+                 edge="E0", ego_type="obstacle", sigma=None, obstacle_speed=None, seed=None,
+                 env="continuous"):
+        if env not in ("continuous", "discrete"):
+            raise ValueError(f"env must be 'continuous' or 'discrete', not '{env}'")
+        scenario = cached_scenario(sumo_cfg)
+        lane_data = scenario["edges"][edge]
+        ego = scenario["vtypes"].get(ego_type, VTYPE_DEFAULTS)
+        self.rng = np.random.default_rng(seed)
+
+        self.env = env
+        self.n_envs = n_envs
+        self.max_steps = max_steps
+        self.horizon = horizon
+        self.n_lanes = lane_data["n_lanes"]
+        self.lane_length = lane_data["length"]
+        self.lane_speed = lane_data["speed"]
+        self.lane_speeds = np.asarray(lane_data["lane_speeds"], dtype=np.float64)
+
+        self.length = ego["length"]
+        self.min_gap = ego["minGap"]
+        self.accel = ego["accel"]
+        self.decel = ego["decel"]
+        self.emergency_decel = ego["emergencyDecel"]
+        self.tau = ego["tau"]
+        self.max_speed = ego["maxSpeed"]
+        self.speed_dev = ego["speedDev"]
+        self.sigma = ego["sigma"] if sigma is None else sigma
+
+        lanes = scenario["vehicle_lanes"]
+        pos = scenario["vehicle_pos"]
+        types = scenario["vehicle_types"]
+        obstacle = scenario["vtypes"].get(types[0] if len(types) else ego_type, VTYPE_DEFAULTS)
+        self.obstacle_length = obstacle["length"]
+        if obstacle_speed is None:
+            # Desired speed; the depart speed is capped by the lane limit
+            sf = np.clip(self.rng.normal(1.0, obstacle["speedDev"], len(pos)), 0.2, 2.0)
+            if env == "continuous":
+                sf = np.minimum(sf, 1.0)
+            obstacle_speed = np.minimum(self.lane_speed * sf, obstacle["maxSpeed"])
+        obstacle_speed = np.asarray(obstacle_speed, dtype=np.float64)
+
+        # Obstacle track: positions and speeds for t = 0..T, after which
+        # nothing changes. Each lane is sorted and padded with +inf so every
+        # lane has the same width.
+        if env == "continuous":
+            # Braking to a stop
+            n_track = int(np.ceil(obstacle_speed.max(initial=0.0) / obstacle["decel"])) + 1
+        else:
+            # Free flow until the end of the episode. SumoEnv adds the ego one
+            # step after the obstacles depart: t = 0 is that step.
+            n_track = max_steps + 1
+            dawdle = 0.5 * obstacle["sigma"] * obstacle["accel"]
+            spacing = obstacle["length"] + obstacle["minGap"]
+        width = max(np.sum(lanes == l) for l in range(self.n_lanes)) + 1
+        self.track_pos = np.full((n_track, self.n_lanes, width), np.inf)
+        self.track_speed = np.zeros((n_track, self.n_lanes, width))
+        for l in range(self.n_lanes):
+            order = np.argsort(pos[lanes == l])
+            p = pos[lanes == l][order]
+            v = obstacle_speed[lanes == l][order]
+            if env == "discrete":
+                cruise = np.maximum(v - dawdle, 0.0)
+                p = p + v
+            for t in range(n_track):
+                self.track_pos[t, l, :len(p)] = p
+                self.track_speed[t, l, :len(p)] = v
+                if env == "continuous":
+                    v = np.maximum(v - obstacle["decel"], 0.0)
+                    p = p + v
+                else:
+                    # Front to back, so nobody drives into the vehicle ahead
+                    nxt = p + cruise
+                    for i in range(len(p) - 2, -1, -1):
+                        nxt[i] = min(nxt[i], nxt[i + 1] - spacing)
+                    v = np.zeros_like(p)
+                    driving = np.isfinite(p)
+                    v[driving] = nxt[driving] - p[driving]
+                    # Vehicles past the end of the road have arrived
+                    p = np.where(nxt > self.lane_length, np.inf, nxt)
+        self.obstacle_decel = obstacle["decel"]
+
+        self.lane = np.zeros(n_envs, dtype=np.int64)
+        self.pos = np.zeros(n_envs)
+        self.speed = np.zeros(n_envs)
+        self.allowed_speed = np.zeros(n_envs)
+        self.step_count = np.zeros(n_envs, dtype=np.int64)
+        self._rows = np.arange(n_envs)
+        self._lane_rows = np.arange(self.n_lanes)[:, None]
+
+    @property
+    def obs_dim(self):
+        return 1 + self.n_lanes
+
+    def seed(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+
+    def reset(self, mask=None):
+        # Reset every env, or only those selected by the boolean `mask`
+        idx = self._rows if mask is None else np.flatnonzero(mask)
+        n = len(idx)
+        speed_factor = np.clip(self.rng.normal(1.0, self.speed_dev, n), 0.2, 2.0)
+        self.lane[idx] = 0
+        self.pos[idx] = self.length + POSITION_EPS
+        self.speed[idx] = 0.0
+        self.allowed_speed[idx] = np.minimum(self.lane_speed * speed_factor, self.max_speed)
+        self.step_count[idx] = 0
+        return self.observe()
+
+    def _track_time(self):
+        return np.minimum(self.step_count, len(self.track_pos) - 1)
+
+    def _ahead_index(self, pos, t):
+        # Index of the first obstacle strictly ahead, per lane: (n_lanes, n_envs).
+        # Envs are grouped by track time, which has only a handful of values.
+        idx = np.empty((self.n_lanes, self.n_envs), dtype=np.int64)
+        for k in np.unique(t):
+            m = t == k
+            for l in range(self.n_lanes):
+                idx[l, m] = np.searchsorted(self.track_pos[k, l], pos[m], side="right")
+        return idx
+
+    def _gather(self, track, t, idx):
+        return track[t[None, :], self._lane_rows, idx]
+
+    def _stop_speed(self, gap):
+        # MSCFModel::maximumSafeStopSpeedEuler with dt = 1
+        # No obstacle ahead gives an infinite gap, any large value does
+        g = np.clip(gap - 1e-6, 0.0, 1e6)
+        b, t = self.decel, self.tau
+        n = np.floor(0.5 - (t - 0.5 * np.sqrt(1.0 + 4.0 * ((2.0 * g / b - t) + t * t))))
+        n = np.maximum(n, 0.0)
+        h = 0.5 * n * (n - 1) * b + n * b * t
+        v = n * b + (g - h) / (n + t)
+        return np.where(gap > 1e-6, np.maximum(v, 0.0), 0.0)
+
+    def _brake_gap(self, speed):
+        # Distance a leader covers while braking to a stop (Euler, no reaction time)
+        steps = np.floor(speed / self.obstacle_decel)
+        return steps * speed - self.obstacle_decel * steps * (steps + 1) / 2
+
+    def observe(self):
+        t = self._track_time()
+        ahead = self._gather(self.track_pos, t, self._ahead_index(self.pos, t))
+        own = ahead[self.lane, self._rows]
+        gap = own - self.obstacle_length - self.pos - self.min_gap
+        obs = np.empty((self.n_envs, self.obs_dim), dtype=np.float32)
+        obs[:, 0] = self.lane
+        obs[:, 1] = np.minimum(gap, self.horizon)
+        d = ahead - self.pos
+        d = np.where(d < self.horizon, d, self.horizon)
+        # Other lanes in ascending index order, own lane skipped
+        others = np.ones((self.n_lanes, self.n_envs), dtype=bool)
+        others[self.lane, self._rows] = False
+        obs[:, 2:] = d.T[others.T].reshape(self.n_envs, self.n_lanes - 1)
+        return obs
+
+    def step(self, actions):
+        """Advance every env by one action; returns obs, rewards, terminated, crashed."""
+        actions = np.asarray(actions)
+        t = self._track_time()
+        idx = self._ahead_index(self.pos, t)
+
+        # SUMO plans the speed on the current lane, then executes the lane
+        # change requested over TraCI and moves the vehicle on the new lane.
+        lead = idx[self.lane, self._rows]
+        gap = self.track_pos[t, self.lane, lead] - self.obstacle_length - self.pos - self.min_gap
+        lead_speed = self.track_speed[t, self.lane, lead]
+        v_safe = self._stop_speed(gap + np.where(np.isfinite(gap), self._brake_gap(lead_speed), 0.0))
+        v_max = np.minimum(np.minimum(self.speed + self.accel, self.allowed_speed), v_safe)
+        v_min = np.minimum(np.maximum(self.speed - self.decel, 0.0), v_max)
+        r = self.rng.random(self.n_envs)
+        dawdle = self.sigma * r * np.where(v_max < self.accel, v_max, self.accel)
+        speed = np.maximum(np.maximum(v_max - dawdle, 0.0), v_min)
+        speed = np.maximum(speed, self.speed - self.emergency_decel)
+        self.speed = np.maximum(speed, 0.0)
+
+        # SumoContinuousEnv: 1 = lane - 1; SumoEnv: 1 = LEFT = lane + 1
+        right = 1 if self.env == "continuous" else 2
+        target = self.lane + np.where(actions == right, -1, np.where(actions == 3 - right, 1, 0))
+        lane_valid = (target >= 0) & (target < self.n_lanes)
+        self.lane = np.where(lane_valid, target, self.lane)
+
+        self.pos = self.pos + self.speed
+        self.step_count += 1
+
+        # Collision with the leader or, after a lane change, the follower on the new lane
+        t = self._track_time()
+        lead = idx[self.lane, self._rows]
+        lead_pos = self.track_pos[t, self.lane, lead]
+        back_pos = np.where(lead > 0, self.track_pos[t, self.lane, np.maximum(lead - 1, 0)], -np.inf)
+        crashed = (self.pos > lead_pos - self.obstacle_length) | \
+            (back_pos > self.pos - self.length) | (self.pos > self.lane_length)
+
+        obs = self.observe()
+        if self.env == "continuous":
+            r_speed = self.speed / self.max_speed
+            r_lane = np.where((actions == 1) | (actions == 2), -0.1, 0.0)
+            r_collision = np.where(obs[:, 1] < 2.0, -10.0, 0.0)
+            r_collision = np.where(lane_valid, r_collision, -5.0)
+            rewards = np.where(crashed, -20.0, r_speed + r_lane + r_collision)
+            obs[crashed] = 0.0
+        else:
+            # SumoEnv.compute_reward: speed over the lane's limit, -50 in the closest bin
+            r_speed = self.speed / self.lane_speeds[self.lane]
+            r_lane = np.where(actions != 0, -0.5, 0.0)
+            r_collision = np.where(obs[:, 1] < 5.0, -50.0, 0.0)
+            rewards = np.where(lane_valid, r_speed + r_lane + r_collision, -10.0)
+            rewards = np.where(crashed, -100.0, rewards)
+            # SumoEnv.empty_state once discretized: lane 0, nothing in sight
+            obs[crashed, 0] = 0.0
+            obs[crashed, 1:] = self.horizon
+
+        terminated = crashed | (self.step_count >= self.max_steps)
+        return obs, rewards.astype(np.float32), terminated, crashed
+
+
+def discretize_obs(obs, dist_bins=(5, 15, 30)):
+    """[lane, d_current, d_other...] -> SumoEnv-style bins, for Q-table pretraining."""
+    obs = np.asarray(obs)
+    state = np.empty(obs.shape, dtype=np.int64)
+    state[:, 0] = obs[:, 0]
+    state[:, 1:] = np.searchsorted(np.asarray(dist_bins[:2]), obs[:, 1:], side="right")
+    return state
+
+
+def pretrain_q_table(q_table, n_envs=1024, n_steps=10_000, alpha=0.1, gamma=0.95,
+                     epsilon=0.2, seed=None, sumo_cfg=DEFAULT_CFG, max_steps=200):
+    """Batched tabular Q-learning on the surrogate, in place on `q_table`.
+
+    The table is the one of SumoEnv (q_learning.train): the surrogate runs
+    with SumoEnv's actions and rewards. Visits of the same (state, action)
+    pair in one batch are averaged before the update, so the learning rate
+    stays per-visit whatever n_envs is.
+    """
+    sim = HighwaySurrogate(n_envs, sumo_cfg=sumo_cfg, max_steps=max_steps, seed=seed, env="discrete")
+    rng = np.random.default_rng(seed)
+    n_states, n_actions = q_table.shape
+    state = state_to_index(discretize_obs(sim.reset()))
+
+    for _ in range(n_steps):
+        greedy = np.argmax(q_table[state], axis=1)
+        explore = rng.random(n_envs) < epsilon
+        actions = np.where(explore, rng.integers(0, n_actions, n_envs), greedy)
+
+        obs, rewards, terminated, _ = sim.step(actions)
+        next_state = state_to_index(discretize_obs(obs))
+        target = rewards + gamma * np.max(q_table[next_state], axis=1) * ~terminated
+
+        pair = state * n_actions + actions
+        counts = np.bincount(pair, minlength=n_states * n_actions)
+        sums = np.bincount(pair, weights=target, minlength=n_states * n_actions)
+        seen = counts > 0
+        flat = q_table.reshape(-1)
+        flat[seen] += alpha * (sums[seen] / counts[seen] - flat[seen])
+
+        if terminated.any():
+            obs = sim.reset(terminated)
+            next_state = state_to_index(discretize_obs(obs))
+        state = next_state
+    return q_table
+
+
+def fidelity_check(n_episodes=5, seed=0, sumo_cfg="data/obstacles.sumocfg", env="continuous"):
+    """Replay identical random action sequences in SUMO and in the surrogate.
+
+    env="continuous" compares with SumoContinuousEnv, env="discrete" with
+    SumoEnv (raw features, not bins). The surrogate gets the ego speed factor
+    and obstacle speeds SUMO drew, so what is left is the random dawdling of
+    the Krauss model. Prints per-episode errors and returns them as a list of
+    dicts.
+    """
+    if env == "continuous":
+        from env_continuous import SumoContinuousEnv
+        sumo_env = SumoContinuousEnv(sumo_cfg=sumo_cfg)
+    else:
+        from env import SumoEnv
+        sumo_env = SumoEnv(sumo_cfg=sumo_cfg, observation="features")
+    rng = np.random.default_rng(seed)
+    scenario = cached_scenario(sumo_env.sumo_cfg)
+    lane_speed = scenario["edges"]["E0"]["speed"]
+    report = []
+    for ep in range(n_episodes):
+        actions = rng.integers(0, 3, sumo_env.max_steps)
+        if env == "continuous":
+            obs, _ = sumo_env.reset(seed=seed + ep)
+            # Depart speeds, before the obstacles brake
+            obstacle_speed = [sumo_env.conn.vehicle.getSpeed(v) for v in scenario["vehicle_ids"]]
+        else:
+            # Raw features: distances clipped at the horizon like the surrogate's
+            obs = np.minimum(sumo_env.reset()[:1 + sumo_env.n_lanes], 100.0)
+            # Desired speeds, which the obstacles keep
+            obstacle_speed = [min(lane_speed * sumo_env.conn.vehicle.getSpeedFactor(v),
+                                  sumo_env.conn.vehicle.getMaxSpeed(v))
+                              for v in scenario["vehicle_ids"]]
+        speed_factor = sumo_env.conn.vehicle.getSpeedFactor(sumo_env.ego_id)
+        sumo_obs, sumo_rew = [obs], []
+        for a in actions:
+            if env == "continuous":
+                obs, r, terminated, truncated, _ = sumo_env.step(int(a))
+                done = terminated or truncated
+            else:
+                obs, r, done = sumo_env.step(int(a))
+                obs = np.minimum(obs[:1 + sumo_env.n_lanes], 100.0)
+            sumo_obs.append(obs)
+            sumo_rew.append(r)
+            if done:
+                break
+
+        sim = HighwaySurrogate(1, sumo_cfg=sumo_env.sumo_cfg, max_steps=sumo_env.max_steps,
+                               obstacle_speed=obstacle_speed, seed=seed + ep, env=env)
+        sim.reset()
+        sim.allowed_speed[:] = min(sim.lane_speed * speed_factor, sim.max_speed)
+        sim_obs, sim_rew = [sim.observe()[0]], []
+        for a in actions[:len(sumo_rew)]:
+            obs, r, terminated, _ = sim.step([a])
+            sim_obs.append(obs[0])
+            sim_rew.append(r[0])
+            if terminated[0]:
+                break
+
+        n = min(len(sumo_rew), len(sim_rew))
+        obs_err = np.abs(np.array(sumo_obs[:n + 1]) - np.array(sim_obs[:n + 1]))
+        rew_err = np.abs(np.array(sumo_rew[:n]) - np.array(sim_rew[:n]))
+        row = {
+            "episode": ep,
+            "sumo_length": len(sumo_rew),
+            "surrogate_length": len(sim_rew),
+            "lane_match": float(np.mean(obs_err[:, 0] == 0)),
+            "dist_current_mae": float(obs_err[:, 1].mean()),
+            "min_dist_mae": float(obs_err[:, 2:].mean()),
+            "reward_mae": float(rew_err.mean()) if n else 0.0,
+            "return_sumo": float(np.sum(sumo_rew)),
+            "return_surrogate": float(np.sum(sim_rew)),
+        }
+        report.append(row)
+        print(" | ".join(f"{k}: {v:.3f}" if isinstance(v, float) else f"{k}: {v}"
+                         for k, v in row.items()))
+    sumo_env.close()
+    return report
+
+
+if __name__ == "__main__":
+    fidelity_check()
+    fidelity_check(env="discrete")
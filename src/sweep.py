@@ -0,0 +1,313 @@
+"""Parallel hyperparameter sweeps for Q-learning and PPO.
+
+Trials run in a process pool, each with its own SUMO instance(s) and seed.
+Every report_every episodes (Q-learning) or timesteps (PPO) a trial reports
+its recent mean episode reward; past the warm-up, a trial whose value is
+below the median of the other trials at the same report is pruned. Trials,
+parameters, intermediate values and results all go to one SQLite file:
+
+    python sweep.py q --param alpha=0.05,0.1,0.2 --param gamma=0.9,0.95,0.99 --workers 8
+    python sweep.py ppo --search random --trials 16 --param learning_rate=log:1e-5:1e-3 \\
+        --param n_steps=256,512,1024 --param batch_size=32,64
+    python sweep.py --show --db results/sweeps.sqlite
+
+    sqlite3 results/sweeps.sqlite "SELECT params, value FROM trials WHERE state='complete' ORDER BY value DESC"
+"""
+import os
+import time
+import json
+import random
+import sqlite3
+import argparse
+import itertools
+import multiprocessing as mp
+import numpy as np
+
+DB_PATH = "results/sweeps.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trials (
+    id INTEGER PRIMARY KEY,
+    sweep TEXT NOT NULL,
+    algo TEXT NOT NULL,
+    params TEXT NOT NULL,
+    seed INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    value REAL,
+    reports INTEGER DEFAULT 0,
+    started REAL,
+    finished REAL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS reports (
+    trial_id INTEGER NOT NULL REFERENCES trials(id),
+    step INTEGER NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (trial_id, step)
+);
+"""
+
+
+class TrialPruned(Exception):
+    pass
+
+
+def connect(db_path):
+    db = sqlite3.connect(db_path, timeout=60.0, isolation_level=None)
+    # Workers write concurrently: WAL lets readers and one writer proceed together
+    db.execute("PRAGMA journal_mode=WAL")
+    db.executescript(SCHEMA)
+    return db
+
+
+# --- Search spaces -------------------------------------------------------------
+
+def parse_param(spec):
+    """'name=a,b,c' (choices) or 'name=log:lo:hi' / 'uniform:lo:hi' / 'int:lo:hi'."""
+    name, _, values = spec.partition("=")
+    kind, _, bounds = values.partition(":")
+    if kind in ("log", "uniform", "int"):
+        lo, hi = (float(v) for v in bounds.split(":"))
+        return name, (kind, lo, hi)
+    return name, [json.loads(v) for v in values.split(",")]
+
+
+def grid(space):
+    names = list(space)
+    for name in names:
+        if not isinstance(space[name], list):
+            raise ValueError(f"Grid search needs a list of values for '{name}'")
+    for values in itertools.product(*(space[n] for n in names)):
+        yield dict(zip(names, values))
+
+
+def sample(space, rng):
+    params = {}
+    for name, dist in space.items():
+        if isinstance(dist, list):
+            params[name] = dist[rng.randrange(len(dist))]
+            continue
+        kind, lo, hi = dist
+        if kind == "log":
+            params[name] = float(np.exp(rng.uniform(np.log(lo), np.log(hi))))
+        elif kind == "int":
+            params[name] = rng.randint(int(lo), int(hi))
+        else:
+            params[name] = rng.uniform(lo, hi)
+    return params
+
+
+# --- Pruning -------------------------------------------------------------------
+
+class MedianPruner:
+    """Prune when a report is below the median of the other trials' same report.
+
+    Nothing is pruned during the first warmup_reports reports, nor before
+    min_trials other trials of the sweep have reached that report.
+    """
+
+    def __init__(self, warmup_reports=2, min_trials=3):
+        self.warmup_reports = warmup_reports
+        self.min_trials = min_trials
+
+    def should_prune(self, db, sweep, trial_id, step, value):
+        if step < self.warmup_reports:
+            return False
+        others = [v for (v,) in db.execute(
+            "SELECT r.value FROM reports r JOIN trials t ON t.id = r.trial_id "
+            "WHERE t.sweep = ? AND r.step = ? AND r.trial_id != ?", (sweep, step, trial_id))]
+        if len(others) < self.min_trials:
+            return False
+        return value < float(np.median(others))
+
+
+class Reporter:
+    """Handed to a trial: records each report, returns True once the trial should stop.
+
+    Objectives stop training cleanly (closing SUMO) and then call check().
+    """
+
+    def __init__(self, db, sweep, trial_id, pruner):
+        self.db = db
+        self.sweep = sweep
+        self.trial_id = trial_id
+        self.pruner = pruner
+        self.step = 0
+        self.last = None
+        self.pruned = False
+
+    def __call__(self, value):
+        value = float(value)
+        self.db.execute("INSERT OR REPLACE INTO reports VALUES (?, ?, ?)", (self.trial_id, self.step, value))
+        self.db.execute("UPDATE trials SET reports = ? WHERE id = ?", (self.step + 1, self.trial_id))
+        self.last = value
+        self.pruned = self.pruner.should_prune(self.db, self.sweep, self.trial_id, self.step, value)
+        self.step += 1
+        return self.pruned
+
+    def check(self):
+        if self.pruned:
+            raise TrialPruned()
+
+
+# --- Objectives ----------------------------------------------------------------
+
+def run_q_trial(params, seed, reporter, n_episodes=300, report_every=25, **env_kwargs):
+    import q_learning
+
+    def report(episode, rewards_history):
+        if (episode + 1) % report_every == 0 and reporter(np.mean(rewards_history[-report_every:])):
+            return False
+
+    _, rewards, _ = q_learning.train(n_episodes=n_episodes, q_table_path=None, history_path=None,
+                                     checkpoint_dir=None, metrics_dir=None, profile=False,
+                                     record_dir=None, seed=seed, report=report, verbose=False, **params, **env_kwargs)
+    reporter.check()
+    return float(np.mean(rewards[-report_every:]))
+
+
+def run_ppo_trial(params, seed, reporter, total_timesteps=50_000, report_every=5_000, **env_kwargs):
+    import deep_rl_train
+    from stable_baselines3.common.callbacks import BaseCallback
+
+    class ReportCallback(BaseCallback):
+        def __init__(self):
+            super().__init__()
+            self.next_report = report_every
+
+        def _on_step(self):
+            if self.num_timesteps >= self.next_report and self.model.ep_info_buffer:
+                self.next_report += report_every
+                return not reporter(np.mean([ep["r"] for ep in self.model.ep_info_buffer]))
+            return True
+
+    model = deep_rl_train.train(total_timesteps=total_timesteps, n_envs=1, profile=False,
+                                record_dir=None, seed=seed, checkpoint_dir=None, model_path=None,
+                                tensorboard_log=None, metrics_dir=None, callbacks=[ReportCallback()], verbose=0,
+                                **params, **env_kwargs)
+    reporter.check()
+    return float(np.mean([ep["r"] for ep in model.ep_info_buffer]))
+
+
+OBJECTIVES = {"q": run_q_trial, "ppo": run_ppo_trial}
+
+
+def _run_trial(job):
+    db_path, trial_id, algo, params, seed, pruner, objective_kwargs = job
+    db = connect(db_path)
+    db.execute("UPDATE trials SET state = 'running', started = ? WHERE id = ?", (time.time(), trial_id))
+    (sweep,) = db.execute("SELECT sweep FROM trials WHERE id = ?", (trial_id,)).fetchone()
+    reporter = Reporter(db, sweep, trial_id, pruner)
+    try:
+        value = OBJECTIVES[algo](params, seed, reporter, **objective_kwargs)
+        state, error = "complete", None
+    except TrialPruned:
+        value, state, error = reporter.last, "pruned", None
+    except Exception as exc:
+        value, state, error = None, "failed", repr(exc)
+    db.execute("UPDATE trials SET state = ?, value = ?, finished = ?, error = ? WHERE id = ?",
+               (state, value, time.time(), error, trial_id))
+    db.close()
+    return trial_id, state, value, params
+
+
+def run_sweep(algo, space, search="grid", n_trials=None, n_workers=None, db_path=DB_PATH,
+              sweep=None, seed=0, pruner=None, start_method="forkserver", **objective_kwargs):
+    """Run every trial of the sweep and return its rows, best first.
+
+    Trial i gets seed + i, for the SUMO runs, the agent and its exploration.
+    """
+    if search == "grid":
+        trials = list(grid(space))[:n_trials]
+    else:
+        rng = random.Random(seed)
+        trials = [sample(space, rng) for _ in range(n_trials or 10)]
+    sweep = sweep or f"{algo}-{time.strftime('%Y%m%d-%H%M%S')}"
+    pruner = pruner or MedianPruner()
+
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    db = connect(db_path)
+    jobs = []
+    for i, params in enumerate(trials):
+        cur = db.execute("INSERT INTO trials (sweep, algo, params, seed, state) VALUES (?, ?, ?, ?, 'queued')",
+                         (sweep, algo, json.dumps(params), seed + i))
+        jobs.append((db_path, cur.lastrowid, algo, params, seed + i, pruner, objective_kwargs))
+
+    n_workers = min(n_workers or os.cpu_count() or 1, len(jobs))
+    print(f"Sweep {sweep}: {len(jobs)} {algo} trials on {n_workers} workers -> {db_path}")
+    t0 = time.perf_counter()
+    # One task per process at a time and a fresh process per trial: each
+    # trial starts its own SUMO (libsumo allows one per process)
+    with mp.get_context(start_method).Pool(n_workers, maxtasksperchild=1) as pool:
+        for trial_id, state, value, params in pool.imap_unordered(_run_trial, jobs):
+            shown = "-" if value is None else f"{value:.2f}"
+            print(f"trial {trial_id:>4} {state:<9} value {shown:>9}  {json.dumps(params)}")
+    print(f"Sweep finished in {time.perf_counter() - t0:.1f} s")
+    rows = leaderboard(db, sweep)
+    db.close()
+    return rows
+
+
+def leaderboard(db, sweep, limit=None):
+    query = ("SELECT id, state, value, reports, params, seed FROM trials WHERE sweep = ? "
+             "ORDER BY state = 'complete' DESC, value DESC")
+    rows = db.execute(query + (f" LIMIT {int(limit)}" if limit else ""), (sweep,)).fetchall()
+    return rows
+
+
+def print_leaderboard(db, sweep, limit=10):
+    print(f"\n{sweep}")
+    print(f"{'trial':>6} {'state':<9}{'value':>10}{'reports':>9}  params")
+    for trial_id, state, value, reports, params, _ in leaderboard(db, sweep, limit):
+        shown = "-" if value is None else f"{value:.2f}"
+        print(f"{trial_id:>6} {state:<9}{shown:>10}{reports:>9}  {params}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parallel hyperparameter sweep with median pruning")
+    parser.add_argument("algo", nargs="?", choices=sorted(OBJECTIVES))
+    parser.add_argument("--param", action="append", default=[],
+                        help="name=v1,v2,... or name=log|uniform|int:lo:hi (repeatable)")
+    parser.add_argument("--search", choices=["grid", "random"], default="grid")
+    parser.add_argument("--trials", type=int, default=None, help="random: trials to sample; grid: cap")
+    parser.add_argument("--workers", type=int, default=None, help="default: one per core")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--sweep", default=None, help="sweep name (default: algo and time)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--budget", type=int, default=None,
+                        help="episodes per Q-learning trial or timesteps per PPO trial")
+    parser.add_argument("--report-every", type=int, default=None,
+                        help="episodes (q) or timesteps (ppo) between two pruning checks")
+    parser.add_argument("--warmup", type=int, default=2, help="reports before pruning can start")
+    parser.add_argument("--min-trials", type=int, default=3, help="trials needed for a median")
+    parser.add_argument("--max-steps", type=int, default=200)
+    parser.add_argument("--show", action="store_true", help="print the leaderboards in --db and exit")
+    args = parser.parse_args(argv)
+
+    if args.show:
+        db = connect(args.db)
+        sweeps = [args.sweep] if args.sweep else \
+            [s for (s,) in db.execute("SELECT DISTINCT sweep FROM trials ORDER BY id")]
+        for sweep in sweeps:
+            print_leaderboard(db, sweep)
+        return
+    if args.algo is None:
+        parser.error("algo is required unless --show")
+    if not args.param:
+        parser.error("at least one --param is required")
+
+    space = dict(parse_param(p) for p in args.param)
+    kwargs = {"max_steps": args.max_steps}
+    if args.budget:
+        kwargs["n_episodes" if args.algo == "q" else "total_timesteps"] = args.budget
+    if args.report_every:
+        kwargs["report_every"] = args.report_every
+    run_sweep(args.algo, space, search=args.search, n_trials=args.trials, n_workers=args.workers,
+              db_path=args.db, sweep=args.sweep, seed=args.seed,
+              pruner=MedianPruner(args.warmup, args.min_trials), **kwargs)
+    db = connect(args.db)
+    print_leaderboard(db, args.sweep or db.execute("SELECT sweep FROM trials ORDER BY id DESC").fetchone()[0])
+
+
+if __name__ == "__main__":
+    main()
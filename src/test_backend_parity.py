@@ -0,0 +1,51 @@
+import numpy as np
+from env import SumoEnv
+from env_continuous import SumoContinuousEnv
+
+
+def run_sumo_env(backend, actions):
+    env = SumoEnv(max_steps=len(actions), backend=backend)
+    trajectory = [env.reset()]
+    for action in actions:
+        state, reward, done = env.step(action)
+        trajectory.append((state, reward, done))
+        if done:
+            break
+    env.close()
+    return trajectory
+
+
+def run_continuous_env(backend, actions, seed):
+    env = SumoContinuousEnv(max_steps=len(actions), backend=backend)
+    state, _ = env.reset(seed=seed)
+    trajectory = [state.tolist()]
+    for action in actions:
+        state, reward, terminated, truncated, _ = env.step(action)
+        trajectory.append((state.tolist(), reward, terminated, truncated))
+        if terminated or truncated:
+            break
+    env.close()
+    return trajectory
+
+
+def main():
+    # Same random action sequence on both backends, trajectories must be identical
+    n_episodes = 3
+    for ep in range(n_episodes):
+        actions = [int(a) for a in np.random.default_rng(ep).integers(0, 3, 200)]
+
+        a = run_sumo_env("traci", actions)
+        b = run_sumo_env("libsumo", actions)
+        assert a == b, f"SumoEnv episode {ep}: traci and libsumo trajectories differ"
+
+        a = run_continuous_env("traci", actions, seed=ep)
+        b = run_continuous_env("libsumo", actions, seed=ep)
+        assert a == b, f"SumoContinuousEnv episode {ep}: traci and libsumo trajectories differ"
+
+        print(f"Episode {ep}: identical trajectories ({len(a) - 1} steps)")
+
+    print("Backend parity test finished.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""Compact per-step trajectories of SUMO episodes, recorded headless.
+
+A recorder wraps SumoEnv or SumoContinuousEnv and keeps, at every agent
+decision, the ego's lane, position and speed, the action and reward, and the
+lane and position of the vehicles around the ego. These are all read from
+what the env's EgoObserver already decoded, so recording adds no TraCI call.
+Each episode is written at its end as one compressed .npz:
+
+    time, ego_lane, ego_pos, ego_speed, ego_alive, action, reward   (n_frames,)
+    veh_offsets   (n_frames + 1,): frame i's vehicles are [offsets[i], offsets[i + 1])
+    veh_name, veh_lane, veh_pos   one entry per vehicle per frame (name: index in `names`)
+    names         vehicle ids
+    meta          JSON: sumo_cfg, edge, n_lanes, step_length, ego_id, action_names
+
+Frame 0 is the state after reset (action -1). The vehicles are the ones of
+the observer's context subscription, i.e. within horizon + CONTEXT_MARGIN of
+the ego. replay.py shows a file in sumo-gui or as a plot.
+"""
+import os
+import json
+import numpy as np
+import gymnasium as gym
+from scenario import cached_scenario, route_metadata
+
+
+class TrajectoryWriter:
+    """Frames of the current episode, saved with np.savez_compressed by end_episode()."""
+
+    def __init__(self, directory, env):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.meta = {
+            "sumo_cfg": env.sumo_cfg,
+            "edge": route_metadata(cached_scenario(env.sumo_cfg))["edge"],
+            "n_lanes": env.n_lanes,
+            "step_length": env.step_length,
+            "ego_id": env.ego_id,
+            # SumoEnv and SumoContinuousEnv number left and right differently
+            "action_names": list(env.action_names),
+        }
+        # Set by the caller before reset() to name the file after its episode
+        self.episode = None
+        self._count = 0
+        self._frames = None
+
+    def start_episode(self, env):
+        self._frames = []
+        self.add_frame(env, -1, 0.0)
+
+    def add_frame(self, env, action, reward):
+        obs = env.observer
+        self._frames.append((
+            env.step_count * env.step_length, obs.lane, obs.lane_pos, obs.speed, obs.alive,
+            action, reward, obs.neighbor_ids, obs.neighbor_lanes, obs.neighbor_pos,
+        ))
+
+    def end_episode(self):
+        """Write the episode's file; returns its path (None without frames)."""
+        frames, self._frames = self._frames, None
+        if not frames:
+            return None
+        if self.episode is not None:
+            name = f"episode_{self.episode:06d}"
+        else:
+            name = f"{os.getpid()}_{self._count:05d}"
+        self._count += 1
+
+        columns = list(zip(*frames))
+        names, veh_name = {}, []
+        for ids in columns[7]:
+            veh_name.extend(names.setdefault(v, len(names)) for v in ids)
+        counts = [len(ids) for ids in columns[7]]
+        path = os.path.join(self.directory, name + ".npz")
+        tmp = path + ".tmp.npz"
+        np.savez_compressed(
+            tmp,
+            time=np.array(columns[0], dtype=np.float32),
+            ego_lane=np.array(columns[1], dtype=np.int8),
+            ego_pos=np.array(columns[2], dtype=np.float32),
+            ego_speed=np.array(columns[3], dtype=np.float32),
+            ego_alive=np.array(columns[4], dtype=bool),
+            action=np.array(columns[5], dtype=np.int8),
+            reward=np.array(columns[6], dtype=np.float32),
+            veh_offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+            veh_name=np.array(veh_name, dtype=np.int32),
+            veh_lane=np.concatenate([np.zeros(0)] + list(columns[8])).astype(np.int8),
+            veh_pos=np.concatenate([np.zeros(0)] + list(columns[9])).astype(np.float32),
+            names=np.array(list(names), dtype=str),
+            meta=np.array(json.dumps(self.meta)),
+        )
+        os.replace(tmp, path)
+        return path
+
+
+class TrajectoryRecorder:
+    """Records the trajectories of SumoEnv episodes (reset() -> s, step(a) -> (s, r, done))."""
+
+    def __init__(self, env, directory):
+        self.env = env
+        self.writer = TrajectoryWriter(directory, env)
+
+    def reset(self, *args, **kwargs):
+        # An episode cut short by the caller is still written
+        self.writer.end_episode()
+        obs = self.env.reset(*args, **kwargs)
+        self.writer.start_episode(self.env)
+        return obs
+
+    def step(self, action):
+        next_obs, reward, done = self.env.step(action)
+        self.writer.add_frame(self.env, int(action), float(reward))
+        if done:
+            self.writer.end_episode()
+        return next_obs, reward, done
+
+    def close(self):
+        self.writer.end_episode()
+        self.env.close()
+
+    def __getattr__(self, name):
+        return getattr(self.env, name)
+
+
+class GymTrajectoryRecorder(gym.Wrapper):
+    """Records the trajectories of a gym env such as SumoContinuousEnv."""
+
+    def __init__(self, env, directory):
+        super().__init__(env)
+        self.writer = TrajectoryWriter(directory, env.unwrapped)
+
+    def reset(self, **kwargs):
+        self.writer.end_episode()
+        obs, info = self.env.reset(**kwargs)
+        self.writer.start_episode(self.env.unwrapped)
+        return obs, info
+
+    def step(self, action):
+        next_obs, reward, terminated, truncated, info = self.env.step(action)
+        self.writer.add_frame(self.env.unwrapped, int(action), float(reward))
+        if terminated or truncated:
+            self.writer.end_episode()
+        return next_obs, reward, terminated, truncated, info
+
+    def close(self):
+        self.writer.end_episode()
+        super().close()
+
+
+def record_trajectories(env, directory):
+    """Wrap SumoEnv or a gym env so that each episode is saved to `directory`."""
+    if isinstance(env, gym.Env):
+        return GymTrajectoryRecorder(env, directory)
+    return TrajectoryRecorder(env, directory)
+
+
+class Trajectory:
+    """One recorded episode; trajectory[i] is frame i."""
+
+    def __init__(self, path):
+        self.path = path
+        with np.load(path) as data:
+            self.arrays = {key: data[key] for key in data.files}
+        self.meta = json.loads(str(self.arrays.pop("meta")))
+        self.names = self.arrays.pop("names")
+
+    def __len__(self):
+        return len(self.arrays["time"])
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["arrays"][name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __getitem__(self, i):
+        if not -len(self) <= i < len(self):
+            raise IndexError(f"frame {i} out of range for {len(self)} frames")
+        i %= len(self)
+        lo, hi = self.veh_offsets[i], self.veh_offsets[i + 1]
+        return {
+            "time": float(self.time[i]),
+            "ego_lane": int(self.ego_lane[i]),
+            "ego_pos": float(self.ego_pos[i]),
+            "ego_speed": float(self.ego_speed[i]),
+            "ego_alive": bool(self.ego_alive[i]),
+            "action": int(self.action[i]),
+            "reward": float(self.reward[i]),
+            "vehicles": self.names[self.veh_name[lo:hi]].tolist(),
+            "lanes": self.veh_lane[lo:hi],
+            "positions": self.veh_pos[lo:hi],
+        }
+
+
+def list_trajectories(directory):
+    """The episode files of a recording directory, in name order."""
+    return sorted(os.path.join(directory, f) for f in os.listdir(directory)
+                  if f.endswith(".npz") and not f.endswith(".tmp.npz"))
@@ -0,0 +1,223 @@
+import os
+import itertools
+import numpy as np
+import traci
+import traci.constants as tc
+
+try:
+    import libsumo
+except ImportError:  # optional: the in-process backend
+    libsumo = None
+
+BACKENDS = ("traci", "libsumo")
+
+# TraCI errors raised by both backends for a failed command. Importing libsumo
+# rebinds traci.exceptions.TraCIException to its own class, the socket client
+# keeps raising the original one (still bound in traci.connection)
+TRACI_ERRORS = (traci.connection.TraCIException,) + \
+    ((libsumo.TraCIException,) if libsumo is not None else ())
+
+# Variables read for the ego vehicle and for every vehicle around it. Both are
+# delivered by SUMO together with the simulationStep answer, so reading them
+# costs no extra TraCI round trip.
+EGO_VARS = (tc.VAR_LANE_INDEX, tc.VAR_LANEPOSITION, tc.VAR_SPEED)
+NEIGHBOR_VARS = (tc.VAR_LANE_INDEX, tc.VAR_LANEPOSITION)
+
+# The context range is a radius around the ego, add some slack for the
+# lateral offset between lanes.
+CONTEXT_MARGIN = 10.0
+
+# Lane offset in the LaneIndex sort key, longer than any lane (power of two
+# so lane * LANE_STRIDE + pos stays exact to ~1e-8 m)
+LANE_STRIDE = float(2 ** 24)
+
+_label_counter = itertools.count()
+_libsumo_in_use = False
+
+
+def resolve_backend(backend=None, gui=False):
+    # Constructor argument first, then the SUMO_BACKEND environment variable
+    backend = backend or os.environ.get("SUMO_BACKEND", "traci")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown SUMO backend '{backend}', expected one of {BACKENDS}")
+    if backend == "libsumo" and (gui or libsumo is None):
+        # libsumo has no GUI; also fall back when it is not installed
+        return "traci"
+    return backend
+
+
+def start_sumo(cmd, label_prefix="sumo", backend="traci"):
+    """Start SUMO and return the connection object to talk to it.
+
+    With "traci" every env owns a labeled connection, so several SUMO
+    instances can run in the same process. traci picks a free port for each
+    one and retries on a clash; a fresh label per start means a crashed
+    connection never blocks the next one.
+
+    With "libsumo" SUMO runs inside this process and the libsumo module itself
+    is the connection. There can only be one per process.
+    """
+    global _libsumo_in_use
+    if backend == "libsumo":
+        if _libsumo_in_use:
+            raise RuntimeError("libsumo supports a single simulation per process, "
+                               "use one worker process per env")
+        libsumo.start(cmd)
+        _libsumo_in_use = True
+        return libsumo
+
+    label = f"{label_prefix}-{os.getpid()}-{next(_label_counter)}"
+    traci.start(cmd, label=label, doSwitch=False)
+    return traci.getConnection(label)
+
+
+def close_sumo(conn):
+    global _libsumo_in_use
+    if conn is None:
+        return
+    # Instrumented connections keep the real one in `unwrapped`
+    conn = getattr(conn, "unwrapped", conn)
+    if conn is libsumo:
+        _libsumo_in_use = False
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def state_to_index(state, n_bins=3):
+    """Mixed-radix index of a discrete [lane, bin_1, ..., bin_k] state.
+
+    The lane is the most significant digit, so with two lanes this is the
+    historical lane * 9 + d1 * 3 + d2. Also takes a (n, k + 1) batch.
+    """
+    state = np.asarray(state)
+    radix = n_bins ** np.arange(state.shape[-1] - 1, -1, -1)
+    index = state @ radix
+    return int(index) if index.ndim == 0 else index
+
+
+def n_states(n_lanes, n_bins=3):
+    # lane x one distance bin per lane (current leader + every other lane)
+    return n_lanes * n_bins ** n_lanes
+
+
+class LaneIndex:
+    """Vehicle positions sorted per lane, for leader/follower queries by bisection.
+
+    All lanes share one array sorted by (lane, position); the slice of lane l
+    is bounds[l]:bounds[l + 1]. When the same vehicles are seen again, the
+    previous order is reused: positions barely move in one step, so the stable
+    merge sort of the almost sorted keys is close to linear.
+    """
+
+    def __init__(self, n_lanes):
+        self.n_lanes = n_lanes
+        self.keys = np.zeros(0, dtype=np.float64)
+        self.pos = np.zeros(0, dtype=np.float64)
+        self.bounds = np.zeros(n_lanes + 1, dtype=np.int64)
+        self._ids = None
+        self._order = None
+
+    def update(self, ids, lanes, pos):
+        key = lanes * LANE_STRIDE + pos
+        if ids == self._ids:
+            order = self._order[np.argsort(key[self._order], kind="stable")]
+        else:
+            order = np.argsort(key, kind="stable")
+        self._ids, self._order = ids, order
+        self.keys = key[order]
+        self.pos = pos[order]
+        # Vehicles on lanes >= n_lanes (another edge) fall after the last bound
+        self.bounds = np.searchsorted(self.keys, np.arange(self.n_lanes + 1) * LANE_STRIDE)
+
+    def lane(self, lane):
+        return self.pos[self.bounds[lane]:self.bounds[lane + 1]]
+
+    def leaders(self, x, horizon=np.inf):
+        """Distance from x to the first vehicle strictly ahead, in every lane, capped at horizon.
+
+        x may also be an (m,) array of positions, giving an (m, n_lanes) array.
+        """
+        x = np.asarray(x)[..., None]
+        i = np.searchsorted(self.keys, np.arange(self.n_lanes) * LANE_STRIDE + x, side="right")
+        found = i < self.bounds[1:]
+        d = self.pos[np.where(found, i, 0)] - x if self.pos.size else np.zeros(i.shape)
+        return np.where(found & (d < horizon), d, horizon)
+
+    def followers(self, x, horizon=np.inf):
+        """Distance from x back to the first vehicle strictly behind, in every lane."""
+        x = np.asarray(x)[..., None]
+        i = np.searchsorted(self.keys, np.arange(self.n_lanes) * LANE_STRIDE + x, side="left") - 1
+        found = i >= self.bounds[:-1]
+        d = x - self.pos[np.where(found, i, 0)] if self.pos.size else np.zeros(i.shape)
+        return np.where(found & (d < horizon), d, horizon)
+
+
+class EgoObserver:
+    """Variable and context subscriptions around the ego vehicle.
+
+    subscribe(conn) must be called once the ego is in the network, then update()
+    after every simulationStep decodes the batched results into NumPy arrays
+    and the per-lane LaneIndex of the surrounding vehicles.
+    """
+
+    def __init__(self, ego_id, horizon=100.0, n_lanes=2):
+        self.conn = None
+        self.ego_id = ego_id
+        self.horizon = horizon
+        self.n_lanes = n_lanes
+        self.alive = False
+        self.lane = 0
+        self.lane_pos = 0.0
+        self.speed = 0.0
+        self.leader_dist = horizon
+        self.neighbor_ids = ()
+        self.neighbor_lanes = np.zeros(0, dtype=np.int32)
+        self.neighbor_pos = np.zeros(0, dtype=np.float64)
+        self.index = LaneIndex(n_lanes)
+
+    def subscribe(self, conn):
+        self.conn = conn
+        conn.vehicle.subscribe(self.ego_id, EGO_VARS)
+        conn.vehicle.subscribeLeader(self.ego_id, self.horizon)
+        conn.vehicle.subscribeContext(self.ego_id, tc.CMD_GET_VEHICLE_VARIABLE,
+                                       self.horizon + CONTEXT_MARGIN, NEIGHBOR_VARS)
+        return self.update()
+
+    def update(self, context=True):
+        # context=False only decodes the ego variables, the neighbours stay stale
+        res = self.conn.vehicle.getSubscriptionResults(self.ego_id)
+        self.alive = bool(res)
+        if not self.alive:
+            return False
+
+        self.lane = res[tc.VAR_LANE_INDEX]
+        self.lane_pos = res[tc.VAR_LANEPOSITION]
+        self.speed = res[tc.VAR_SPEED]
+        leader = res[tc.VAR_LEADER]
+        self.leader_dist = leader[1] if leader and leader[0] else self.horizon
+        if not context:
+            return True
+
+        ctx = self.conn.vehicle.getContextSubscriptionResults(self.ego_id) or {}
+        ctx.pop(self.ego_id, None)
+        n = len(ctx)
+        self.neighbor_ids = tuple(ctx)
+        self.neighbor_lanes = np.fromiter(
+            (v[tc.VAR_LANE_INDEX] for v in ctx.values()), dtype=np.int32, count=n)
+        self.neighbor_pos = np.fromiter(
+            (v[tc.VAR_LANEPOSITION] for v in ctx.values()), dtype=np.float64, count=n)
+        self.index.update(self.neighbor_ids, self.neighbor_lanes, self.neighbor_pos)
+        return True
+
+    def ahead_in_lanes(self):
+        # Distance to the closest vehicle ahead of the ego in every lane, capped at the horizon
+        return self.index.leaders(self.lane_pos, self.horizon)
+
+    def ahead_in_lane(self, lane):
+        return float(self.ahead_in_lanes()[lane])
+
+    def ahead_in_other_lanes(self):
+        # Every lane but the ego's, in ascending lane index
+        return np.delete(self.ahead_in_lanes(), self.lane)
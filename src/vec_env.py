@@ -0,0 +1,217 @@
+import os
+import time
+import numpy as np
+from gymnasium import spaces
+from stable_baselines3.common.monitor import Monitor
+from stable_baselines3.common.buffers import RolloutBuffer
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv, VecEnv
+from env_continuous import SumoContinuousEnv
+from env_multi_agent import SumoMultiAgentEnv
+from surrogate import HighwaySurrogate
+from profiling import Profiler
+from recorder import GymTransitionRecorder
+
+
+def make_sumo_env(sumo_cfg="data/obstacles.sumocfg", max_steps=200, profile_dir=None,
+                  record_dir=None, **env_kwargs):
+    def _init():
+        # The profiler is created inside the worker; each worker writes its own
+        # TensorBoard event file into profile_dir.
+        profiler = Profiler(tensorboard_dir=profile_dir) if profile_dir else None
+        env = SumoContinuousEnv(sumo_cfg=sumo_cfg, max_steps=max_steps, profiler=profiler,
+                                **env_kwargs)
+        if record_dir:
+            # One dataset directory per worker process, read back together
+            # with recorder.TransitionDataset(record_dir)
+            env = GymTransitionRecorder(env, os.path.join(record_dir, f"worker_{os.getpid()}"))
+        return Monitor(env)   # REQUIRED for episode rewards
+    return _init
+
+
+def make_sumo_vec_env(n_envs=1, seed=None, start_method=None, **env_kwargs):
+    """K SumoContinuousEnv workers behind the SB3 VecEnv interface.
+
+    Each worker runs in its own process with its own SUMO instance and TraCI
+    connection; a worker whose SUMO process dies restarts it on the next reset.
+    """
+    env_fns = [make_sumo_env(**env_kwargs) for _ in range(n_envs)]
+    if n_envs == 1:
+        vec_env = DummyVecEnv(env_fns)
+    else:
+        vec_env = SubprocVecEnv(env_fns, start_method=start_method)
+    if seed is not None:
+        vec_env.seed(seed)
+    return vec_env
+
+
+class SurrogateVecEnv(VecEnv):
+    """HighwaySurrogate behind the SB3 VecEnv interface (SUMO-free pretraining).
+
+    Done envs are reset automatically, with the SB3 "terminal_observation" and
+    Monitor-style "episode" entries in their info dict.
+    """
+
+    def __init__(self, n_envs, **sim_kwargs):
+        self.sim = HighwaySurrogate(n_envs, **sim_kwargs)
+        horizon = self.sim.horizon
+        observation_space = spaces.Box(
+            low=np.zeros(self.sim.obs_dim, dtype=np.float32),
+            high=np.array([self.sim.n_lanes - 1] + [horizon] * self.sim.n_lanes, dtype=np.float32),
+            dtype=np.float32
+        )
+        super().__init__(n_envs, observation_space, spaces.Discrete(3))
+        self._actions = None
+        self._returns = np.zeros(n_envs)
+        self._lengths = np.zeros(n_envs, dtype=np.int64)
+        self._t0 = time.time()
+
+    def reset(self):
+        if self._seeds:
+            self.sim.seed(self._seeds[0])
+        self._reset_seeds()
+        self._returns[:] = 0.0
+        self._lengths[:] = 0
+        return self.sim.reset()
+
+    def step_async(self, actions):
+        self._actions = actions
+
+    def step_wait(self):
+        obs, rewards, terminated, _ = self.sim.step(self._actions)
+        self._returns += rewards
+        self._lengths += 1
+        infos = [{} for _ in range(self.num_envs)]
+        if terminated.any():
+            t = round(time.time() - self._t0, 6)
+            for i in np.flatnonzero(terminated):
+                infos[i]["terminal_observation"] = obs[i].copy()
+                infos[i]["episode"] = {"r": float(self._returns[i]), "l": int(self._lengths[i]), "t": t}
+            self._returns[terminated] = 0.0
+            self._lengths[terminated] = 0
+            obs = self.sim.reset(terminated)
+        return obs, rewards, terminated, infos
+
+    def close(self):
+        pass
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self.sim, attr_name) for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self.sim, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        # The sub-environments are rows of one HighwaySurrogate: the method
+        # runs once on it and its result is returned for every index
+        result = getattr(self.sim, method_name)(*method_args, **method_kwargs)
+        return [result for _ in self._get_indices(indices)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
+
+
+class MultiAgentVecEnv(VecEnv):
+    """The agents of one SumoMultiAgentEnv as SB3 sub-environments.
+
+    A done agent is respawned in the running simulation; when the shared
+    episode ends (max_steps, SUMO crash) the whole simulation is reset. Info
+    dicts carry "terminal_observation" and Monitor-style "episode" entries.
+    Rows of agents waiting to be reinserted carry "pending": train PPO with
+    rollout_buffer_class=PendingRolloutBuffer and a PendingMaskCallback so
+    they are left out of the updates.
+    """
+
+    def __init__(self, n_agents=4, **env_kwargs):
+        self.env = SumoMultiAgentEnv(n_agents=n_agents, **env_kwargs)
+        super().__init__(n_agents, self.env.observation_space, self.env.action_space)
+        self._actions = None
+        self._returns = np.zeros(n_agents)
+        self._lengths = np.zeros(n_agents, dtype=np.int64)
+        self._t0 = time.time()
+
+    def reset(self):
+        seed = self._seeds[0] if self._seeds else None
+        self._reset_seeds()
+        self._returns[:] = 0.0
+        self._lengths[:] = 0
+        obs, _ = self.env.reset(seed=seed)
+        return obs
+
+    def step_async(self, actions):
+        self._actions = actions
+
+    def step_wait(self):
+        obs, rewards, terminated, truncated, infos = self.env.step(self._actions)
+        dones = terminated | truncated
+        pending = np.array(["pending" in info for info in infos])
+        self._returns += rewards
+        self._lengths += ~pending
+        if dones.any():
+            t = round(time.time() - self._t0, 6)
+            for i in np.flatnonzero(dones):
+                infos[i]["terminal_observation"] = obs[i].copy()
+                infos[i]["TimeLimit.truncated"] = bool(truncated[i])
+                if not pending[i]:
+                    infos[i]["episode"] = {"r": float(self._returns[i]), "l": int(self._lengths[i]), "t": t}
+            self._returns[dones] = 0.0
+            self._lengths[dones] = 0
+            if dones.all():
+                obs, _ = self.env.reset()
+            else:
+                for i in np.flatnonzero(dones):
+                    obs[i] = self.env.respawn(i)
+        return obs, rewards.astype(np.float32), dones, infos
+
+    def close(self):
+        self.env.close()
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self.env, attr_name) for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self.env, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        # All agents share one SumoMultiAgentEnv: the method runs once on it
+        # and its result is returned for every index
+        result = getattr(self.env, method_name)(*method_args, **method_kwargs)
+        return [result for _ in self._get_indices(indices)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
+
+
+class PendingRolloutBuffer(RolloutBuffer):
+    """RolloutBuffer whose minibatches skip the rows PendingMaskCallback masked.
+
+    Returns and advantages are computed over every row as usual: the row
+    before a pending one is always terminal, so nothing bootstraps from it.
+    """
+
+    def reset(self):
+        super().reset()
+        self.valid = np.ones((self.buffer_size, self.n_envs), dtype=bool)
+
+    def get(self, batch_size=None):
+        assert self.full, ""
+        if not self.generator_ready:
+            for tensor in ("observations", "actions", "values", "log_probs", "advantages", "returns"):
+                self.__dict__[tensor] = self.swap_and_flatten(self.__dict__[tensor])
+            self.generator_ready = True
+        # Flattened like the tensors: env-major
+        indices = np.random.permutation(np.flatnonzero(self.valid.T))
+        if batch_size is None:
+            batch_size = len(indices)
+        for start in range(0, len(indices), batch_size):
+            yield self._get_samples(indices[start:start + batch_size])
+
+
+class PendingMaskCallback(BaseCallback):
+    """Masks in a PendingRolloutBuffer the rows whose info is "pending"."""
+
+    def _on_step(self):
+        buffer = self.model.rollout_buffer
+        # Called between env.step() and rollout_buffer.add(): the row is buffer.pos
+        buffer.valid[buffer.pos] = ["pending" not in info for info in self.locals["infos"]]
+        return True